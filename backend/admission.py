@@ -0,0 +1,355 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+# LOCAL IMPORTS
+import metrics
+
+# ==========================
+# ADMISSION CONTROL (load shedding)
+# ==========================
+# When the Wi-Fi comes back every tablet retries at once. Two gates sit in
+# front of the routes so that burst can't starve order placement:
+#
+# 1. Token buckets per client per route: `rate` requests/s with `burst`
+#    headroom. Empty bucket -> 429 + Retry-After (time until a token).
+#    Every request draws from its IP address's bucket (a restaurant's
+#    devices usually share one NAT address, so it gets SHARED_IP_FACTOR x
+#    the budget), and then from its own: the X-Device-Id header, else the
+#    table id in the path / query. Headers are the client's to pick, so
+#    they only ever narrow the budget; a device refused at the IP bucket
+#    never gets a bucket of its own.
+#
+# 2. A concurrency limit on Mongo-bound routes: ADMISSION_MAX_CONCURRENT
+#    requests in flight, of which each priority class may fill a share:
+#
+#      critical - guest / staff writes (place order, settle, status, login)
+#      normal   - everything not listed
+#      poll     - dashboard / tablet polling reads
+#
+#    A request over its class's share waits up to the class's `wait_ms` for
+#    a slot (critical first when one frees up), then gets 503 + Retry-After.
+#    Polls don't wait: under load they are shed at once.
+#
+#    Polls also draw from one server-wide token bucket whose rate adapts
+#    (AIMD) every LOOP_PROBE_SECONDS: it halves while critical requests run
+#    slower than LATENCY_TOLERANCE x their route's recent best, or while
+#    the event loop runs more than LOOP_LAG_LIMIT_MS late (requests queue
+#    there before any middleware can time them); otherwise it grows by
+#    POLL_RATE_STEP a tick while polls are being turned away. A slot count
+#    alone can't tell how much work the database or the process has to
+#    spare - one slot reused back to back can keep either busy - but order
+#    placement latency can.
+#
+# Routes served from memory (menu snapshot, table registry) skip gate 2.
+# Per-route overrides: ADMISSION_LIMITS='{"GET /api/orders": {"rate": 1, "burst": 5}}'
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "40"))
+SHARED_IP_FACTOR = int(os.getenv("ADMISSION_SHARED_IP_FACTOR", "20"))
+MAX_TRACKED_CLIENTS = 10000
+
+# class -> (share of ADMISSION_MAX_CONCURRENT, max wait for a slot in ms)
+PRIORITY_CLASSES = {
+    "critical": (1.0, 2000),
+    "normal": (0.8, 250),
+    "poll": (0.5, 0),
+}
+PRIORITY_ORDER = ["critical", "normal", "poll"]
+LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "2"))
+LATENCY_SLACK_SECONDS = 0.005  # Jitter below this is never a sign of overload
+FLOOR_DRIFT = 1.005            # Per sample, so a stale best time is slowly forgotten
+LOOP_LAG_LIMIT_MS = float(os.getenv("ADMISSION_LOOP_LAG_MS", "50"))
+LOOP_PROBE_SECONDS = 0.1
+POLL_RATE_MAX = float(os.getenv("ADMISSION_POLL_RATE", "200"))  # Mongo-bound polls/s, whole server
+POLL_RATE_MIN = 1.0
+POLL_RATE_STEP = 1.0  # Per healthy tick
+POLL_BURST_SECONDS = 1.0
+SMOOTHING = 0.3  # EWMA weight of the newest sample, so one blip doesn't shed anything
+
+
+class RoutePolicy:
+    __slots__ = ("priority", "rate", "burst", "mongo")
+
+    def __init__(self, priority: str = "normal", rate: float = 5, burst: float = 20, mongo: bool = True):
+        self.priority = priority
+        self.rate = rate
+        self.burst = burst
+        self.mongo = mongo  # Counts against the concurrency limit
+
+
+# (method, route template) -> policy
+ROUTE_POLICIES: Dict[Tuple[str, str], RoutePolicy] = {
+    ("POST", "/api/orders"): RoutePolicy("critical", rate=2, burst=10),
+    ("PATCH", "/api/orders/{order_id}/status"): RoutePolicy("critical", rate=10, burst=40),
+    ("POST", "/api/orders/bulk-status"): RoutePolicy("critical", rate=2, burst=10),
+    ("POST", "/api/tables/{table_id}/settle"): RoutePolicy("critical", rate=1, burst=5),
+    ("POST", "/api/users/login"): RoutePolicy("critical", rate=1, burst=5),
+    ("GET", "/api/orders"): RoutePolicy("poll", rate=2, burst=10),
+    ("GET", "/api/kitchen/eta"): RoutePolicy("poll", rate=1, burst=5),
+    ("GET", "/api/analytics/summary"): RoutePolicy("poll", rate=1, burst=5),
+    ("GET", "/api/analytics/daily"): RoutePolicy("poll", rate=1, burst=5),
+    # Long streams: a few per device, and each holds a slot while it runs
+    ("GET", "/api/orders/export"): RoutePolicy("normal", rate=0.1, burst=3),
+    # In-memory reads: rate limited only
+    ("GET", "/api/menu"): RoutePolicy("poll", rate=1, burst=10, mongo=False),
+    ("GET", "/api/menu/search"): RoutePolicy("poll", rate=5, burst=20, mongo=False),
+    ("GET", "/api/menu/recommendations"): RoutePolicy("poll", rate=2, burst=10, mongo=False),
+    ("GET", "/api/tables/{table_id}/session"): RoutePolicy("poll", rate=2, burst=10, mongo=False),
+    ("GET", "/api/tables"): RoutePolicy("poll", rate=2, burst=10, mongo=False),
+}
+DEFAULT_POLICY = RoutePolicy()
+EXEMPT_ROUTES = {"/", "/health/ready", "/metrics", "/api/events/stream"}  # WebSockets never reach admission
+
+
+def _load_overrides():
+    raw = os.getenv("ADMISSION_LIMITS")
+    if not raw:
+        return
+    for key, fields in json.loads(raw).items():
+        method, route = key.split(" ", 1)
+        policy = ROUTE_POLICIES.get((method, route), RoutePolicy())
+        ROUTE_POLICIES[(method, route)] = RoutePolicy(
+            fields.get("priority", policy.priority), fields.get("rate", policy.rate),
+            fields.get("burst", policy.burst), fields.get("mongo", policy.mongo),
+        )
+
+
+_load_overrides()
+
+
+# --- Gate 1: token buckets ---
+class TokenBuckets:
+    def __init__(self, capacity: int = MAX_TRACKED_CLIENTS):
+        self.capacity = capacity
+        self._buckets: "OrderedDict[tuple, list]" = OrderedDict()  # key -> [tokens, last refill]
+
+    def take(self, key: tuple, rate: float, burst: float) -> float:
+        """0 if admitted, else seconds until a token is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+            if len(self._buckets) > self.capacity:
+                self._buckets.popitem(last=False)  # Least recently seen client
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+
+# --- Gate 2: prioritized concurrency limit ---
+def _ewma(previous: float, sample: float) -> float:
+    return previous + SMOOTHING * (sample - previous)
+
+
+class ConcurrencyGate:
+    def __init__(self, limit: int = ADMISSION_MAX_CONCURRENT):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters: Dict[str, deque] = {name: deque() for name in PRIORITY_ORDER}
+        # Adaptive server-wide poll rate (a token bucket), and the signals it follows
+        self.poll_rate = POLL_RATE_MAX
+        self._poll_tokens = POLL_RATE_MAX * POLL_BURST_SECONDS
+        self._poll_stamp = time.monotonic()
+        self._poll_refused = False           # Since the last tick; only a rate in use grows
+        self.loop_lag_ms = 0.0               # Smoothed
+        self.critical_slowness = 0.0         # Smoothed latency / allowed latency (> 1 = overloaded)
+        self._critical_seen = False          # Since the last tick
+        self._floors: Dict[str, float] = {}  # Critical route -> recent best latency
+        self._probe: Optional[asyncio.Task] = None
+        metrics.admission_metrics.poll_rate = self.poll_rate
+
+    def _share(self, priority: str) -> int:
+        return max(1, int(self.limit * PRIORITY_CLASSES[priority][0]))
+
+    def _has_room(self, priority: str) -> bool:
+        return self.in_flight < self._share(priority)
+
+    def _poll_token(self) -> bool:
+        now = time.monotonic()
+        burst = max(1.0, self.poll_rate * POLL_BURST_SECONDS)
+        self._poll_tokens = min(burst, self._poll_tokens + (now - self._poll_stamp) * self.poll_rate)
+        self._poll_stamp = now
+        if self._poll_tokens < 1:
+            return False
+        self._poll_tokens -= 1
+        return True
+
+    # --- Admitting ---
+    async def acquire(self, priority: str) -> bool:
+        if priority == "poll":
+            if self._has_room(priority) and not any(self._waiters.values()) and self._poll_token():
+                self.in_flight += 1
+                return True
+            self._poll_refused = True
+            return False  # Polls never wait
+        if self._has_room(priority) and not any(self._waiters[p] for p in self._ahead_of(priority)):
+            self.in_flight += 1
+            return True
+        wait_ms = PRIORITY_CLASSES[priority][1]
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), wait_ms / 1000)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return True  # Handed a slot just as the wait ran out
+            waiter.cancel()
+            return False
+        except asyncio.CancelledError:
+            # Client went away while waiting: a slot handed over meanwhile goes back
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters[priority]:
+                self._waiters[priority].remove(waiter)
+
+    def release(self):
+        self.in_flight -= 1
+        # Hand the slot straight to the highest-priority waiter that may use it
+        for priority in PRIORITY_ORDER:
+            queue = self._waiters[priority]
+            while queue and queue[0].done():
+                queue.popleft()
+            if queue and self._has_room(priority):
+                self.in_flight += 1
+                queue.popleft().set_result(True)
+                return
+
+    @staticmethod
+    def _ahead_of(priority: str):
+        return PRIORITY_ORDER[:PRIORITY_ORDER.index(priority) + 1]
+
+    # --- Adapting the poll rate ---
+    def observe(self, route: str, seconds: float):
+        """A critical request took `seconds` from admission to its last byte"""
+        floor = self._floors.get(route)
+        floor = seconds if floor is None or seconds < floor else floor * FLOOR_DRIFT
+        self._floors[route] = floor
+        allowed = floor * LATENCY_TOLERANCE + LATENCY_SLACK_SECONDS
+        self.critical_slowness = _ewma(self.critical_slowness, seconds / allowed)
+        self._critical_seen = True
+
+    def _tick(self, lag_ms: float):
+        self.loop_lag_ms = _ewma(self.loop_lag_ms, lag_ms)
+        if not self._critical_seen:
+            self.critical_slowness = _ewma(self.critical_slowness, 0.0)  # No news: let it fade
+        self._critical_seen = False
+        if self.loop_lag_ms > LOOP_LAG_LIMIT_MS or self.critical_slowness > 1:
+            self.poll_rate = max(POLL_RATE_MIN, self.poll_rate / 2)
+        elif self._poll_refused:
+            self.poll_rate = min(POLL_RATE_MAX, self.poll_rate + POLL_RATE_STEP)
+        self._poll_refused = False
+        metrics.admission_metrics.poll_rate = self.poll_rate
+
+    async def _watch_loop(self):
+        while True:
+            due = time.perf_counter() + LOOP_PROBE_SECONDS
+            await asyncio.sleep(LOOP_PROBE_SECONDS)
+            self._tick(max(0.0, time.perf_counter() - due) * 1000)
+
+    # --- Lifecycle ---
+    async def start(self):
+        if ADMISSION_ENABLED:
+            self._probe = asyncio.create_task(self._watch_loop())
+
+    async def stop(self):
+        if self._probe:
+            self._probe.cancel()
+            try:
+                await self._probe
+            except asyncio.CancelledError:
+                pass
+            self._probe = None
+
+
+gate = ConcurrencyGate()
+
+
+# --- Middleware ---
+def _client_keys(scope, route: str) -> List[Tuple[str, int]]:
+    """[(client id, budget multiplier)]: the IP address, then the device or table if named"""
+    client = scope.get("client")
+    keys = [("ip:" + (client[0] if client else "unknown"), SHARED_IP_FACTOR)]
+    for name, value in scope.get("headers") or ():
+        if name == b"x-device-id" and value:
+            return keys + [("device:" + value.decode("latin-1")[:64], 1)]
+    table = None
+    if "{table_id}" in route:
+        table = scope["path"].split("/")[3]  # /api/tables/{table_id}/... (not routed yet, no path_params)
+    else:
+        for part in (scope.get("query_string") or b"").decode("latin-1").split("&"):
+            if part.startswith("tableId="):
+                table = part[8:]
+    if table:
+        keys.append((f"table:{table}", 1))
+    return keys
+
+
+async def _reject(send, status: int, retry_after: float, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """Pure ASGI; runs inside MetricsMiddleware so rejections are counted per route"""
+
+    def __init__(self, app):
+        self.app = app
+        self.buckets = TokenBuckets()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+
+        stats = metrics.current_request.get()
+        route = stats.route if stats else metrics.MetricsMiddleware._route(scope)
+        if route in EXEMPT_ROUTES:
+            return await self.app(scope, receive, send)
+        policy = ROUTE_POLICIES.get((scope["method"], route), DEFAULT_POLICY)
+        counts = metrics.admission_metrics.outcomes
+
+        for client, factor in _client_keys(scope, route):
+            wait = self.buckets.take((client, scope["method"], route), policy.rate * factor, policy.burst * factor)
+            if wait:
+                counts[(policy.priority, "throttled")] += 1
+                return await _reject(send, 429, wait, "Too many requests, slow down")
+
+        if not policy.mongo:
+            counts[(policy.priority, "admitted")] += 1
+            return await self.app(scope, receive, send)
+
+        if not await gate.acquire(policy.priority):
+            counts[(policy.priority, "shed")] += 1
+            return await _reject(send, 503, 1, "Server busy, retry shortly")
+        counts[(policy.priority, "admitted")] += 1
+        metrics.admission_metrics.in_flight = gate.in_flight
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+            if policy.priority == "critical":
+                gate.observe(route, time.perf_counter() - start)
+            metrics.admission_metrics.in_flight = gate.in_flight
@@ -0,0 +1,190 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# LOCAL IMPORTS
+from database import db
+from archive import order_archive
+
+# ==========================
+# SALES ROLLUPS
+# ==========================
+# One document per business day in `daily_rollups`:
+#   {_id: "2026-10-17", revenue, orders,
+#    hours: {"13": {revenue, orders}}, items: {"Beef Fry": qty}}
+# settle_table folds the orders it just marked paid into these with $inc, so
+# analytics reads cost O(days in range), never O(orders). It does so from
+# the job queue, which may retry: each day lists the settlement revisions
+# already counted (`settled`) and a revision is only ever added once.
+# Startup loads existing history when `daily_rollups` is empty (first run
+# after upgrading); `python analytics.py --backfill` reloads it by hand.
+
+
+def _item_key(name: str) -> str:
+    # Field names can't contain '.' or start with '$'
+    return (name or "Unknown").replace(".", "．").replace("$", "＄")
+
+
+def _item_name(key: str) -> str:
+    return key.replace("．", ".").replace("＄", "$")
+
+
+def _rollup_increments(orders: list, settled_at: datetime) -> dict:
+    """$inc document for a batch of orders paid at `settled_at`"""
+    hour = f"hours.{settled_at.hour:02d}"
+    inc = defaultdict(float)
+    for order in orders:
+        amount = order.get("totalAmount") or 0
+        inc["revenue"] += amount
+        inc["orders"] += 1
+        inc[f"{hour}.revenue"] += amount
+        inc[f"{hour}.orders"] += 1
+        for item in order.get("items", []):
+            inc[f"items.{_item_key(item.get('name'))}"] += item.get("quantity", 0)
+    return dict(inc)
+
+
+async def record_settlement(table_id: int, revision: int, settled_at: Optional[datetime] = None):
+    """Fold the orders settle_table just marked paid (same revision) into today's rollup"""
+    settled_at = settled_at or datetime.now()
+    orders = await db.orders.find(
+        {"tableId": table_id, "status": "paid", "revision": revision},
+        {"totalAmount": 1, "items.name": 1, "items.quantity": 1},
+    ).to_list(None)
+    if not orders:
+        return
+    try:
+        await db.daily_rollups.update_one(
+            {"_id": settled_at.date().isoformat(), "settled": {"$ne": revision}},
+            {"$inc": _rollup_increments(orders, settled_at), "$push": {"settled": revision}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        pass  # The day already counts this revision (retried job): upsert hit the existing _id
+
+
+async def summary(start: Optional[str] = None, end: Optional[str] = None, top: int = 5) -> dict:
+    """Totals + best sellers across [start, end] (inclusive ISO dates, open-ended if omitted)"""
+    day_filter = {}
+    if start:
+        day_filter["$gte"] = start
+    if end:
+        day_filter["$lte"] = end
+    query = {"_id": day_filter} if day_filter else {}
+
+    revenue, order_count = 0.0, 0
+    item_totals = defaultdict(int)
+    async for day in db.daily_rollups.find(query, {"revenue": 1, "orders": 1, "items": 1}):
+        revenue += day.get("revenue", 0)
+        order_count += int(day.get("orders", 0))
+        for key, qty in (day.get("items") or {}).items():
+            item_totals[key] += qty
+
+    best_sellers = sorted(item_totals.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    return {
+        "start": start,
+        "end": end,
+        "revenue": round(revenue, 2),
+        "orders": order_count,
+        "averageOrderValue": round(revenue / order_count, 2) if order_count else 0,
+        "bestSellers": [{"name": _item_name(k), "quantity": int(v)} for k, v in best_sellers],
+    }
+
+
+async def daily(start: Optional[str] = None, end: Optional[str] = None) -> list:
+    day_filter = {}
+    if start:
+        day_filter["$gte"] = start
+    if end:
+        day_filter["$lte"] = end
+    query = {"_id": day_filter} if day_filter else {}
+    days = await db.daily_rollups.find(query, {"settled": 0}).sort("_id", 1).to_list(None)
+    return [
+        {
+            "date": d["_id"],
+            "revenue": round(d.get("revenue", 0), 2),
+            "orders": int(d.get("orders", 0)),
+            "hours": {h: {"revenue": round(v.get("revenue", 0), 2), "orders": int(v.get("orders", 0))}
+                      for h, v in sorted((d.get("hours") or {}).items())},
+            "items": {_item_name(k): int(v) for k, v in (d.get("items") or {}).items()},
+        }
+        for d in days
+    ]
+
+
+# --- BACKFILL (one-shot, replaces rollups with what the orders say) ---
+# Paid orders are bucketed by when they were settled (updatedAt), falling
+# back to createdAt for orders written before revisions existed. Reads the
+# live collection and every monthly archive.
+_PAID_AT = {"$ifNull": ["$updatedAt", "$createdAt"]}
+
+
+async def _backfill_from(collection, days: dict):
+    by_hour = collection.aggregate([
+        {"$match": {"status": "paid"}},
+        {"$group": {
+            "_id": {"day": {"$substrBytes": [_PAID_AT, 0, 10]}, "hour": {"$substrBytes": [_PAID_AT, 11, 2]}},
+            "revenue": {"$sum": {"$ifNull": ["$totalAmount", 0]}},
+            "orders": {"$sum": 1},
+        }},
+    ], allowDiskUse=True)
+    async for row in by_hour:
+        day = days[row["_id"]["day"]]
+        day["revenue"] += row["revenue"]
+        day["orders"] += row["orders"]
+        # The same hour can come from the live and an archive collection
+        hour = day["hours"].setdefault(row["_id"]["hour"], {"revenue": 0.0, "orders": 0})
+        hour["revenue"] += row["revenue"]
+        hour["orders"] += row["orders"]
+
+    by_item = collection.aggregate([
+        {"$match": {"status": "paid"}},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"day": {"$substrBytes": [_PAID_AT, 0, 10]}, "name": "$items.name"},
+            "quantity": {"$sum": "$items.quantity"},
+        }},
+    ], allowDiskUse=True)
+    async for row in by_item:
+        day = days[row["_id"]["day"]]
+        key = _item_key(row["_id"]["name"])
+        day["items"][key] = day["items"].get(key, 0) + row["quantity"]
+
+
+async def backfill() -> int:
+    days = defaultdict(lambda: {"revenue": 0.0, "orders": 0, "hours": {}, "items": {}})
+
+    await order_archive.load()
+    for collection in order_archive.collections():
+        await _backfill_from(collection, days)
+
+    if days:
+        await db.daily_rollups.bulk_write(
+            # $set, not a replace: `settled` must keep the revisions already counted
+            [UpdateOne({"_id": d}, {"$set": doc}, upsert=True) for d, doc in days.items()], ordered=False
+        )
+    return len(days)
+
+
+async def backfill_if_empty() -> int:
+    """Backfill once: only while no rollup exists yet; returns the days written"""
+    if await db.daily_rollups.find_one({}, {"_id": 1}):
+        return 0
+    days = await backfill()
+    if days:
+        print(f"📊 BACKFILLED {days} DAYS of sales rollups")
+    return days
+
+
+if __name__ == "__main__":
+    import sys
+    import database
+
+    database.connect()
+
+    if "--backfill" in sys.argv:
+        print(f"📊 BACKFILLED {asyncio.run(backfill())} DAYS")
@@ -0,0 +1,234 @@
+import asyncio
+import heapq
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo import ASCENDING, IndexModel, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+# LOCAL IMPORTS
+from bus import RESYNC, bus
+from coalesce import coalescer
+from database import db
+from indexes import ACTIVE_EXCLUDED
+
+# ==========================
+# ORDER ARCHIVE (hot / cold split)
+# ==========================
+# `orders` only holds what's in service. A sweeper moves paid / cancelled
+# orders, once they are ARCHIVE_GRACE_SECONDS old, into one collection per
+# month of `createdAt`:  orders_archive_2026_10, orders_archive_2026_11, ...
+#
+# Moving is copy-then-delete and idempotent: copies keep their _id and
+# replace an archived copy only if theirs is not an older revision, so a
+# re-run after a crash overwrites the stale copy it left instead of keeping
+# it and deleting the newer live order. The grace period lets delta
+# sync clients see the final "paid" revision before the order leaves
+# `orders`. `horizon` is the highest revision archived so far; a client
+# resuming from an older cursor may have missed a removal, so get_orders
+# sends it a fresh snapshot instead.
+#
+# History reads (date ranges, paid listings, analytics backfill, lookups by
+# id) go through `find()` / `find_by_id()`, which span `orders` plus the
+# month collections the query can touch.
+#
+# Existing data: `python archive.py --migrate` (no grace period).
+
+ARCHIVE_PREFIX = "orders_archive_"
+ARCHIVED_STATUSES = ACTIVE_EXCLUDED
+ARCHIVE_GRACE_SECONDS = int(os.getenv("ARCHIVE_GRACE_SECONDS", "600"))
+ARCHIVE_SWEEP_SECONDS = int(os.getenv("ARCHIVE_SWEEP_SECONDS", "60"))
+ARCHIVE_BATCH = 500
+
+ARCHIVE_INDEXES = [
+    IndexModel([("createdAt", ASCENDING), ("_id", ASCENDING)], name="created_at"),
+    IndexModel([("status", ASCENDING), ("revision", ASCENDING)], name="status_revision"),
+    IndexModel([("tableId", ASCENDING), ("revision", ASCENDING)], name="table_revision"),
+    IndexModel([("idempotencyKeys", ASCENDING)], name="idempotency_keys", sparse=True),
+]
+
+
+def month_of(order: dict) -> str:
+    """'YYYY_MM' bucket: createdAt, or the ObjectId timestamp for legacy docs"""
+    created = order.get("createdAt")
+    if isinstance(created, str) and len(created) >= 7:
+        return created[:7].replace("-", "_")
+    return order["_id"].generation_time.strftime("%Y_%m")
+
+
+def _month_key(iso_date: Optional[str]) -> Optional[str]:
+    return iso_date[:7].replace("-", "_") if iso_date else None
+
+
+class OrderArchive:
+    def __init__(self):
+        self.months: List[str] = []  # Sorted 'YYYY_MM' buckets that exist
+        self.horizon = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def collection(self, month: str):
+        return db[f"{ARCHIVE_PREFIX}{month}"]
+
+    async def load(self):
+        names = await db.list_collection_names(filter={"name": {"$regex": f"^{ARCHIVE_PREFIX}"}})
+        self.months = sorted(name[len(ARCHIVE_PREFIX):] for name in names)
+        state = await db.counters.find_one({"_id": "orders_archive"})
+        self.horizon = max(self.horizon, (state or {}).get("revision", 0))
+
+    # --- Moving ---
+    async def sweep(self, grace_seconds: int = ARCHIVE_GRACE_SECONDS) -> int:
+        """Archive every terminal order older than the grace period; returns how many moved"""
+        cutoff = (datetime.now() - timedelta(seconds=grace_seconds)).isoformat()
+        query = {
+            "status": {"$in": ARCHIVED_STATUSES},
+            "$or": [{"updatedAt": {"$lt": cutoff}}, {"updatedAt": {"$exists": False}}],
+        }
+        moved = 0
+        while True:
+            batch = await db.orders.find(query).sort("_id", ASCENDING).limit(ARCHIVE_BATCH).to_list(ARCHIVE_BATCH)
+            if not batch:
+                break
+            await self._move(batch)
+            moved += len(batch)
+            if len(batch) < ARCHIVE_BATCH:
+                break
+        await self.load()
+        return moved
+
+    async def _move(self, batch: list):
+        by_month = {}
+        for order in batch:
+            by_month.setdefault(month_of(order), []).append(order)
+
+        for month, orders in by_month.items():
+            if month not in self.months:
+                await self.collection(month).create_indexes(ARCHIVE_INDEXES)
+            copies = [
+                ReplaceOne(
+                    {"_id": order["_id"], "$or": [{"revision": {"$lte": order.get("revision") or 0}},
+                                                   {"revision": None}]},
+                    order, upsert=True,
+                )
+                for order in orders
+            ]
+            try:
+                await self.collection(month).bulk_write(copies, ordered=False)
+            except BulkWriteError as e:
+                # A newer copy is already there (another worker got further): its upsert hit the _id
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+
+        # Publish the horizon before the documents disappear from `orders`
+        top = max(order.get("revision") or 0 for order in batch)
+        state = await db.counters.find_one_and_update(
+            {"_id": "orders_archive"}, {"$max": {"revision": top}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        self.horizon = max(self.horizon, state.get("revision", 0))
+        self.months = sorted(set(self.months) | set(by_month))
+        bus.publish(ARCHIVE_MOVED, {"horizon": self.horizon, "months": sorted(by_month)})
+
+        # Only delete the version we copied (skip anything written since)
+        await db.orders.delete_many({"$or": [
+            {"_id": order["_id"], "revision": order.get("revision")} for order in batch
+        ]})
+        coalescer.touch("orders")
+
+    # --- Background sweeper ---
+    async def start(self):
+        await self.load()
+        self._sweeper = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(ARCHIVE_SWEEP_SECONDS)
+            try:
+                moved = await self.sweep()
+                if moved:
+                    print(f"🗄️  ARCHIVED {moved} settled orders")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Archive sweep failed: {e}")
+
+    # --- Reading history ---
+    def months_for(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        low, high = _month_key(start), _month_key(end)
+        return [m for m in self.months if (not low or m >= low) and (not high or m <= high)]
+
+    async def find(self, query: dict, projection: Optional[dict] = None, sort: Optional[list] = None,
+                   limit: int = 1000, start: Optional[str] = None, end: Optional[str] = None) -> list:
+        """`orders.find()` over live + archived orders (archive months limited to [start, end])"""
+        collections = [db.orders] + [self.collection(m) for m in self.months_for(start, end)]
+        if sort and len(sort) == 1:
+            field, direction = sort[0]
+            # Newest-first reads (recent paid): stop once the newer buckets fill the page
+            if direction < 0:
+                collections = [db.orders] + collections[:0:-1]
+            results = []
+            for i, collection in enumerate(collections):
+                results.append(await collection.find(query, projection).sort(sort).limit(limit).to_list(limit))
+                if direction < 0 and i and sum(map(len, results)) >= limit:
+                    break
+            merged = heapq.merge(*results, key=lambda d: (d.get(field) is not None, d.get(field)),
+                                 reverse=direction < 0)
+            return list(merged)[:limit]
+
+        results = []
+        for collection in collections:
+            remaining = limit - len(results)
+            if remaining <= 0:
+                break
+            results += await collection.find(query, projection).limit(remaining).to_list(remaining)
+        return results
+
+    async def find_by_id(self, oid) -> Optional[dict]:
+        order = await db.orders.find_one({"_id": oid})
+        if order:
+            return order
+        # Usually in the month the id was minted; scan the rest for legacy docs
+        home = oid.generation_time.strftime("%Y_%m")
+        for month in sorted(self.months, key=lambda m: m != home):
+            order = await self.collection(month).find_one({"_id": oid})
+            if order:
+                return order
+        return None
+
+    def collections(self) -> list:
+        return [db.orders] + [self.collection(m) for m in self.months]
+
+    def _moved_elsewhere(self, message: dict):
+        """Another worker archived a batch: same horizon, new months readable here"""
+        self.horizon = max(self.horizon, message.get("horizon", 0))
+        self.months = sorted(set(self.months) | set(message.get("months", ())))
+
+
+ARCHIVE_MOVED = "archive.moved"
+
+order_archive = OrderArchive()
+bus.subscribe(ARCHIVE_MOVED, order_archive._moved_elsewhere)
+bus.subscribe(RESYNC, lambda _: order_archive.load())
+
+
+if __name__ == "__main__":
+    import sys
+    import database
+
+    database.connect()
+
+    if "--migrate" in sys.argv:
+        async def migrate():
+            await order_archive.load()
+            moved = await order_archive.sweep(grace_seconds=0)
+            print(f"🗄️  MIGRATED {moved} settled orders into {len(order_archive.months)} monthly archives")
+        asyncio.run(migrate())
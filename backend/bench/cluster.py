@@ -0,0 +1,200 @@
+"""
+Multi-worker coherence check: a write on one worker must show up on all the
+others within a bounded time.
+
+    cd backend
+    pip install -r bench/requirements.txt
+    python -m bench.cluster --mongo-url mongodb://localhost:27017
+    python -m bench.cluster --workers 4 --bound 0.5 --rounds 10
+
+Starts N single-worker uvicorn processes on consecutive ports, all with the
+cluster bus on and against one throwaway database (the same coherence path
+as `serve.py --workers N`, but each worker is addressable). Then, for each
+round, on worker 0:
+
+    menu toggle  -> every other worker's GET /api/menu and search reflect it
+    place order  -> every other worker's table session is active, and an SSE
+                    subscriber on each other worker gets order.created
+    settle table -> every other worker's table session is inactive
+
+Reports the worst propagation time per check and exits 1 if any exceeds
+--bound seconds. Needs a real mongod: the in-process stand-in used by
+bench.load has no tailable cursors.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLL_SECONDS = 0.01
+
+
+def start_worker(port: int, args) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "MONGO_URL": args.mongo_url,
+        "MONGO_DB": args.db_name,
+        "CLUSTER_BUS": "1",
+        "EVENT_SOURCE": "local",  # Events travel over the bus, not a change stream
+        "ADMISSION_ENABLED": "0",  # The checker polls every 10ms from one address
+        "MONGO_MIN_POOL_SIZE": "2",
+        "OUTBOX_PATH": args.journal,  # One journal for the host, as under serve.py
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, base: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            r = await client.get(f"{base}/health/ready")
+            if r.status_code == 200 and r.json()["clusterBus"]["running"]:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{base} not ready after {timeout}s")
+
+
+async def until(check, bound: float) -> float:
+    """Seconds until `check()` is true (inf if it never is within 10x bound)"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < bound * 10:
+        if await check():
+            return time.perf_counter() - start
+        await asyncio.sleep(POLL_SECONDS)
+    return float("inf")
+
+
+async def first_event(client: httpx.AsyncClient, base: str, table_id: int, event_type: str,
+                      subscribed: asyncio.Event) -> float:
+    """Open an SSE stream for one table; returns when `event_type` arrived (perf_counter)"""
+    async with client.stream("GET", f"{base}/api/events/stream", params={"tableId": table_id},
+                             timeout=None) as response:
+        subscribed.set()
+        async for line in response.aiter_lines():
+            if line.startswith("data:") and json.loads(line[5:]).get("type") == event_type:
+                return time.perf_counter()
+    return float("inf")
+
+
+async def run_round(client, bases, table_id, args, results):
+    home, others = bases[0], bases[1:]
+
+    # --- Menu toggle ---
+    menu = (await client.get(f"{home}/api/menu")).json()
+    item = menu[0]
+    target = not item.get("isAvailable", True)
+    await client.patch(f"{home}/api/menu/{item['id']}/toggle")
+
+    async def menu_flipped(base):
+        items = (await client.get(f"{base}/api/menu")).json()
+        return any(i["id"] == item["id"] and i.get("isAvailable", True) == target for i in items)
+
+    async def search_flipped(base):
+        hits = (await client.get(f"{base}/api/menu/search", params={"q": item["name"]})).json()
+        return any(h["id"] == item["id"] and h.get("isAvailable", True) == target for h in hits)
+
+    results["menu"] += await asyncio.gather(*(until(lambda b=b: menu_flipped(b), args.bound) for b in others))
+    results["search"] += await asyncio.gather(*(until(lambda b=b: search_flipped(b), args.bound) for b in others))
+    await client.patch(f"{home}/api/menu/{item['id']}/toggle")  # Put it back
+
+    # --- Order: table sessions + SSE ---
+    ready = [asyncio.Event() for _ in others]
+    streams = [asyncio.create_task(first_event(client, b, table_id, "order.created", r))
+               for b, r in zip(others, ready)]
+    await asyncio.gather(*(r.wait() for r in ready))
+    sent = time.perf_counter()
+    r = await client.post(f"{home}/api/orders", json={
+        "tableId": table_id, "guestName": "Cluster Check",
+        "items": [{"name": "Cluster Check Item", "price": 1, "quantity": 1}],
+    })
+    r.raise_for_status()
+
+    async def session_active(base, active):
+        return (await client.get(f"{base}/api/tables/{table_id}/session")).json()["active"] == active
+
+    results["session"] += await asyncio.gather(*(until(lambda b=b: session_active(b, True), args.bound)
+                                                 for b in others))
+    for stream in streams:
+        try:
+            received = await asyncio.wait_for(stream, args.bound * 10)
+        except asyncio.TimeoutError:
+            received = float("inf")
+        results["event"].append(received - sent)
+
+    # --- Settle ---
+    await client.post(f"{home}/api/tables/{table_id}/settle")
+    results["settle"] += await asyncio.gather(*(until(lambda b=b: session_active(b, False), args.bound)
+                                                for b in others))
+
+
+async def check(args) -> bool:
+    args.journal = os.path.join(tempfile.mkdtemp(prefix="cluster-outbox-"), "outbox.db")
+    ports = [args.port + i for i in range(args.workers)]
+    bases = [f"http://127.0.0.1:{p}" for p in ports]
+    processes = []
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            # First worker builds indexes and seeds; the rest start against a ready database
+            processes.append(start_worker(ports[0], args))
+            await wait_ready(client, bases[0])
+            processes += [start_worker(p, args) for p in ports[1:]]
+            await asyncio.gather(*(wait_ready(client, b) for b in bases[1:]))
+            print(f"🧪 {args.workers} workers up on ports {ports[0]}-{ports[-1]}")
+
+            results = {"menu": [], "search": [], "session": [], "event": [], "settle": []}
+            for i in range(args.rounds):
+                await run_round(client, bases, 900 + i, args, results)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+        if not args.keep:
+            from pymongo import MongoClient
+            MongoClient(args.mongo_url).drop_database(args.db_name)
+
+    ok = True
+    print(f"\n{'check':<10}{'samples':>8}{'p50 ms':>10}{'max ms':>10}")
+    for name, samples in results.items():
+        samples = sorted(samples)
+        worst = samples[-1]
+        ok &= worst <= args.bound
+        print(f"{name:<10}{len(samples):>8}{samples[len(samples) // 2] * 1000:>10.1f}{worst * 1000:>10.1f}"
+              f"{'' if worst <= args.bound else '  ❌ over bound'}")
+    print(f"\n{'✅ coherent' if ok else '❌ NOT coherent'} within {args.bound}s across {args.workers} workers")
+    return ok
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.getenv("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="dine_ai_cluster_check")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8100, help="first worker port")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--bound", type=float, default=1.0, help="max seconds for a change to reach every worker")
+    parser.add_argument("--keep", action="store_true", help="keep the database afterwards")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.workers < 2:
+        sys.exit("--workers must be at least 2")
+    sys.exit(0 if asyncio.run(check(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+First-order race check: parallel orders on empty tables, from several
+workers at once, must end up as ONE open ticket per table with every line.
+
+    cd backend
+    pip install -r bench/requirements.txt
+    python -m bench.first_order_race --mongo-url mongodb://localhost:27017
+    python -m bench.first_order_race --workers 4 --tables 20 --orders 16 --rounds 5
+    python -m bench.first_order_race --standin          # no mongod: in-process
+
+Starts N single-worker uvicorn processes on consecutive ports against one
+throwaway database, with the outbox off (every request writes straight to
+Mongo, as separate hosts with their own journals would). Each round takes
+--tables tables nobody has ordered at, releases --orders orders per table at
+the same instant, spread round-robin over the workers, and then checks in
+Mongo, per table:
+
+    exactly one open order       (the one_active_order_per_table index turns
+                                  the losing upserts into merges)
+    one line per order sent      (no merge lost another's items)
+    subtotal = sum of the lines  (running $inc totals stayed consistent)
+
+--standin: the same rounds inside this process against the mongomock
+stand-in, one worker. Its operations never yield, so
+bench.standin.interleave_upserts makes the upserts race: each looks for the
+open ticket, waits --gap ms while the other requests run, and inserts if it
+found none; the stand-in enforces the partial unique index. Every
+table's racers miss together and collide on the index; the round also
+reports how many inserts collided.
+
+Exits 1 on any failed table or failed request.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ACTIVE_STATUSES = ["placed", "ready", "served"]
+FIRST_TABLE = 5000
+LINE_PRICE = 10
+
+
+def start_worker(port: int, args) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "MONGO_URL": args.mongo_url,
+        "MONGO_DB": args.db_name,
+        "OUTBOX_ENABLED": "0",  # Straight to Mongo: one journal would serialize the race away
+        "ADMISSION_ENABLED": "0",  # Every order comes from this one address
+        "EVENT_SOURCE": "local",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, base: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{base}/health/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{base} not ready after {timeout}s")
+
+
+async def race(client: httpx.AsyncClient, bases: list, tables: list, orders: int) -> list:
+    """Every order for every table released at once; returns the failed responses"""
+    go = asyncio.Event()
+    failed = []
+
+    async def place(base: str, table_id: int, i: int):
+        await go.wait()
+        r = await client.post(f"{base}/api/orders", json={
+            "tableId": table_id, "guestName": "Race Check", "totalAmount": LINE_PRICE,
+            "items": [{"name": f"race-{table_id}-{i}", "price": LINE_PRICE, "quantity": 1}],
+        })
+        if r.status_code != 200:
+            failed.append((table_id, r.status_code, r.text[:200]))
+
+    tasks = [asyncio.create_task(place(bases[(t + i) % len(bases)], table_id, i))
+             for t, table_id in enumerate(tables) for i in range(orders)]
+    await asyncio.sleep(0.1)  # Every request parked on the event
+    go.set()
+    await asyncio.gather(*tasks)
+    return failed
+
+
+async def verify(db, tables: list, orders: int) -> dict:
+    report = {"tables": len(tables), "split": 0, "lost_lines": 0, "bad_subtotal": 0}
+    for table_id in tables:
+        open_orders = await db.orders.find({"tableId": table_id, "status": {"$in": ACTIVE_STATUSES}}).to_list(None)
+        lines = {item["name"] for o in open_orders for item in o.get("items") or ()}
+        if len(open_orders) != 1:
+            report["split"] += 1
+        report["lost_lines"] += orders - len(lines)
+        if any(o.get("subtotal") != LINE_PRICE * len(o.get("items") or ()) for o in open_orders):
+            report["bad_subtotal"] += 1
+    return report
+
+
+async def rounds(client: httpx.AsyncClient, bases: list, db, args, collisions=None) -> bool:
+    ok = True
+    for round_no in range(args.rounds):
+        tables = [FIRST_TABLE + round_no * args.tables + t for t in range(args.tables)]
+        collided = collisions and collisions["collisions"]
+        started = time.perf_counter()
+        failed = await race(client, bases, tables, args.orders)
+        elapsed = time.perf_counter() - started
+        report = await verify(db, tables, args.orders)
+        passed = not failed and not (report["split"] or report["lost_lines"] or report["bad_subtotal"])
+        ok = ok and passed
+        raced = f", insert collisions {collisions['collisions'] - collided}" if collisions else ""
+        print(f"{'✅' if passed else '❌'} round {round_no + 1}: {elapsed * 1000:.0f}ms, "
+              f"split tickets {report['split']}, lost lines {report['lost_lines']}, "
+              f"bad subtotals {report['bad_subtotal']}, failed requests {len(failed)}{raced}")
+        for table_id, status_code, text in failed[:5]:
+            print(f"   table {table_id}: {status_code} {text}")
+    return ok
+
+
+async def run(args) -> bool:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    mongo = AsyncIOMotorClient(args.mongo_url)
+    await mongo.drop_database(args.db_name)
+    db = mongo[args.db_name]
+    ports = [args.port + i for i in range(args.workers)]
+    bases = [f"http://127.0.0.1:{port}" for port in ports]
+    workers = [start_worker(port, args) for port in ports]
+    ok = False
+    try:
+        limits = httpx.Limits(max_connections=args.tables * args.orders)
+        async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+            await asyncio.gather(*(wait_ready(client, base) for base in bases))
+            if "one_active_order_per_table" not in await db.orders.index_information():
+                print("❌ one_active_order_per_table is missing (MongoDB < 6.0?): expect split tickets")
+            print(f"🏁 {args.workers} workers, {args.tables} tables x {args.orders} parallel first orders per round")
+            ok = await rounds(client, bases, db, args)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait(timeout=10)
+        if not args.keep:
+            await mongo.drop_database(args.db_name)
+    return ok
+
+
+async def run_standin(args) -> bool:
+    from bench.load import install_database
+    from bench.standin import interleave_upserts
+
+    install_database("", args.db_name)
+    import admission
+    from database import db
+    from main import app
+
+    admission.ADMISSION_ENABLED = False  # Every order comes from this one process
+    collisions = interleave_upserts(args.gap / 1000)
+    async with app.router.lifespan_context(app):
+        if "one_active_order_per_table" not in await db.orders.index_information():
+            print("❌ one_active_order_per_table is missing: expect split tickets")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://standin", timeout=30) as client:
+            print(f"🏁 stand-in, {args.tables} tables x {args.orders} parallel first orders per round, "
+                  f"{args.gap:g}ms between match and write")
+            ok = await rounds(client, ["http://standin"], db, args, collisions)
+    print(f"   upserts {collisions['upserts']}, inserts {collisions['inserts']}, "
+          f"collisions {collisions['collisions']}")
+    return ok and collisions["collisions"] > 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.getenv("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="dine_ai_race_check")
+    parser.add_argument("--standin", action="store_true", help="in-process mongomock with interleaved upserts")
+    parser.add_argument("--gap", type=float, default=5, help="--standin: ms between an upsert's match and write")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--tables", type=int, default=10, help="empty tables raced per round")
+    parser.add_argument("--orders", type=int, default=12, help="parallel first orders per table")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8300)
+    parser.add_argument("--keep", action="store_true", help="keep the database afterwards")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ok = asyncio.run(run_standin(args) if args.standin else run(args))
+    print(f"\n{'✅ one ticket per table, no lines lost' if ok else '❌ first-order race lost or split orders'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
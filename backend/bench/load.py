@@ -0,0 +1,530 @@
+"""
+Load test / latency benchmark for the FastAPI backend.
+
+    cd backend
+    pip install -r bench/requirements.txt
+    python -m bench.load                                   # in-process Mongo stand-in
+    python -m bench.load --mongo-url mongodb://localhost:27017   # real local mongod
+    python -m bench.load --tables 40 --dashboards 20 --mode subscribe --duration 60
+    python -m bench.load --out run.json --compare baseline.json
+
+`main:app` runs in-process behind an ASGI transport (no sockets), against a
+throwaway database seeded with a synthetic menu, users and paid-order
+history. N tables place / merge / settle orders, the kitchen and service
+bump tickets, and M dashboards either poll (delta sync + menu ETag + guest
+session) or subscribe to the event hub.
+
+Reported per route: p50 / p95 / p99 latency, throughput, errors and Mongo
+operations (per collection.method). Results are written as JSON so runs can
+be compared; --compare flags routes whose p95 regressed by more than
+--threshold percent.
+
+Every simulated actor sends its own X-Device-Id, as the frontend does, so
+admission control budgets them per device. --read-storm N then checks load
+shedding: order placement latency is measured alone, and again while N
+devices hammer the Mongo-bound reads without backing off.
+
+Orders are written straight to Mongo, as in a default deployment, so their
+Mongo operations count against place_order. --outbox routes them through
+the journal (a throwaway file per run) instead; the flusher then writes
+from the background, and those operations show under "(background)".
+bench.outbox_crash checks the journal's crash recovery.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+
+# ==========================
+# MONGO OP ACCOUNTING
+# ==========================
+# The harness labels every request with its route; collection calls made
+# while serving it are counted under that label.
+current_route = contextvars.ContextVar("current_route", default="(background)")
+mongo_ops = defaultdict(lambda: defaultdict(int))
+
+_COUNTED = {
+    "find", "find_one", "insert_one", "insert_many", "update_one", "update_many",
+    "find_one_and_update", "replace_one", "delete_one", "delete_many", "count_documents",
+    "aggregate", "bulk_write", "create_indexes",
+}
+
+
+class CountingCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in _COUNTED:
+            def counted(*args, **kwargs):
+                mongo_ops[current_route.get()][f"{self._collection.name}.{name}"] += 1
+                return attr(*args, **kwargs)
+            return counted
+        return attr
+
+
+class CountingDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name])
+
+    def __getattr__(self, name):
+        attr = getattr(self._database, name)
+        if hasattr(attr, "find_one"):  # a collection
+            return CountingCollection(attr)
+        return attr
+
+
+def install_database(mongo_url: str, db_name: str):
+    """Bind `database.db` to a counting wrapper; the app lifespan then keeps it"""
+    import database
+
+    if mongo_url:
+        import motor.motor_asyncio
+        database.client = motor.motor_asyncio.AsyncIOMotorClient(mongo_url)
+    else:
+        from bench.standin import create_client
+        database.client = create_client()
+    database.DATABASE_NAME = db_name
+    database.db.bind(CountingDatabase(database.client[db_name]))
+    return database
+
+
+# ==========================
+# SEEDING (generalises seed_data / seed.cjs)
+# ==========================
+CATEGORIES = ["Starters", "Mains", "Breads/Rice", "Beverages", "Dessert"]
+TAGS = ["bestseller", "comfort", "spicy", "light", "healthy", "high_protein", "keto", "classic", "kids_friendly", "vegan"]
+ALLERGENS = ["dairy", "gluten", "soy", "treenuts", "egg"]
+
+
+def synthetic_menu(n: int, rng: random.Random) -> list:
+    return [
+        {
+            "name": f"Dish {i} {rng.choice(['Biriyani', 'Curry', 'Fry', 'Roast', 'Soda', 'Payasam'])}",
+            "description": "Synthetic benchmark dish with a realistic description length.",
+            "price": rng.randrange(40, 600, 10),
+            "category": rng.choice(CATEGORIES),
+            "image": "https://images.unsplash.com/photo-1633945274405-b6c8069047b0",
+            "spiceLevel": rng.choice(["mild", "medium", "fiery"]),
+            "isAvailable": True,
+            "dietaryType": rng.choice(["veg", "non-veg", "egg"]),
+            "tags": rng.sample(TAGS, 2),
+            "heroIngredient": rng.choice(["poultry", "red_meat", "veg", "rice", "seafood"]),
+            "allergens": rng.sample(ALLERGENS, rng.randint(0, 2)),
+            "prepTime": rng.randint(5, 30),
+            "calories": rng.randint(100, 900),
+            "stock": None,
+            "rating": round(rng.uniform(3.5, 5.0), 1),
+        }
+        for i in range(n)
+    ]
+
+
+async def seed(db, menu_size: int, users: int, history: int, tables: int, rng: random.Random):
+    for name in ("menu", "orders", "users", "counters", "daily_rollups"):
+        await db[name].delete_many({})
+
+    menu = synthetic_menu(menu_size, rng)
+    await db.menu.insert_many(menu)
+
+    await db.users.insert_many([
+        {"name": f"Guest {i}", "phone": f"9{i:09d}", "preferences": {}, "visitCount": 1,
+         "lastVisit": datetime.now().isoformat()}
+        for i in range(users)
+    ])
+
+    # Paid history, spread over the last 90 days, inserted in batches
+    start = datetime.now() - timedelta(days=90)
+    batch = []
+    for i in range(history):
+        created = start + timedelta(seconds=rng.randrange(90 * 86400))
+        items = [
+            {"menu_item_id": None, "name": m["name"], "price": m["price"], "quantity": rng.randint(1, 3),
+             "notes": "", "status": "served"}
+            for m in rng.sample(menu, rng.randint(1, 4))
+        ]
+        subtotal = sum(it["price"] * it["quantity"] for it in items)
+        batch.append({
+            "createdAt": created.isoformat(), "updatedAt": created.isoformat(), "status": "paid",
+            "tableId": rng.randint(1, tables), "items": items, "guestName": "Guest",
+            "subtotal": subtotal, "totalAmount": subtotal * 1.075, "type": "food", "revision": 0,
+        })
+        if len(batch) == 1000:
+            await db.orders.insert_many(batch)
+            batch = []
+    if batch:
+        await db.orders.insert_many(batch)
+    return menu
+
+
+# ==========================
+# WORKLOAD
+# ==========================
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.event_lag_ms = []
+
+    async def call(self, client, route: str, method: str, url: str, device: str = None, **kwargs):
+        if device:
+            kwargs["headers"] = {**kwargs.get("headers", {}), "X-Device-Id": device}
+        token = current_route.set(route)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception:
+            self.errors[route] += 1
+            return None
+        finally:
+            self.latencies[route].append((time.perf_counter() - start) * 1000)
+            current_route.reset(token)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+        return response
+
+
+async def table_loop(client, rec, table_id, menu_names, deadline, args, rng):
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(rng.expovariate(1 / args.order_interval))
+        lines = [{"name": name, "price": 100, "quantity": rng.randint(1, 3)}
+                 for name in rng.sample(menu_names, rng.randint(1, 3))]
+        await rec.call(client, "place_order", "POST", "/api/orders", device=f"table-{table_id}",
+                       json={"tableId": table_id, "items": lines, "guestName": f"Table {table_id}",
+                             "totalAmount": 100})
+        if rng.random() < args.settle_rate:
+            await rec.call(client, "settle_table", "POST", f"/api/tables/{table_id}/settle", device=f"table-{table_id}")
+
+
+async def staff_loop(client, rec, from_status, to_status, view, deadline, interval):
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(interval)
+        response = await rec.call(client, f"get_orders(status,{view})", "GET", "/api/orders", device=f"staff-{view}",
+                                  params={"status": from_status, "view": view, "limit": 20})
+        if response is None or response.status_code != 200:
+            continue
+        for order in response.json()["orders"][:5]:
+            await rec.call(client, "update_status", "PATCH", f"/api/orders/{order['id']}/status",
+                           device=f"staff-{view}", params={"status": to_status})
+
+
+async def polling_dashboard(client, rec, table_id, device, deadline, args):
+    cursor, etag, last_menu = 0, None, 0.0
+    while time.perf_counter() < deadline:
+        response = await rec.call(client, "get_orders(since)", "GET", "/api/orders", device=device,
+                                  params={"since": cursor, "view": "service"})
+        if response is not None and response.status_code == 200:
+            cursor = response.json()["cursor"]
+        await rec.call(client, "get_session", "GET", f"/api/tables/{table_id}/session", device=device)
+        if time.perf_counter() - last_menu >= args.menu_interval:
+            headers = {"If-None-Match": etag, "Accept-Encoding": "gzip"} if etag else {"Accept-Encoding": "gzip"}
+            response = await rec.call(client, "get_menu", "GET", "/api/menu", device=device, headers=headers)
+            if response is not None and response.status_code == 200:
+                etag = response.headers.get("etag")
+            last_menu = time.perf_counter()
+        await asyncio.sleep(args.poll_interval)
+
+
+async def subscribed_dashboard(rec, deadline):
+    from events import hub
+
+    sub = hub.subscribe()
+    try:
+        while time.perf_counter() < deadline:
+            event = await sub.next(timeout=max(0.01, deadline - time.perf_counter()))
+            updated = (event or {}).get("order", {}).get("updatedAt")
+            if updated:
+                lag = (datetime.now() - datetime.fromisoformat(updated)).total_seconds() * 1000
+                rec.event_lag_ms.append(lag)
+    finally:
+        hub.unsubscribe(sub)
+
+
+async def merge_race_check(client, rec, table_id: int, orders: int) -> dict:
+    """Fire concurrent orders at one table; every line must survive the merge
+
+    The stand-in runs one operation at a time, so this covers the merge path
+    only; bench.first_order_race races first orders (--standin interleaves them).
+    """
+    await rec.call(client, "settle_table", "POST", f"/api/tables/{table_id}/settle", device="race")
+    await asyncio.gather(*[
+        rec.call(client, "place_order(race)", "POST", "/api/orders", device=f"race-{i}",
+                 json={"tableId": table_id, "items": [{"name": f"race-{i}", "price": 10, "quantity": 1}],
+                       "totalAmount": 10})
+        for i in range(orders)
+    ])
+    response = await client.get(f"/api/tables/{table_id}/session")
+    order_id = response.json().get("orderId")
+    found = 0
+    if order_id:
+        order = (await client.get(f"/api/orders/{order_id}")).json()
+        found = sum(1 for item in order["items"] if item["name"].startswith("race-"))
+    return {"sent": orders, "found": found, "ok": found == orders}
+
+
+async def _place_orders(client, rec, route, table_id, seconds, menu_names) -> list:
+    """One order every 50ms (each from its own guest phone) for `seconds`; returns latencies in ms
+
+    Open loop: latency runs from when the order was due, not when the
+    starved event loop got round to sending it (no coordinated omission).
+    """
+    async def place(i, due):
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        await rec.call(client, route, "POST", "/api/orders", device=f"{route}-{i}",
+                       json={"tableId": table_id, "items": [{"name": menu_names[i % len(menu_names)],
+                                                             "price": 100, "quantity": 1}],
+                             "totalAmount": 100})
+        return (time.perf_counter() - due) * 1000
+
+    start = time.perf_counter()
+    return await asyncio.gather(*(place(i, start + i * 0.05) for i in range(int(seconds / 0.05))))
+
+
+async def _storm_device(client, rec, device: int, deadline, interval, statuses):
+    """A tablet reconnecting: a heavy read every `interval`, ignoring Retry-After"""
+    # Distinct start dates so the reads can't be coalesced into one query
+    start = (datetime.now() - timedelta(days=90, seconds=device)).isoformat()
+    reads = [("get_orders(storm)", "/api/orders", {"start": start, "view": "full"}),
+             ("get_analytics(storm)", "/api/analytics/summary", {"start": start}),
+             ("get_menu(storm)", "/api/menu", {})]
+    await asyncio.sleep(random.uniform(0, interval))
+    i = 0
+    while time.perf_counter() < deadline:
+        route, url, params = reads[i % len(reads)]
+        response = await rec.call(client, route, "GET", url, device=f"storm-{device}", params=params)
+        statuses[response.status_code if response is not None else "error"] += 1
+        i += 1
+        await asyncio.sleep(interval)
+
+
+async def _storm_phase(client, rec, route, table_id, devices, seconds, interval, menu_names):
+    statuses = defaultdict(int)
+    deadline = time.perf_counter() + seconds + 1
+    storm = [asyncio.create_task(_storm_device(client, rec, d, deadline, interval, statuses)) for d in range(devices)]
+    await asyncio.sleep(0.5)  # Let the storm build up
+    latencies = await _place_orders(client, rec, route, table_id, seconds, menu_names)
+    await asyncio.gather(*storm)
+    return latencies, dict(statuses)
+
+
+async def read_storm_check(client, rec, table_id: int, devices: int, seconds: float, interval: float,
+                           menu_names) -> dict:
+    """
+    Order placement alone, during a read storm with admission control off,
+    and during the same storm with it on. Passes when placement p50 stays
+    within 2x (or +10ms) of the quiet run and p95 is at least halved
+    compared to the unprotected storm.
+    """
+    import admission
+
+    await rec.call(client, "settle_table", "POST", f"/api/tables/{table_id}/settle", device="storm")
+    phases = {"quiet": (await _place_orders(client, rec, "place_order(quiet)", table_id, seconds, menu_names), {})}
+    enabled, admission.ADMISSION_ENABLED = admission.ADMISSION_ENABLED, False
+    phases["storm_unprotected"] = await _storm_phase(client, rec, "place_order(storm,off)", table_id,
+                                                     devices, seconds, interval, menu_names)
+    admission.ADMISSION_ENABLED = True
+    phases["storm"] = await _storm_phase(client, rec, "place_order(storm)", table_id,
+                                         devices, seconds, interval, menu_names)
+    admission.ADMISSION_ENABLED = enabled
+
+    result = {"devices": devices}
+    for name, (values, statuses) in phases.items():
+        result[name] = {"p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95)}
+        if statuses:
+            result[name]["reads"] = statuses
+    quiet, unprotected, storm = result["quiet"], result["storm_unprotected"], result["storm"]
+    result["ok"] = (storm["p50_ms"] <= max(2 * quiet["p50_ms"], quiet["p50_ms"] + 10)
+                    and storm["p95_ms"] <= unprotected["p95_ms"] / 2
+                    and rec.errors.get("place_order(storm)", 0) == 0)
+    return result
+
+
+# ==========================
+# REPORTING
+# ==========================
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index], 3)
+
+
+def summarize(rec: Recorder, elapsed: float) -> dict:
+    routes = {}
+    for route, values in sorted(rec.latencies.items()):
+        ops = dict(mongo_ops.get(route, {}))
+        routes[route] = {
+            "count": len(values),
+            "errors": rec.errors.get(route, 0),
+            "rps": round(len(values) / elapsed, 2),
+            "mean_ms": round(statistics.fmean(values), 3),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+            "mongo_ops": ops,
+            "mongo_ops_per_request": round(sum(ops.values()) / len(values), 2),
+        }
+    return routes
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def print_report(result: dict):
+    print(f"\n{'route':<28}{'count':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'ops/req':>9}")
+    for route, r in result["routes"].items():
+        print(f"{route:<28}{r['count']:>8}{r['errors']:>6}{r['rps']:>9}{r['p50_ms']:>9}"
+              f"{r['p95_ms']:>9}{r['p99_ms']:>9}{r['mongo_ops_per_request']:>9}")
+    if result.get("events"):
+        print(f"\nevent delivery: {result['events']}")
+    for name, check in result.get("checks", {}).items():
+        print(f"check {name}: {check}")
+
+
+def compare(result: dict, baseline_path: str, threshold: float) -> int:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = 0
+    print(f"\nvs {baseline_path} ({baseline['meta'].get('git')}) - p95 threshold {threshold}%")
+    for route, r in result["routes"].items():
+        base = baseline["routes"].get(route)
+        if not base or not base.get("p95_ms"):
+            continue
+        change = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+        flag = "REGRESSION" if change > threshold else ""
+        regressions += bool(flag)
+        print(f"  {route:<28} p95 {base['p95_ms']:>9} -> {r['p95_ms']:>9}  ({change:+.1f}%) {flag}")
+    return regressions
+
+
+# ==========================
+# ENTRY POINT
+# ==========================
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    install_database(args.mongo_url, args.db_name)
+
+    import httpx
+    import admission
+    import outbox
+    from database import db
+    from main import app
+
+    admission.ADMISSION_ENABLED = not args.no_admission
+    outbox.OUTBOX_ENABLED = args.outbox
+    outbox.order_outbox.path = os.path.join(tempfile.mkdtemp(prefix="bench-outbox-"), "outbox.db")
+
+    menu = await seed(db, args.menu_size, args.users, args.history, args.tables, rng)
+    menu_names = [m["name"] for m in menu]
+    mongo_ops.clear()
+
+    rec = Recorder()
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            deadline = started + args.duration
+            tasks = [table_loop(client, rec, t, menu_names, deadline, args, random.Random(args.seed + t))
+                     for t in range(1, args.tables + 1)]
+            tasks.append(staff_loop(client, rec, "placed", "ready", "kitchen", deadline, 1.0))
+            tasks.append(staff_loop(client, rec, "ready", "served", "service", deadline, 1.5))
+            for d in range(args.dashboards):
+                if args.mode == "subscribe":
+                    tasks.append(subscribed_dashboard(rec, deadline))
+                else:
+                    tasks.append(polling_dashboard(client, rec, (d % args.tables) + 1, f"dashboard-{d}", deadline, args))
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+
+            checks = {}
+            if args.merge_race:
+                checks["merge_race"] = await merge_race_check(client, rec, args.tables + 1, args.merge_race)
+            if args.read_storm:
+                checks["read_storm"] = await read_storm_check(client, rec, args.tables + 2, args.read_storm,
+                                                              args.storm_seconds, args.storm_interval, menu_names)
+
+    result = {
+        "meta": {
+            "git": git_revision(),
+            "timestamp": datetime.now().isoformat(),
+            "mongo": "real" if args.mongo_url else "stand-in",
+            "args": vars(args),
+            "elapsed_s": round(elapsed, 2),
+        },
+        "routes": summarize(rec, elapsed),
+        "checks": checks,
+    }
+    if rec.event_lag_ms:
+        result["events"] = {
+            "delivered": len(rec.event_lag_ms),
+            "p50_ms": percentile(rec.event_lag_ms, 50),
+            "p95_ms": percentile(rec.event_lag_ms, 95),
+        }
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.getenv("BENCH_MONGO_URL"),
+                        help="real mongod (default: in-process stand-in)")
+    parser.add_argument("--db-name", default="dine_ai_bench")
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--dashboards", type=int, default=20)
+    parser.add_argument("--mode", choices=["poll", "subscribe"], default="poll")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--order-interval", type=float, default=3.0, help="mean seconds between a table's orders")
+    parser.add_argument("--settle-rate", type=float, default=0.15)
+    parser.add_argument("--poll-interval", type=float, default=3.0)
+    parser.add_argument("--menu-interval", type=float, default=10.0)
+    parser.add_argument("--menu-size", type=int, default=300)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--history", type=int, default=20000)
+    parser.add_argument("--merge-race", type=int, default=25, help="concurrent orders for the merge check (0 = skip)")
+    parser.add_argument("--read-storm", type=int, default=0,
+                        help="devices hammering reads for the load-shedding check (0 = skip)")
+    parser.add_argument("--storm-seconds", type=float, default=3.0)
+    parser.add_argument("--storm-interval", type=float, default=0.5, help="seconds between a storm device's reads")
+    parser.add_argument("--no-admission", action="store_true", help="turn admission control off (for comparison)")
+    parser.add_argument("--outbox", action="store_true", help="journal orders through the outbox (flushed in the background)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\n📝 saved {args.out}")
+    failed = any(not c.get("ok", True) for c in result["checks"].values())
+    if args.compare:
+        failed |= compare(result, args.compare, args.threshold) > 0
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
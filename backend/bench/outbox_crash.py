@@ -0,0 +1,275 @@
+"""
+Crash-recovery check for the order outbox: kill the flusher mid-flush, start
+again, and every acknowledged order must be in Mongo exactly once.
+
+    cd backend
+    pip install -r bench/requirements.txt
+    python -m bench.outbox_crash --mongo-url mongodb://localhost:27017
+    python -m bench.outbox_crash --standin          # no mongod: in-process
+
+Real mongod: starts a worker (uvicorn main:app) with OUTBOX_ACK_SECONDS=0,
+so orders are acknowledged as soon as they are journaled and the flusher
+falls behind. --orders orders go out from --concurrency clients over
+--tables tables, each with its own Idempotency-Key; once half are
+acknowledged and the journal still has pending entries the worker gets
+SIGKILL. A fresh worker starts on the same journal and drains it, then every
+order is sent again with its key, as a client retrying would.
+
+--standin: the same story inside this process against the mongomock
+stand-in (which can't outlive a process). The flusher stops dead after
+--kill-after writes of a batch it hasn't recorded in the journal yet, its
+tasks are cancelled and its lock / SQLite handle dropped without stop(),
+and a new outbox takes over the file.
+
+Passes when, per table, the open order holds exactly one line per order
+sent (every key once) and no order acknowledged before the kill is missing.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DRAIN_TIMEOUT = 30
+
+
+def order_body(table_id: int, key: str) -> dict:
+    # One line per order, named after its key: lines in Mongo map back to keys
+    return {"tableId": table_id, "guestName": "Crash Check", "type": "food", "totalAmount": 1,
+            "items": [{"name": f"crash-{key}", "price": 1, "quantity": 1}]}
+
+
+def plan(args) -> dict:
+    """key -> table, tables filled round-robin"""
+    return {uuid.uuid4().hex: 1000 + i % args.tables for i in range(args.orders)}
+
+
+async def verify(db, keys: dict, acked: set) -> bool:
+    by_table = {}
+    for key, table_id in keys.items():
+        by_table.setdefault(table_id, set()).add(key)
+
+    ok = True
+    lost = duplicated = 0
+    for table_id, expected in sorted(by_table.items()):
+        orders = await db.orders.find({"tableId": table_id}).to_list(None)
+        lines = [item["name"][len("crash-"):] for o in orders for item in o.get("items") or ()]
+        stamped = [k for o in orders for k in o.get("idempotencyKeys") or ()]
+        lost += len(expected - set(lines))
+        duplicated += len(lines) - len(set(lines))
+        if set(lines) != expected or len(lines) != len(expected) or sorted(stamped) != sorted(expected):
+            ok = False
+    acked_missing = 0
+    for key in acked:
+        if not await db.orders.find_one({"idempotencyKeys": key}, {"_id": 1}):
+            acked_missing += 1
+    print(f"   orders sent {len(keys)}, acknowledged before the kill {len(acked)}")
+    print(f"   missing {lost} (acknowledged: {acked_missing}), duplicated lines {duplicated}")
+    return ok and not acked_missing
+
+
+# ==========================
+# REAL MONGOD: SIGKILL A WORKER
+# ==========================
+def start_worker(args, journal: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "MONGO_URL": args.mongo_url,
+        "MONGO_DB": args.db_name,
+        "OUTBOX_PATH": journal,
+        "OUTBOX_ACK_SECONDS": "0",  # Acknowledge on journaling: the flusher lags behind
+        "ADMISSION_ENABLED": "0",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, base: str, timeout: float = 30) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            r = await client.get(f"{base}/health/ready")
+            if r.status_code == 200 and r.json()["outbox"]["running"]:
+                return r.json()
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{base} not ready after {timeout}s")
+
+
+async def drained(client: httpx.AsyncClient, base: str):
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while time.monotonic() < deadline:
+        if (await client.get(f"{base}/health/ready")).json()["outbox"]["pending"] == 0:
+            return
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"journal not drained after {DRAIN_TIMEOUT}s")
+
+
+async def send_all(client, base, keys: dict, acked: set, concurrency: int):
+    queue = list(keys.items())
+
+    async def sender():
+        while queue:
+            key, table_id = queue.pop()
+            try:
+                r = await client.post(f"{base}/api/orders", json=order_body(table_id, key),
+                                      headers={"Idempotency-Key": key})
+            except httpx.TransportError:
+                return  # Worker is gone
+            if r.status_code in (200, 202):
+                acked.add(key)
+
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+
+
+async def check_real(args) -> bool:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    journal = os.path.join(tempfile.mkdtemp(prefix="outbox-crash-"), "outbox.db")
+    base = f"http://127.0.0.1:{args.port}"
+    keys, acked = plan(args), set()
+    mongo = AsyncIOMotorClient(args.mongo_url)
+    await mongo.drop_database(args.db_name)
+    worker = start_worker(args, journal)
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            await wait_ready(client, base)
+            sending = asyncio.create_task(send_all(client, base, keys, acked, args.concurrency))
+            while len(acked) < len(keys) // 2 and not sending.done():
+                await asyncio.sleep(0.005)
+            pending = (await client.get(f"{base}/health/ready")).json()["outbox"]["pending"]
+            worker.send_signal(signal.SIGKILL)
+            worker.wait()
+            await sending
+            print(f"💥 SIGKILL with {pending} orders journaled but not yet in Mongo")
+            before_kill = set(acked)
+
+            worker = start_worker(args, journal)
+            await wait_ready(client, base)
+            await drained(client, base)
+            print("🗃️  restarted worker drained the journal")
+
+            # Clients retry everything they sent, acknowledged or not
+            await send_all(client, base, keys, acked, args.concurrency)
+            await drained(client, base)
+        ok = await verify(mongo[args.db_name], keys, before_kill)
+        if not pending:
+            print("   (nothing was pending at the kill: raise --orders to land mid-flush)")
+        return ok
+    finally:
+        worker.terminate()
+        worker.wait(timeout=10)
+        if not args.keep:
+            await mongo.drop_database(args.db_name)
+
+
+# ==========================
+# STAND-IN: KILL THE FLUSHER IN-PROCESS
+# ==========================
+def kill(box):
+    """What SIGKILL leaves behind: no drain, no journal bookkeeping, the lock released by the OS"""
+    for task in box._tasks + list(box._lanes.values()):
+        task.cancel()
+    box._tasks, box._lanes = [], {}
+    box._lock_file.close()
+    box._lock_file = None
+    box._executor.submit(box._db_close).result()
+    box._executor.shutdown(wait=True)
+
+
+async def check_standin(args) -> bool:
+    from bench.load import install_database
+
+    install_database("", args.db_name)
+    import admission
+    import outbox
+    from database import db
+    from main import _apply_journaled, app
+
+    admission.ADMISSION_ENABLED = False
+    outbox.OUTBOX_ENABLED = True
+    journal = os.path.join(tempfile.mkdtemp(prefix="outbox-crash-"), "outbox.db")
+    outbox.order_outbox.path = journal
+    keys = plan(args)
+
+    async with app.router.lifespan_context(app):
+        first = outbox.order_outbox
+        writes, dead = 0, asyncio.Event()
+
+        async def dies_mid_batch(entry, recheck):
+            nonlocal writes
+            if writes == args.kill_after:
+                dead.set()
+                await asyncio.Event().wait()  # Never comes back
+            writes += 1
+            return await _apply_journaled(entry, recheck)
+
+        first.apply = dies_mid_batch
+        acked = await asyncio.gather(*(
+            first.append(key, table_id, "Crash Check", 1, outbox_payload(table_id, key))
+            for key, table_id in keys.items()
+        ))
+        await dead.wait()
+        kill(first)
+        unrecorded = sum(1 for e in acked if e.state != "pending")  # Settled in memory, not in the journal
+        print(f"💥 flusher killed after {writes} writes ({unrecorded} in Mongo but still pending in the journal)")
+
+        second = outbox.OrderOutbox(journal)
+        await second.start(_apply_journaled)
+        journaled = len(second.pending)
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while second.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        print(f"🗃️  new outbox drained the journal ({journaled} pending at start, {len(second.pending)} left)")
+
+        # Client retries: every key again, nothing new may reach Mongo
+        retried = await asyncio.gather(*(
+            second.append(key, table_id, "Crash Check", 1, outbox_payload(table_id, key))
+            for key, table_id in keys.items()
+        ))
+        not_applied = sum(1 for e in retried if e.state != "applied")
+        await second.stop()
+        ok = await verify(db, keys, {e.key for e in acked})
+        if not_applied:
+            print(f"   {not_applied} retries did not find their order applied")
+        return ok and not not_applied and unrecorded > 0
+
+
+def outbox_payload(table_id: int, key: str) -> str:
+    from models import OrderCreate
+    return OrderCreate(**order_body(table_id, key)).model_dump_json()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.getenv("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="dine_ai_outbox_check")
+    parser.add_argument("--standin", action="store_true", help="in-process mongomock, flusher killed in-process")
+    parser.add_argument("--orders", type=int, default=400)
+    parser.add_argument("--tables", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--kill-after", type=int, default=25, help="--standin: writes before the flusher dies")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--keep", action="store_true", help="keep the database afterwards")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ok = asyncio.run(check_standin(args) if args.standin else check_real(args))
+    print(f"\n{'✅ every acknowledged order in Mongo exactly once' if ok else '❌ orders lost or duplicated'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Micro-benchmarks: current vs fast response encoding on 1000-document payloads.
+
+    cd backend && python -m bench.serialization [--n 1000] [--repeat 20]
+
+No Mongo needed; documents are synthesized in the shape the routes read back.
+"""
+import argparse
+import copy
+import json
+import statistics
+import time
+from datetime import datetime
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+# LOCAL IMPORTS
+from models import MenuItem
+from responses import MENU_LIST_ADAPTER, dumps, rename_id
+
+
+def make_menu_docs(n: int) -> list:
+    return [
+        {
+            "_id": ObjectId(),
+            "name": f"Item {i}",
+            "description": "Aromatic kaima rice cooked with spiced chicken.",
+            "price": 100 + i % 300,
+            "category": ["Mains", "Starters", "Beverages", "Dessert"][i % 4],
+            "image": "https://images.unsplash.com/photo-1633945274405-b6c8069047b0",
+            "spiceLevel": "medium",
+            "isAvailable": True,
+            "dietaryType": "non-veg",
+            "tags": ["bestseller", "comfort"],
+            "heroIngredient": "poultry",
+            "allergens": ["dairy"],
+            "prepTime": 25,
+            "calories": 650,
+            "stock": 50,
+            "rating": 4.8,
+        }
+        for i in range(n)
+    ]
+
+
+def make_order_docs(n: int) -> list:
+    now = datetime.now().isoformat()
+    return [
+        {
+            "_id": ObjectId(),
+            "createdAt": now,
+            "updatedAt": now,
+            "status": "placed",
+            "tableId": i % 40,
+            "items": [
+                {"menu_item_id": None, "name": f"Item {j}", "price": 120.0, "quantity": 2, "notes": "", "status": "pending"}
+                for j in range(4)
+            ],
+            "guestName": "Guest",
+            "subtotal": 960.0,
+            "totalAmount": 1032.0,
+            "type": "food",
+            "revision": i,
+        }
+        for i in range(n)
+    ]
+
+
+# --- Current paths (what FastAPI does with a dict / response_model today) ---
+def menu_current(docs):
+    items = TypeAdapter(List[MenuItem]).validate_python(docs)  # response_model revalidation
+    return json.dumps(jsonable_encoder(items)).encode()
+
+
+def _copy_serialize_order(order: dict) -> dict:
+    # serialize_order before the fast layer: copy, then rename
+    result = {**order}
+    result["id"] = str(result.pop("_id"))
+    return result
+
+
+def orders_current(docs):
+    serialized = [_copy_serialize_order(d) for d in docs]
+    return json.dumps(jsonable_encoder(serialized)).encode()
+
+
+# --- New paths ---
+def menu_validated(docs):
+    return MENU_LIST_ADAPTER.dump_json(MENU_LIST_ADAPTER.validate_python(docs))
+
+
+def menu_trusted(docs):
+    return dumps([rename_id(d) for d in docs])
+
+
+def orders_fast(docs):
+    return dumps([rename_id(d) for d in docs])
+
+
+def bench(fn, docs, repeat: int) -> dict:
+    # Fresh copies per run: the fast paths rename `_id` in place
+    batches = [copy.deepcopy(docs) for _ in range(repeat)]
+    timings = []
+    for batch in batches:
+        start = time.perf_counter()
+        fn(batch)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    menu, orders = make_menu_docs(args.n), make_order_docs(args.n)
+    cases = [
+        ("menu: response_model + jsonable_encoder", menu_current, menu),
+        ("menu: precompiled TypeAdapter dump_json", menu_validated, menu),
+        ("menu: trusted + orjson", menu_trusted, menu),
+        ("orders: serialize_order + jsonable_encoder", orders_current, orders),
+        ("orders: in-place rename + orjson", orders_fast, orders),
+    ]
+    print(f"{args.n} documents, {args.repeat} runs each")
+    for label, fn, docs in cases:
+        result = bench(fn, docs, args.repeat)
+        print(f"  {label:<45} median {result['median_ms']:8.2f} ms   min {result['min_ms']:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
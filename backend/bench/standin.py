@@ -0,0 +1,147 @@
+"""
+In-process Mongo stand-in for the benchmark harness (mongomock-motor).
+
+Latencies against the stand-in measure our own code paths (routing,
+serialization, pipelines evaluated in Python) and are only comparable
+run-to-run. Point the harness at a real local mongod with --mongo-url for
+numbers that include the database.
+
+mongomock gaps patched here (benchmark use only):
+  - $mergeObjects / $substrBytes aggregation expressions
+  - Collection.create_indexes drops partialFilterExpression, and
+    create_index checks existing documents against a unique index as if it
+    had none; either way one_active_order_per_table would mean one order
+    per table ever. Models are created one by one, partial ones checked
+    against their filter only
+  - Collection.bulk_write: mongomock's builder rejects the `sort` argument
+    current pymongo write models pass, so ops are applied one by one
+    (ordered / unordered error semantics kept)
+
+interleave_upserts() (opt-in, bench.first_order_race --standin): every
+operation here runs to completion without yielding, so two upserts can never
+both miss and both insert. With it, an upsert on `orders` looks for its
+document, yields for `gap` seconds, and then takes the insert path if it
+found none, as a server running the two requests side by side would; the
+unique index decides who wins.
+"""
+
+
+def patch_mongomock():
+    from mongomock import aggregate, collection
+
+    original_parse = aggregate._Parser.parse
+
+    def parse(self, expression):
+        if isinstance(expression, dict) and len(expression) == 1:
+            operator, value = next(iter(expression.items()))
+            if operator == "$mergeObjects":
+                merged = {}
+                for part in value:
+                    merged.update(self.parse(part) or {})
+                return merged
+            if operator == "$substrBytes":
+                return original_parse(self, {"$substr": value})
+        return original_parse(self, expression)
+
+    aggregate._Parser.parse = parse
+    collection.Collection.bulk_write = _bulk_write
+    collection.Collection.create_indexes = _create_indexes
+
+
+def _create_indexes(self, indexes, session=None, **kwargs):
+    from pymongo.errors import DuplicateKeyError
+
+    names = []
+    for model in indexes:
+        options = dict(model.document)
+        keys = list(options.pop("key").items())
+        partial = options.get("partialFilterExpression")
+        if partial is None or not options.get("unique"):
+            names.append(self.create_index(keys, **options))
+            continue
+        # create_index checks the existing documents as if there were no
+        # filter: check the filtered ones here, then mark the index unique
+        if options["name"] not in self._store.indexes:
+            seen = set()
+            for doc in self.find(partial):
+                value = tuple(repr(doc.get(field)) for field, _ in keys)
+                if value in seen:
+                    raise DuplicateKeyError("E11000 Duplicate Key Error", 11000)
+                seen.add(value)
+            self.create_index(keys, **{**options, "unique": False})
+            self._store.indexes[options["name"]]["unique"] = True
+        names.append(options["name"])
+    return names
+
+
+def _bulk_write(self, requests, ordered=True, **kwargs):
+    from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+    from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+    from pymongo.results import BulkWriteResult
+
+    details = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nUpserted": 0, "nRemoved": 0,
+               "upserted": [], "writeErrors": []}
+    for index, op in enumerate(requests):
+        try:
+            if isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+                write = {UpdateOne: self.update_one, UpdateMany: self.update_many, ReplaceOne: self.replace_one}[type(op)]
+                result = write(op._filter, op._doc, upsert=op._upsert)
+                details["nMatched"] += result.matched_count
+                details["nModified"] += result.modified_count
+                if result.upserted_id is not None:
+                    details["nUpserted"] += 1
+                    details["upserted"].append({"index": index, "_id": result.upserted_id})
+            elif isinstance(op, InsertOne):
+                self.insert_one(op._doc)
+                details["nInserted"] += 1
+            elif isinstance(op, (DeleteOne, DeleteMany)):
+                delete = self.delete_one if isinstance(op, DeleteOne) else self.delete_many
+                details["nRemoved"] += delete(op._filter).deleted_count
+        except WriteError as e:
+            # mongomock leaves code unset on most write errors; stock.reserve relies on 66
+            code = 11000 if isinstance(e, DuplicateKeyError) else e.code or (66 if "immutable" in str(e) else 2)
+            details["writeErrors"].append({"index": index, "code": code, "errmsg": str(e)})
+            if ordered:
+                break
+    if details["writeErrors"]:
+        raise BulkWriteError(details)
+    return BulkWriteResult(details, True)
+
+
+def interleave_upserts(gap: float = 0.005, collections=("orders",)) -> dict:
+    """Let upserts on `collections` race between match and write; returns live counters"""
+    import asyncio
+
+    from bson import ObjectId
+    from mongomock_motor import AsyncMongoMockCollection
+    from pymongo.errors import DuplicateKeyError
+
+    stats = {"upserts": 0, "inserts": 0, "collisions": 0}
+    original = AsyncMongoMockCollection.find_one_and_update
+
+    async def find_one_and_update(self, filter, update, *args, upsert=False, **kwargs):
+        if not upsert or self.name not in collections:
+            return await original(self, filter, update, *args, upsert=upsert, **kwargs)
+        stats["upserts"] += 1
+        matched = await self.find_one(filter, {"_id": 1})
+        await asyncio.sleep(gap)  # Other requests run between the match and the write
+        if matched is None:
+            stats["inserts"] += 1
+            filter = {**filter, "_id": ObjectId()}  # Can't match: the server already chose to insert
+        try:
+            return await original(self, filter, update, *args, upsert=True, **kwargs)
+        except DuplicateKeyError:
+            stats["collisions"] += 1
+            raise
+
+    AsyncMongoMockCollection.find_one_and_update = find_one_and_update
+    return stats
+
+
+def create_client():
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("The in-process stand-in needs `pip install -r bench/requirements.txt`")
+    patch_mongomock()
+    return AsyncMongoMockClient()
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+# LOCAL IMPORTS
+from database import db
+
+# ==========================
+# CLUSTER BUS (cross-worker coherence)
+# ==========================
+# Each worker process keeps state in memory: the menu snapshot and search
+# index, the table registry, SSE / WebSocket subscribers, the archive
+# horizon. With several workers a write handled by one has to reach the
+# others, so every worker tails one capped collection:
+#
+#   publish(kind, payload)    - never awaits: queued, written in batches by a
+#                               background task
+#   subscribe(kind, handler)  - handler(payload) (sync or async) runs for
+#                               messages from OTHER workers; the writer has
+#                               already applied its own change
+#
+# The tail uses a TAILABLE_AWAIT cursor: the server holds each getMore open
+# until a message lands, so delivery takes milliseconds and needs nothing
+# but the Mongo we already run (standalone is fine, no replica set).
+#
+# If the tail breaks and has to be reopened, messages may have been missed;
+# RESYNC handlers then drop / reload the state they own.
+#
+# Off unless CLUSTER_BUS=1 (serve.py sets it when running more than one
+# worker): a single process has nothing to tell anyone.
+
+CLUSTER_BUS = os.getenv("CLUSTER_BUS", "0") == "1"
+BUS_COLLECTION = "cluster_bus"
+BUS_SIZE_BYTES = int(os.getenv("CLUSTER_BUS_SIZE_BYTES", str(16 * 1024 * 1024)))
+BUS_RETRY_SECONDS = 1.0
+BUS_MAX_PENDING = 10000
+RESUME_SLACK = timedelta(seconds=5)  # Re-read window when reopening the tail (clock skew between workers)
+
+RESYNC = "bus.resync"  # Local only: the tail was reopened, state may have missed messages
+
+
+def _utcnow() -> datetime:
+    # Naive UTC, the way pymongo hands datetimes back
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ClusterBus:
+    def __init__(self, enabled: bool = CLUSTER_BUS):
+        self.enabled = enabled
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, List[Callable]] = {}
+        self.published = 0
+        self.delivered = 0
+        self.running = False
+        self._pending: List[dict] = []
+        self._wake = asyncio.Event()
+        self._seen: "OrderedDict[object, None]" = OrderedDict()  # Recent message ids (tail reopen overlap)
+        self._tasks: List[asyncio.Task] = []
+
+    # --- API ---
+    def subscribe(self, kind: str, handler: Callable):
+        self.handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind: str, payload: Optional[dict] = None):
+        if not self.running:
+            return
+        if len(self._pending) >= BUS_MAX_PENDING:
+            self._pending.pop(0)  # Writer is stuck; peers resync when it recovers
+        self._pending.append({"origin": self.origin, "kind": kind, "payload": payload or {}, "at": _utcnow()})
+        self._wake.set()
+
+    # --- Lifecycle ---
+    async def start(self):
+        if not self.enabled:
+            return
+        try:
+            await db.create_collection(BUS_COLLECTION, capped=True, size=BUS_SIZE_BYTES)
+        except (CollectionInvalid, OperationFailure):
+            pass  # Another worker created it first
+        self._wake = asyncio.Event()
+        self.running = True
+        # A tailable cursor on an empty capped collection dies at once; announce ourselves first
+        await db[BUS_COLLECTION].insert_one({"origin": self.origin, "kind": "bus.hello", "payload": {}, "at": _utcnow()})
+        self._tasks = [asyncio.create_task(self._tail()), asyncio.create_task(self._write())]
+        print(f"🛰️  CLUSTER BUS: worker {self.origin}")
+
+    async def stop(self):
+        self.running = False
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def status(self) -> dict:
+        return {"enabled": self.enabled, "running": self.running, "origin": self.origin,
+                "published": self.published, "delivered": self.delivered, "pending": len(self._pending)}
+
+    # --- Writer ---
+    async def _write(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            batch, self._pending = self._pending, []
+            if not batch:
+                continue
+            try:
+                await db[BUS_COLLECTION].insert_many(batch, ordered=True)
+                self.published += len(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Cluster bus publish failed ({e}), retrying")
+                self._pending = batch + self._pending
+                await asyncio.sleep(BUS_RETRY_SECONDS)
+                self._wake.set()
+
+    # --- Tail ---
+    async def _tail(self):
+        since = _utcnow()
+        broken = False
+        while True:
+            try:
+                cursor = db[BUS_COLLECTION].find({"at": {"$gte": since - RESUME_SLACK}},
+                                                 cursor_type=CursorType.TAILABLE_AWAIT)
+                if broken:
+                    await self._dispatch(RESYNC, {})
+                    broken = False
+                while cursor.alive:
+                    async for message in cursor:
+                        since = max(since, message["at"])
+                        if message["_id"] in self._seen:
+                            continue
+                        self._seen[message["_id"]] = None
+                        if len(self._seen) > BUS_MAX_PENDING:
+                            self._seen.popitem(last=False)
+                        if message.get("origin") != self.origin:
+                            self.delivered += 1
+                            await self._dispatch(message.get("kind"), message.get("payload") or {})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Cluster bus tail stopped ({e}), reopening")
+                broken = True
+            # Also reached when the cursor dies (e.g. its position was overwritten)
+            await asyncio.sleep(BUS_RETRY_SECONDS)
+
+    async def _dispatch(self, kind: str, payload: dict):
+        for handler in self.handlers.get(kind, ()):
+            try:
+                result = handler(payload)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"❌ Cluster bus handler for {kind} failed: {e}")
+
+
+bus = ClusterBus()
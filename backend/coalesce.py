@@ -0,0 +1,78 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# ==========================
+# SINGLE-FLIGHT READ COALESCING
+# ==========================
+# Tablets poll on the same interval, so identical reads arrive together.
+# `coalescer.run(namespace, key, fn)` lets one caller per key run `fn`
+# (the leader); everyone arriving while it runs awaits the same result,
+# and for COALESCE_TTL_MS after it finishes the result is reused as is.
+#
+# Writes call `touch(namespace)` when they finish. A flight started before
+# the write is neither joined nor reused afterwards, so a read that follows
+# a write in this process always sees it. Writes on other workers are not
+# tracked here; their reads can be stale by at most the TTL.
+#
+# The leader's query runs in its own task: a client hanging up does not
+# cancel the result the others are waiting for.
+
+COALESCE_TTL_MS = int(os.getenv("COALESCE_TTL_MS", "250"))  # 0 = only share in-flight reads
+
+
+class _Flight:
+    __slots__ = ("generation", "task", "done_at")
+
+    def __init__(self, generation: int, task: asyncio.Task):
+        self.generation = generation
+        self.task = task
+        self.done_at: Optional[float] = None
+
+
+class SingleFlight:
+    def __init__(self, ttl_ms: int = COALESCE_TTL_MS):
+        self.ttl = ttl_ms / 1000
+        self._flights: Dict[Tuple[str, Hashable], _Flight] = {}
+        self._generations: Dict[str, int] = defaultdict(int)
+        self.outcomes: Dict[Tuple[str, str], int] = defaultdict(int)  # (namespace, leader|joined|cached)
+
+    def touch(self, namespace: str):
+        """A write to `namespace` finished: later reads start fresh"""
+        self._generations[namespace] += 1
+
+    async def run(self, namespace: str, key: Hashable, fn: Callable[[], Awaitable]):
+        full_key = (namespace, key)
+        generation = self._generations[namespace]
+        flight = self._flights.get(full_key)
+
+        if flight and flight.generation == generation:
+            if flight.done_at is None:
+                self.outcomes[(namespace, "joined")] += 1
+                return await asyncio.shield(flight.task)
+            if time.monotonic() - flight.done_at < self.ttl:
+                self.outcomes[(namespace, "cached")] += 1
+                return flight.task.result()
+
+        self.outcomes[(namespace, "leader")] += 1
+        flight = _Flight(generation, asyncio.ensure_future(fn()))
+        self._flights[full_key] = flight
+        flight.task.add_done_callback(lambda _: self._landed(full_key, flight))
+        return await asyncio.shield(flight.task)
+
+    def _landed(self, full_key, flight: _Flight):
+        flight.done_at = time.monotonic()
+        failed = flight.task.cancelled() or flight.task.exception() is not None
+        if failed or not self.ttl:
+            self._forget(full_key, flight)
+        else:
+            asyncio.get_running_loop().call_later(self.ttl, self._forget, full_key, flight)
+
+    def _forget(self, full_key, flight: _Flight):
+        if self._flights.get(full_key) is flight:
+            del self._flights[full_key]
+
+
+coalescer = SingleFlight()
@@ -1,10 +1,122 @@
-import motor.motor_asyncio
+import asyncio
 import os
+import time
+from typing import Optional
+
+import motor.motor_asyncio
+
+# LOCAL IMPORTS
+from metrics import mongo_metrics, pool_metrics
+
+# ==========================
+# MONGO CLIENT LIFECYCLE
+# ==========================
+# The client is created by the app lifespan (`connect()` -> `warm_up()` ...
+# `close()`), not at import time, so pool size, timeouts and read
+# preference come from config and the pool is filled before the first
+# request instead of by it.
+#
+# Modules keep doing `from database import db`: `db` is a stable handle
+# bound to the real database by `connect()` (or to a stand-in by the bench).
 
-# For MVP, we can hardcode or use env vars.
-# Default to localhost for now as per instructions.
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DATABASE_NAME = "dine_ai"
+DATABASE_NAME = os.getenv("MONGO_DB", "dine_ai")
+
+MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) or None  # 0 = no timeout
+WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
+
+class Database:
+    """Handle to the app database, usable before the client exists"""
+
+    def __init__(self):
+        self._database = None
+
+    def bind(self, database):
+        self._database = database
+
+    @property
+    def bound(self) -> bool:
+        return self._database is not None
+
+    def _target(self):
+        if self._database is None:
+            raise RuntimeError("Database not connected: database.connect() runs in the app lifespan")
+        return self._database
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __getitem__(self, name):
+        return self._target()[name]
+
+
+client: Optional[motor.motor_asyncio.AsyncIOMotorClient] = None
+db = Database()
+
+
+def connect():
+    """Create the client (once) and bind `db`"""
+    global client
+    if db.bound:
+        return  # Already connected, or the bench injected its own database
+    client = motor.motor_asyncio.AsyncIOMotorClient(
+        MONGO_URL,
+        appname="dineai",
+        maxPoolSize=MAX_POOL_SIZE,
+        minPoolSize=MIN_POOL_SIZE,
+        maxIdleTimeMS=MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+        readPreference=READ_PREFERENCE,
+        # Per-route command stats + pool gauges for /metrics
+        event_listeners=[mongo_metrics, pool_metrics],
+    )
+    db.bind(client[DATABASE_NAME])
+
+
+async def warm_up():
+    """Open MIN_POOL_SIZE connections now (concurrent pings each need their own)"""
+    start = time.perf_counter()
+    await asyncio.gather(*(db.command("ping") for _ in range(max(MIN_POOL_SIZE, 1))))
+    print(f"🔌 MONGO POOL WARM: {MIN_POOL_SIZE} connections in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+def close():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+        db.bind(None)
+        print("🔌 MONGO CLIENT CLOSED")
+
+
+async def status(timeout: float = 2.0) -> dict:
+    """Readiness: ping latency, replica set view and pool state"""
+    report = {"ready": False, "database": DATABASE_NAME, "readPreference": READ_PREFERENCE,
+              "pool": {"maxPoolSize": MAX_POOL_SIZE, "minPoolSize": MIN_POOL_SIZE, **pool_metrics.snapshot()}}
+    try:
+        start = time.perf_counter()
+        hello = await asyncio.wait_for(db.command("hello"), timeout)
+        report["pingMs"] = round((time.perf_counter() - start) * 1000, 2)
+    except Exception as e:
+        report["error"] = str(e) or type(e).__name__
+        return report
 
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
-db = client[DATABASE_NAME]
+    report["ready"] = True
+    report["replica"] = {
+        "setName": hello.get("setName"),
+        "primary": hello.get("primary"),
+        "isWritablePrimary": hello.get("isWritablePrimary", hello.get("ismaster")),
+        "secondary": hello.get("secondary", False),
+        "hosts": hello.get("hosts", []),
+    } if hello.get("setName") else {"setName": None, "standalone": hello.get("msg") != "isdbgrid"}
+    return report
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import os
+from typing import Optional, Set
+
+from pymongo.errors import OperationFailure
+
+# LOCAL IMPORTS
+from bus import bus
+from database import db
+
+# ==========================
+# ORDER EVENT HUB
+# ==========================
+# Dashboards subscribe here instead of polling /api/orders every 3s.
+#
+# Event types:
+#   order.created      - new ticket for a table
+#   order.items_merged - guest added items to their running ticket
+#   order.items_ready  - kitchen marked pending items ready
+#   order.items_served - service marked ready items served
+#   order.updated      - any other status recalculation
+#   table.settled      - every open order on a table was paid
+#   orders.bulk_updated - one batch of kitchen / service bumps (one revision)
+#   order.rejected     - a journaled order the outbox could not write (no Mongo write)
+#
+# Two sources feed the hub:
+#   "changestream" - replica set / Atlas. We watch `orders` and turn changes
+#                    into events, so writes from any process are seen.
+#   "local"        - standalone Mongo. Routes fan out in-process directly,
+#                    and over the cluster bus to the other workers.
+# Routes always call `emit()`; it is a no-op while the change stream is the
+# source, so nothing is delivered twice. UNWRITTEN_EVENTS have no change
+# behind them for the stream to see: those always go out in-process + bus.
+#
+# A broken stream is reopened from its last resume token, so no change is
+# lost. When it can't be (token gone from the oplog, or CHANGESTREAM_RETRIES
+# failed reopens) the worker falls back to "local" and says so on the bus:
+# every worker switches, because a worker still on the stream would no
+# longer put its writes on the bus. Subscribers of a worker that switched
+# get a `resync` event, as changes made meanwhile were never seen.
+
+EVENT_SOURCE = os.getenv("EVENT_SOURCE", "auto")  # auto | local | changestream
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+UNWRITTEN_EVENTS = {"order.rejected"}
+CHANGESTREAM_RETRIES = 5
+CHANGESTREAM_RETRY_SECONDS = 1.0
+CHANGESTREAM_HISTORY_LOST = 286  # Resume token no longer in the oplog
+
+
+def build_event(event_type: str, order: Optional[dict] = None, **fields) -> dict:
+    """Typed event payload. `order` is an already serialized order dict."""
+    event = {"type": event_type, **fields}
+    if order:
+        event.setdefault("orderId", order.get("id"))
+        event.setdefault("tableId", order.get("tableId"))
+        event.setdefault("status", order.get("status"))
+        event.setdefault("revision", order.get("revision"))
+        event["order"] = order
+    return event
+
+
+class Subscription:
+    """One dashboard connection with its own bounded queue.
+
+    A slow tablet only ever loses its own oldest events: when the queue is
+    full we drop from the front and flag the subscription so the client is
+    told to resync through GET /api/orders?since=<cursor>.
+    """
+
+    def __init__(self, table_id: Optional[int] = None, statuses: Optional[Set[str]] = None,
+                 maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.table_id = table_id
+        self.statuses = statuses or None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.stale = False  # Events may have been missed upstream (source switch)
+
+    def matches(self, event: dict) -> bool:
+        if self.table_id is not None and event.get("tableId") != self.table_id:
+            return False
+        # Settlements always go through so boards can clear the table
+        if self.statuses and event["type"] != "table.settled" and event.get("status") not in self.statuses:
+            return False
+        return True
+
+    def accepts(self, event: dict) -> bool:
+        # A batch touches many tables / statuses: deliver if any of them match
+        if event["type"] == "orders.bulk_updated":
+            orders = event.get("orders")
+            return not orders or any(self.matches({**o, "type": event["type"]}) for o in orders)
+        return self.matches(event)
+
+    def offer(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Next event, a resync notice after drops, or None on timeout."""
+        if self.dropped or self.stale:
+            dropped, self.dropped, self.stale = self.dropped, 0, False
+            return {"type": "resync", "dropped": dropped}
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventHub:
+    def __init__(self):
+        self.subscribers: Set[Subscription] = set()
+        self.source = "local"
+        self._watcher: Optional[asyncio.Task] = None
+
+    # --- Subscriptions ---
+    def subscribe(self, table_id: Optional[int] = None, statuses: Optional[Set[str]] = None) -> Subscription:
+        sub = Subscription(table_id, statuses)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self.subscribers.discard(sub)
+
+    # --- Publishing ---
+    def publish(self, event: dict):
+        """Fan out to every matching subscriber without ever awaiting."""
+        for sub in list(self.subscribers):
+            if sub.accepts(event):
+                sub.offer(event)
+
+    def emit(self, event_type: str, order: Optional[dict] = None, **fields):
+        """Called by write routes after a successful write."""
+        if self.source == "changestream" and event_type not in UNWRITTEN_EVENTS:
+            return
+        event = build_event(event_type, order, **fields)
+        self.publish(event)
+        bus.publish(EVENT_MESSAGE, event)
+
+    def _relay(self, event: dict):
+        """Event emitted by another worker (the change stream already covers them)"""
+        if self.source == "local" or event["type"] in UNWRITTEN_EVENTS:
+            self.publish(event)
+
+    def _fall_back(self, reason: str):
+        """Change stream gone for good: in-process events from here on, here and on every worker"""
+        print(f"❌ Change stream stopped ({reason}), falling back to in-process events")
+        self.source = "local"
+        for sub in list(self.subscribers):
+            sub.stale = True
+        bus.publish(SOURCE_MESSAGE, {"source": "local"})
+
+    def _source_switched(self, message: dict):
+        """Another worker lost its change stream: its writes only reach us over the bus now"""
+        if self.source != "changestream":
+            return
+        print("📡 EVENT HUB: another worker fell back, switching to in-process events")
+        self.source = "local"
+        if self._watcher:
+            self._watcher.cancel()
+            self._watcher = None
+        for sub in list(self.subscribers):
+            sub.stale = True
+
+    # --- Lifecycle ---
+    async def start(self):
+        if EVENT_SOURCE == "local" or not await _supports_change_streams():
+            self.source = "local"
+            print("📡 EVENT HUB: in-process fan-out")
+            return
+        self.source = "changestream"
+        self._watcher = asyncio.create_task(self._watch())
+        print("📡 EVENT HUB: Mongo change streams")
+
+    async def stop(self):
+        if self._watcher:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self):
+        last_settle = None
+        last_bulk = None
+        token = None
+        failures = 0
+        while True:
+            try:
+                async with db.orders.watch(full_document="updateLookup", resume_after=token) as stream:
+                    while stream.alive:
+                        change = await stream.try_next()  # None after an idle await: the token still moves on
+                        token = stream.resume_token or token
+                        failures = 0
+                        doc = (change or {}).get("fullDocument")
+                        if not doc:
+                            continue
+                        order = {**doc, "id": str(doc["_id"])}
+                        order.pop("_id")
+                        event_type = order.get("lastEvent") or "order.updated"
+                        if event_type == "table.settled":
+                            # update_many yields one change per order; one event per settlement
+                            key = (order.get("tableId"), order.get("revision"))
+                            if key == last_settle:
+                                continue
+                            last_settle = key
+                            self.publish(build_event(event_type, tableId=order.get("tableId"),
+                                                     status="paid", revision=order.get("revision")))
+                            continue
+                        if event_type == "orders.bulk_updated":
+                            # One event per batch; without the order list it reaches every subscriber
+                            if order.get("revision") == last_bulk:
+                                continue
+                            last_bulk = order.get("revision")
+                            self.publish(build_event(event_type, revision=last_bulk))
+                            continue
+                        self.publish(build_event(event_type, order))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                lost = isinstance(e, OperationFailure) and e.code == CHANGESTREAM_HISTORY_LOST
+                if lost or token is None or failures > CHANGESTREAM_RETRIES:
+                    self._fall_back(str(e))
+                    self._watcher = None
+                    return
+                print(f"⚠️ Change stream broke ({e}), resuming (attempt {failures}/{CHANGESTREAM_RETRIES})")
+                await asyncio.sleep(CHANGESTREAM_RETRY_SECONDS * failures)
+
+
+async def _supports_change_streams() -> bool:
+    try:
+        hello = await db.command("hello")
+    except Exception:
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+
+def sse_format(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+EVENT_MESSAGE = "events.emitted"
+SOURCE_MESSAGE = "events.source"
+
+hub = EventHub()
+bus.subscribe(EVENT_MESSAGE, hub._relay)
+bus.subscribe(SOURCE_MESSAGE, hub._source_switched)
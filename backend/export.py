@@ -0,0 +1,229 @@
+import asyncio
+import csv
+import heapq
+import io
+import zlib
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional
+
+from pymongo import ASCENDING
+
+# LOCAL IMPORTS
+from archive import ARCHIVED_STATUSES, order_archive
+from database import db
+from responses import dumps, rename_id
+
+# ==========================
+# ORDER HISTORY EXPORT (streaming)
+# ==========================
+# End-of-day / month-end reporting reads every order in a date range, which
+# can be far more than a listing page. Instead of `to_list()`, the export
+# opens one cursor per collection the range touches (`orders` plus the
+# archive months) and merges them on (createdAt, _id):
+#
+#   live ----\
+#   2026_09 --> heap (one document per cursor) -> encode -> [gzip] -> chunks
+#   2026_10 --/
+#
+# Cursors fetch EXPORT_BATCH documents per round trip and a chunk is handed
+# to the response every EXPORT_BATCH documents, so memory stays the same
+# whether the range holds fifty orders or five hundred thousand.
+#
+# Formats:
+#   ndjson  one order per line, as the API returns it
+#   csv     rows="orders": one row per order
+#           rows="items":  one row per order line (for item-level sales)
+#
+# gzip=True compresses on the fly (one deflate stream, flushed at the end).
+#
+# CLI:  python export.py --start 2026-10-01 --end 2026-11-01 --format csv --gzip --out october.csv.gz
+
+EXPORT_BATCH = 500
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_ROWS = ("orders", "items")
+
+ORDER_COLUMNS = ["id", "createdAt", "updatedAt", "tableId", "guestName", "type", "status",
+                 "itemCount", "subtotal", "totalAmount"]
+ITEM_COLUMNS = ["orderId", "createdAt", "tableId", "guestName", "orderStatus",
+                "name", "quantity", "price", "lineTotal", "status", "notes"]
+
+
+def _sort_key(doc: dict):
+    # Same order as Mongo's sort: missing createdAt (legacy docs) first
+    created = doc.get("createdAt")
+    return (created is not None, created or "", doc["_id"])
+
+
+def _collections(start: Optional[str], end: Optional[str], statuses: Optional[set]) -> list:
+    collections = [db.orders]
+    # Archived orders are all paid / cancelled
+    if not statuses or statuses & set(ARCHIVED_STATUSES):
+        collections += [order_archive.collection(m) for m in order_archive.months_for(start, end)]
+    return collections
+
+
+def _query(start: Optional[str], end: Optional[str], statuses: Optional[set]) -> dict:
+    query = {}
+    if start or end:
+        query["createdAt"] = {k: v for k, v in (("$gte", start), ("$lt", end)) if v}
+    if statuses:
+        query["status"] = next(iter(statuses)) if len(statuses) == 1 else {"$in": sorted(statuses)}
+    return query
+
+
+async def _next(cursor) -> Optional[dict]:
+    try:
+        return await cursor.next()
+    except StopAsyncIteration:
+        return None
+
+
+async def iter_orders(start: Optional[str] = None, end: Optional[str] = None,
+                      statuses: Optional[set] = None) -> AsyncIterator[dict]:
+    """Every order created in [start, end), live and archived, oldest first"""
+    query = _query(start, end, statuses)
+    sort = [("createdAt", ASCENDING), ("_id", ASCENDING)]
+    cursors = [c.find(query).sort(sort).batch_size(EXPORT_BATCH) for c in _collections(start, end, statuses)]
+    try:
+        heap = []
+        for i, cursor in enumerate(cursors):
+            doc = await _next(cursor)
+            if doc is not None:
+                heap.append((_sort_key(doc), i, doc))
+        heapq.heapify(heap)
+        while heap:
+            _, i, doc = heap[0]
+            following = await _next(cursors[i])
+            if following is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (_sort_key(following), i, following))
+            yield doc
+    finally:
+        # Client went away mid-export: don't leave server-side cursors open
+        await asyncio.gather(*(cursor.close() for cursor in cursors), return_exceptions=True)
+
+
+# --- Encoders: one document -> the rows / lines it becomes ---
+def _order_row(order: dict) -> list:
+    items = order.get("items") or []
+    return [order["id"], order.get("createdAt"), order.get("updatedAt"), order.get("tableId"),
+            order.get("guestName"), order.get("type"), order.get("status"),
+            sum(item.get("quantity") or 0 for item in items),
+            order.get("subtotal"), order.get("totalAmount")]
+
+
+def _item_rows(order: dict) -> List[list]:
+    return [
+        [order["id"], order.get("createdAt"), order.get("tableId"), order.get("guestName"), order.get("status"),
+         item.get("name"), item.get("quantity"), item.get("price"),
+         round((item.get("price") or 0) * (item.get("quantity") or 0), 2),
+         item.get("status"), item.get("notes")]
+        for item in order.get("items") or ()
+    ]
+
+
+class _CsvEncoder:
+    def __init__(self, rows: str):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.rows = rows
+
+    def header(self) -> bytes:
+        self.writer.writerow(ORDER_COLUMNS if self.rows == "orders" else ITEM_COLUMNS)
+        return self.take()
+
+    def add(self, order: dict):
+        if self.rows == "orders":
+            self.writer.writerow(_order_row(order))
+        else:
+            self.writer.writerows(_item_rows(order))
+
+    def take(self) -> bytes:
+        data = self.buffer.getvalue().encode()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+class _NdjsonEncoder:
+    def __init__(self):
+        self.lines = []
+
+    def header(self) -> bytes:
+        return b""
+
+    def add(self, order: dict):
+        self.lines.append(dumps(order))
+        self.lines.append(b"\n")
+
+    def take(self) -> bytes:
+        data, self.lines = b"".join(self.lines), []
+        return data
+
+
+async def stream_orders(start: Optional[str] = None, end: Optional[str] = None, statuses: Optional[set] = None,
+                        format: str = "ndjson", rows: str = "orders", gzip: bool = False) -> AsyncIterator[bytes]:
+    """Encoded export, EXPORT_BATCH orders per chunk"""
+    encoder = _CsvEncoder(rows) if format == "csv" else _NdjsonEncoder()
+    # wbits=31: gzip container, so the output is a plain .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    def emit(data: bytes) -> bytes:
+        return compressor.compress(data) if compressor else data
+
+    chunk = emit(encoder.header())
+    if chunk:
+        yield chunk
+    pending = 0
+    async with aclosing(iter_orders(start, end, statuses)) as orders:
+        async for order in orders:
+            encoder.add(rename_id(order))
+            pending += 1
+            if pending == EXPORT_BATCH:
+                pending = 0
+                chunk = emit(encoder.take())
+                if chunk:  # The compressor may still be holding the whole batch
+                    yield chunk
+    chunk = emit(encoder.take()) + (compressor.flush() if compressor else b"")
+    if chunk:
+        yield chunk
+
+
+def filename(start: Optional[str], end: Optional[str], format: str, gzip: bool) -> str:
+    name = f"orders_{(start or 'all')[:10]}_{(end or 'now')[:10]}.{format}"
+    return name + ".gz" if gzip else name
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import database
+
+    parser = argparse.ArgumentParser(description="Stream order history (live + archive) to a file")
+    parser.add_argument("--start", help="createdAt >= (ISO date)")
+    parser.add_argument("--end", help="createdAt < (ISO date)")
+    parser.add_argument("--status", help="comma-separated statuses, e.g. paid")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="ndjson")
+    parser.add_argument("--rows", choices=EXPORT_ROWS, default="orders", help="csv only: a row per order or per item")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--out", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    statuses = {s.strip() for s in args.status.split(",") if s.strip()} if args.status else None
+    database.connect()
+
+    async def export():
+        await order_archive.load()
+        out = open(args.out, "wb") if args.out else sys.stdout.buffer
+        written = 0
+        try:
+            async for chunk in stream_orders(args.start, args.end, statuses, args.format, args.rows, args.gzip):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if args.out:
+                out.close()
+        print(f"📤 EXPORTED {written} bytes to {args.out or 'stdout'}", file=sys.stderr)
+
+    asyncio.run(export())
@@ -0,0 +1,127 @@
+import asyncio
+import sys
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+# LOCAL IMPORTS
+from database import db
+
+# ==========================
+# INDEX REGISTRY
+# ==========================
+# Every hot route query must be served by one of these. Applied on startup
+# (create_indexes is a no-op for indexes that already exist) and verified
+# with `python indexes.py --check`, which explains each entry of
+# ROUTE_QUERIES and fails if any of them falls back to a COLLSCAN.
+
+ACTIVE_EXCLUDED = ["paid", "cancelled"]
+ACTIVE_STATUSES = ["placed", "ready", "served"]
+
+INDEXES = {
+    "orders": [
+        # place_order / table registry refresh ($nin) and settle_table ($ne), newest first
+        IndexModel([("tableId", ASCENDING), ("status", ASCENDING), ("_id", DESCENDING)],
+                   name="table_status_recent"),
+        # place_order upserts: at most one open ticket per table
+        # (partial $in needs MongoDB 6.0+; created on its own so an older
+        # server only loses this one, with a warning)
+        IndexModel([("tableId", ASCENDING)], name="one_active_order_per_table", unique=True,
+                   partialFilterExpression={"status": {"$in": ACTIVE_STATUSES}}),
+        # get_orders?status=..., get_orders?status=...&since=..., table registry hydrate
+        IndexModel([("status", ASCENDING), ("revision", ASCENDING)], name="status_revision"),
+        # get_orders?start=...&end=... (date range pages), export_orders
+        IndexModel([("createdAt", ASCENDING), ("_id", ASCENDING)], name="created_at"),
+        # get_orders?since=... (delta sync)
+        IndexModel([("revision", ASCENDING)], name="revision"),
+        # outbox replays: did this journaled order already go in?
+        IndexModel([("idempotencyKeys", ASCENDING)], name="idempotency_keys", sparse=True),
+    ],
+    "users": [
+        # check_user / login_user
+        IndexModel([("phone", ASCENDING)], name="phone_unique", unique=True),
+    ],
+}
+
+# (route, collection, filter, sort) - one entry per query shape a route issues
+ROUTE_QUERIES = [
+    ("place_order", "orders", {"tableId": 1, "status": {"$nin": ACTIVE_EXCLUDED}}, None),
+    ("table_registry(refresh)", "orders", {"tableId": 1, "status": {"$nin": ACTIVE_EXCLUDED}}, {"_id": -1}),
+    ("table_registry(hydrate)", "orders", {"status": {"$nin": ACTIVE_EXCLUDED}}, {"_id": 1}),
+    ("settle_table", "orders", {"tableId": 1, "status": {"$ne": "paid"}}, None),
+    ("settle_table(rollup)", "orders", {"tableId": 1, "status": "paid", "revision": 1}, None),
+    ("get_orders(status)", "orders", {"status": "placed"}, None),
+    ("kitchen_eta", "orders", {"status": "placed", "type": {"$ne": "request"}}, None),
+    ("analytics_summary(recent)", "orders", {"status": "paid"}, {"revision": -1}),
+    ("get_orders(since)", "orders", {"revision": {"$gt": 0}}, {"revision": 1}),
+    ("get_orders(status, since)", "orders", {"status": "placed", "revision": {"$gt": 0}}, {"revision": 1}),
+    ("get_orders(range)", "orders", {"createdAt": {"$gte": "2026-01-01", "$lt": "2026-01-02"}}, {"_id": 1}),
+    ("export_orders", "orders", {"createdAt": {"$gte": "2026-01-01", "$lt": "2026-02-01"}}, {"createdAt": 1, "_id": 1}),
+    ("outbox(recheck)", "orders", {"idempotencyKeys": "0000"}, None),
+    ("check_user", "users", {"phone": "0000000000"}, None),
+    ("login_user", "users", {"phone": "0000000000"}, None),
+]
+
+
+async def ensure_indexes():
+    for collection, models in INDEXES.items():
+        # Partial indexes go one by one: a server that can't build one
+        # (older MongoDB, unsupported filter) would fail the whole batch
+        partial = [m for m in models if "partialFilterExpression" in m.document]
+        plain = [m for m in models if "partialFilterExpression" not in m.document]
+        try:
+            await db[collection].create_indexes(plain)
+        except OperationFailure as e:
+            # e.g. duplicate phones in legacy data block the unique index;
+            # keep serving and let `--check` surface it.
+            print(f"❌ INDEX BOOTSTRAP FAILED on {collection}: {e}")
+        for model in partial:
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                print(f"❌ PARTIAL INDEX {model.document['name']} NOT CREATED on {collection} "
+                      f"(needs MongoDB 6.0+ for $in filters): {e}")
+                if model.document["name"] == "one_active_order_per_table":
+                    print("   racing first orders on an empty table can open two tickets")
+    print(f"🗂️  INDEXES READY: {sum(len(m) for m in INDEXES.values())} registered")
+
+
+def _has_collscan(plan) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(v) for v in plan)
+    return False
+
+
+async def explain_route_queries() -> list:
+    """Returns [(route, winning_plan_uses_collscan)] for every registered query."""
+    results = []
+    for route, collection, query_filter, sort in ROUTE_QUERIES:
+        find = {"find": collection, "filter": query_filter}
+        if sort:
+            find["sort"] = sort
+        explained = await db.command({"explain": find, "verbosity": "queryPlanner"})
+        winning = explained["queryPlanner"]["winningPlan"]
+        results.append((route, _has_collscan(winning)))
+    return results
+
+
+async def check() -> int:
+    await ensure_indexes()
+    failures = 0
+    for route, collscan in await explain_route_queries():
+        print(f"{'❌ COLLSCAN' if collscan else '✅ IXSCAN  '}  {route}")
+        failures += collscan
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    import database
+
+    database.connect()
+    if "--check" in sys.argv:
+        sys.exit(asyncio.run(check()))
+    asyncio.run(ensure_indexes())
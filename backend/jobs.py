@@ -0,0 +1,138 @@
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ==========================
+# BACKGROUND JOB QUEUE
+# ==========================
+# Side effects that the guest doesn't wait for (rollups, registry
+# re-reads, prep-time stats, log lines) are queued here, so a write route
+# answers as soon as its primary Mongo write is done.
+#
+#   jobs.submit(name, fn, *args)             - never waits; when the queue
+#                                              is full the policy decides:
+#                                              "drop" the new job (default)
+#                                              or "drop_oldest" queued one
+#   await jobs.submit_wait(name, fn, *args)  - backpressure: waits for room
+#                                              (for jobs we must not lose)
+#
+# JOB_WORKERS workers run jobs; a failing job is retried up to `attempts`
+# times with exponential backoff + jitter. On shutdown the queue stops
+# taking work and drains for up to JOB_DRAIN_SECONDS.
+#
+# Jobs run after the response: they must be safe to retry and must not be
+# needed by the very next read (keep those writes in the route).
+
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "1000"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "10"))
+JOB_RETRY_BASE_SECONDS = 0.5
+JOB_ATTEMPTS = 3
+
+
+class Job:
+    __slots__ = ("name", "fn", "args", "attempts", "enqueued_at")
+
+    def __init__(self, name: str, fn: Callable, args: tuple, attempts: int):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.attempts = attempts
+        self.enqueued_at = time.monotonic()
+
+
+class JobQueue:
+    def __init__(self, capacity: int = JOB_QUEUE_SIZE, workers: int = JOB_WORKERS):
+        self.capacity = capacity
+        self.worker_count = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self.accepting = False
+        self.outcomes: Dict[Tuple[str, str], int] = defaultdict(int)  # (job, done|failed|retried|dropped|rejected)
+        self.busy = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    # --- Enqueueing ---
+    def submit(self, name: str, fn: Callable, *args, policy: str = "drop", attempts: int = JOB_ATTEMPTS) -> bool:
+        """Queue `fn(*args)` (sync or async) without waiting; False if it was dropped"""
+        if not self.accepting:
+            self.outcomes[(name, "rejected")] += 1
+            return False
+        job = Job(name, fn, args, attempts)
+        if self._queue.full():
+            if policy != "drop_oldest":
+                self.outcomes[(name, "dropped")] += 1
+                return False
+            evicted = self._queue.get_nowait()
+            self._queue.task_done()
+            self.outcomes[(evicted.name, "dropped")] += 1
+        self._queue.put_nowait(job)
+        return True
+
+    async def submit_wait(self, name: str, fn: Callable, *args, attempts: int = JOB_ATTEMPTS) -> bool:
+        """Queue `fn(*args)`, waiting for room when the queue is full"""
+        if not self.accepting:
+            self.outcomes[(name, "rejected")] += 1
+            return False
+        await self._queue.put(Job(name, fn, args, attempts))
+        return True
+
+    # --- Workers ---
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            self.busy += 1
+            try:
+                await self._run(job)
+            finally:
+                self.busy -= 1
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        for attempt in range(1, job.attempts + 1):
+            try:
+                result = job.fn(*job.args)
+                if asyncio.iscoroutine(result):
+                    await result
+                self.outcomes[(job.name, "done")] += 1
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == job.attempts:
+                    self.outcomes[(job.name, "failed")] += 1
+                    print(f"❌ Job {job.name} failed after {attempt} attempts: {e}")
+                    return
+                self.outcomes[(job.name, "retried")] += 1
+                delay = JOB_RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
+    # --- Lifecycle ---
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.capacity)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.worker_count)]
+        self.accepting = True
+        print(f"🧵 JOB QUEUE: {self.worker_count} workers, capacity {self.capacity}")
+
+    async def stop(self, timeout: float = JOB_DRAIN_SECONDS):
+        """Stop taking jobs, let queued ones finish (up to `timeout`), then stop the workers"""
+        self.accepting = False
+        if not self._queue:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"❌ Job queue drain timed out: {self.depth} queued, {self.busy} running abandoned")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+jobs = JobQueue()
@@ -0,0 +1,296 @@
+import asyncio
+import heapq
+import os
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+# LOCAL IMPORTS
+from bus import bus
+from database import db
+from menu_cache import MenuSnapshot, menu_cache
+
+# ==========================
+# KITCHEN THROUGHPUT + ETA
+# ==========================
+# Order items carry their transition times (placedAt / readyAt / servedAt,
+# written by the order pipelines). Every transition a write makes feeds one
+# observation into a quantile sketch per menu item, per category and for
+# the whole kitchen:
+#
+#   prep - placedAt -> readyAt   (kitchen)
+#   pass - readyAt  -> servedAt  (waiting at the pass for service)
+#
+# A sketch is a fixed set of log-spaced buckets (~7% apart, 15s .. 4h)
+# whose weights halve every PREP_HALF_LIFE_MINUTES, so tonight's rush
+# outweighs last week. Adding an observation and reading a quantile both
+# touch the same ~50 floats: constant time and memory, no history scans.
+#
+# /api/kitchen/eta replays the open queue (pending items, oldest first)
+# over KITCHEN_STATIONS parallel stations using the p50 / p90 prep times,
+# falling back item -> category -> MenuItem.prepTime -> whole kitchen
+# while a sketch has fewer than MIN_SAMPLES observations.
+#
+# Sketches are shared with the other workers over the cluster bus and
+# flushed to `kitchen_stats` every KITCHEN_FLUSH_SECONDS, so a restart
+# keeps what was learnt.
+
+PREP_HALF_LIFE_MINUTES = float(os.getenv("PREP_HALF_LIFE_MINUTES", "180"))
+KITCHEN_STATIONS = int(os.getenv("KITCHEN_STATIONS", "4"))
+KITCHEN_FLUSH_SECONDS = int(os.getenv("KITCHEN_FLUSH_SECONDS", "60"))
+MIN_SAMPLES = 5
+DEFAULT_PREP_SECONDS = 15 * 60
+
+BUCKET_EDGES = []  # Upper bounds in seconds
+_edge = 15.0
+while _edge < 4 * 3600:
+    BUCKET_EDGES.append(round(_edge, 1))
+    _edge *= 1.15
+# Representative value per bucket (geometric midpoint; the last one is open-ended)
+_MIDPOINTS = [BUCKET_EDGES[0] / 1.07] + [(a * b) ** 0.5 for a, b in zip(BUCKET_EDGES, BUCKET_EDGES[1:])] + [BUCKET_EDGES[-1]]
+
+
+class DecayingSketch:
+    __slots__ = ("weights", "stamp")
+
+    def __init__(self, weights: Optional[List[float]] = None, stamp: float = 0.0):
+        self.weights = weights or [0.0] * (len(BUCKET_EDGES) + 1)
+        self.stamp = stamp  # Wall clock the weights are expressed at
+
+    def _factor(self, now: float) -> float:
+        return 0.5 ** (max(now - self.stamp, 0) / (PREP_HALF_LIFE_MINUTES * 60))
+
+    def add(self, seconds: float, now: float):
+        factor = self._factor(now)
+        if factor < 1:
+            self.weights = [w * factor for w in self.weights]
+        self.stamp = now
+        self.weights[bisect_left(BUCKET_EDGES, seconds)] += 1.0
+
+    def count(self, now: float) -> float:
+        """Effective (decayed) number of observations"""
+        return sum(self.weights) * self._factor(now)
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = sum(self.weights)  # Decay scales every bucket alike, so ranks don't need it
+        if not total:
+            return None
+        running = 0.0
+        for i, weight in enumerate(self.weights):
+            running += weight
+            if running >= q * total:
+                return _MIDPOINTS[i]
+        return _MIDPOINTS[-1]
+
+
+# --- Item lines -> category, per menu snapshot version ---
+class _Categories:
+    def __init__(self, snapshot: MenuSnapshot):
+        self.version = snapshot.version
+        self.by_name = {item.name.strip().lower(): item for item in snapshot.items}
+
+
+def _parse(iso: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(iso) if iso else None
+    except (TypeError, ValueError):
+        return None
+
+
+class KitchenStats:
+    def __init__(self):
+        self.sketches: Dict[Tuple[str, str, str], DecayingSketch] = {}  # (metric, scope, key)
+        self._dirty = set()
+        self._categories: Optional[_Categories] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def _menu(self) -> _Categories:
+        snapshot = await menu_cache.get()
+        if not self._categories or self._categories.version != snapshot.version:
+            self._categories = _Categories(snapshot)
+        return self._categories
+
+    # --- Observing ---
+    def _add(self, observations: List[list]):
+        now = time.time()
+        for metric, name, category, seconds in observations:
+            for scope, key in (("item", name), ("category", category), ("all", "")):
+                if key is None:
+                    continue
+                sketch_key = (metric, scope, key)
+                self.sketches.setdefault(sketch_key, DecayingSketch()).add(seconds, now)
+                self._dirty.add(sketch_key)
+
+    async def observe(self, order: Optional[dict], at: str):
+        """Record the transitions a write made at `at` (the timestamp it gave the items)"""
+        if not order:
+            return
+        menu = await self._menu()
+        observations = []
+        for item in order.get("items") or ():
+            if item.get("readyAt") == at:
+                metric, start, end = "prep", item.get("placedAt") or order.get("createdAt"), at
+            elif item.get("servedAt") == at:
+                metric, start, end = "pass", item.get("readyAt"), at
+            else:
+                continue
+            started, ended = _parse(start), _parse(end)
+            if not started or ended < started:
+                continue
+            name = (item.get("name") or "").strip().lower()
+            menu_item = menu.by_name.get(name)
+            observations.append([metric, name, menu_item.category if menu_item else None,
+                                 (ended - started).total_seconds()])
+        if observations:
+            self._add(observations)
+            bus.publish(KITCHEN_OBSERVED, {"observations": observations})
+
+    # --- Estimating ---
+    def _estimate(self, metric: str, name: str, menu_item, q: float) -> float:
+        now = time.time()
+        for scope, key in (("item", name), ("category", menu_item.category if menu_item else None)):
+            sketch = self.sketches.get((metric, scope, key))
+            if sketch and sketch.count(now) >= MIN_SAMPLES:
+                return sketch.quantile(q)
+        if metric == "prep" and menu_item and menu_item.prepTime:
+            return menu_item.prepTime * 60 * (1.0 if q <= 0.5 else 1.5)
+        sketch = self.sketches.get((metric, "all", ""))
+        if sketch and sketch.count(now) >= MIN_SAMPLES:
+            return sketch.quantile(q)
+        return DEFAULT_PREP_SECONDS * (1.0 if q <= 0.5 else 1.5)
+
+    def _replay(self, lines: list, now: datetime, q: float) -> Dict[int, datetime]:
+        """Finish time per queued line: FIFO over KITCHEN_STATIONS parallel stations"""
+        stations = [now] * KITCHEN_STATIONS
+        finished = {}
+        for i, (placed, name, menu_item) in enumerate(lines):
+            prep = timedelta(seconds=self._estimate("prep", name, menu_item, q))
+            free = heapq.heappop(stations)
+            if free <= now:
+                # Assume a free station has been on it since it came in
+                finish = max(placed + prep, now)
+            else:
+                finish = free + prep
+            finished[i] = finish
+            heapq.heappush(stations, finish)
+        return finished
+
+    async def eta(self, orders: list) -> dict:
+        """Predicted ready time of every open ticket from the queue as it stands"""
+        now = datetime.now()
+        menu = await self._menu()
+        lines, owners = [], []
+        for order in orders:
+            for item in order.get("items") or ():
+                if (item.get("status") or "pending") != "pending":
+                    continue
+                placed = _parse(item.get("placedAt") or order.get("createdAt")) or now
+                name = (item.get("name") or "").strip().lower()
+                lines.append((placed, name, menu.by_name.get(name)))
+                owners.append((order, item))
+        order_of_line = sorted(range(len(lines)), key=lambda i: lines[i][0])
+        queue = [lines[i] for i in order_of_line]
+        p50, p90 = self._replay(queue, now, 0.5), self._replay(queue, now, 0.9)
+
+        tickets = {}
+        for position, i in enumerate(order_of_line):
+            order, item = owners[i]
+            order_id = str(order.get("id") or order.get("_id"))
+            ticket = tickets.setdefault(order_id, {
+                "orderId": order_id, "tableId": order.get("tableId"), "guestName": order.get("guestName"),
+                "readyAt": now, "readyAtP90": now, "items": [],
+            })
+            ticket["readyAt"] = max(ticket["readyAt"], p50[position])
+            ticket["readyAtP90"] = max(ticket["readyAtP90"], p90[position])
+            ticket["items"].append({"name": item.get("name"), "quantity": item.get("quantity"),
+                                    "readyInSeconds": round((p50[position] - now).total_seconds())})
+
+        for ticket in tickets.values():
+            ticket["readyInSeconds"] = round((ticket["readyAt"] - now).total_seconds())
+            ticket["readyInSecondsP90"] = round((ticket["readyAtP90"] - now).total_seconds())
+            ticket["readyAt"] = ticket["readyAt"].isoformat()
+            ticket["readyAtP90"] = ticket["readyAtP90"].isoformat()
+        return {
+            "generatedAt": now.isoformat(),
+            "stations": KITCHEN_STATIONS,
+            "queueDepth": len(lines),
+            "tickets": sorted(tickets.values(), key=lambda t: t["readyAt"]),
+        }
+
+    async def prep_times(self) -> list:
+        """Observed prep / pass quantiles per menu item next to the listed prepTime"""
+        now = time.time()
+        menu = await self._menu()
+        report = []
+        for name, menu_item in sorted(menu.by_name.items()):
+            row = {"name": menu_item.name, "category": menu_item.category, "prepTime": menu_item.prepTime}
+            for metric in ("prep", "pass"):
+                sketch = self.sketches.get((metric, "item", name))
+                row[metric] = {
+                    "samples": round(sketch.count(now), 1),
+                    "p50Seconds": sketch.quantile(0.5),
+                    "p90Seconds": sketch.quantile(0.9),
+                } if sketch else None
+            report.append(row)
+        return report
+
+    # --- Persistence ---
+    async def load(self):
+        async for doc in db.kitchen_stats.find():
+            self.sketches[(doc["metric"], doc["scope"], doc["key"])] = DecayingSketch(doc["weights"], doc["stamp"])
+        print(f"⏱️  KITCHEN STATS: {len(self.sketches)} sketches")
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        ops = []
+        for metric, scope, key in dirty:
+            sketch = self.sketches[(metric, scope, key)]
+            ops.append(UpdateOne(
+                {"_id": f"{metric}|{scope}|{key}"},
+                {"$set": {"metric": metric, "scope": scope, "key": key,
+                          "weights": sketch.weights, "stamp": sketch.stamp}},
+                upsert=True,
+            ))
+        try:
+            await db.kitchen_stats.bulk_write(ops, ordered=False)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+    async def start(self):
+        await self.load()
+        self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"❌ Kitchen stats not saved on shutdown: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(KITCHEN_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Kitchen stats flush failed: {e}")
+
+
+KITCHEN_OBSERVED = "kitchen.observed"
+
+kitchen_stats = KitchenStats()
+bus.subscribe(KITCHEN_OBSERVED, lambda message: kitchen_stats._add(message["observations"]))
@@ -1,18 +1,79 @@
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 import uvicorn
 from datetime import datetime
 import uuid
+import json
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import List, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pydantic import ValidationError
 
 # LOCAL IMPORTS
+import database
 from database import db
-from models import MenuItem, Order, OrderCreate, OrderItem
+from bus import bus
+from models import BulkMenuPatch, BulkOrderStatus, MenuItem, MenuItemUpdate, Order, OrderCreate, OrderItem
+from sync import order_clock, stamp
+from events import hub, sse_format
+from coalesce import coalescer
+from menu_cache import menu_cache
+from recommendations import Profile, engine as recommender
+from search import search_index
+from tables import table_registry
+from archive import ARCHIVED_STATUSES, order_archive
+from stock import OutOfStock, reserve as reserve_stock
+from kitchen import kitchen_stats
+from jobs import jobs
+from outbox import Rejected, order_outbox
+import export
+from responses import dumps, json_response, model_response, rename_id
+from indexes import ACTIVE_EXCLUDED, ensure_indexes
+import admission
+import analytics
+import metrics
+import outbox
+
+# --- LIFESPAN: data layer first up, last down ---
+# serve.py builds indexes and seeds once before forking workers (SETUP_DONE=1)
+SETUP_DONE = os.getenv("SETUP_DONE", "0") == "1"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.connect()
+    await database.warm_up()
+    await jobs.start()
+    if not SETUP_DONE:
+        await ensure_indexes()
+        await seed_data()
+        await analytics.backfill_if_empty()
+    await bus.start()  # Before loading state, so nothing published meanwhile is missed
+    await menu_cache.get()  # Prime the snapshot the first tablets will read
+    await table_registry.hydrate()
+    await hub.start()
+    await order_archive.start()
+    await kitchen_stats.start()
+    if outbox.OUTBOX_ENABLED:
+        await order_outbox.start(_apply_journaled)  # Replays whatever the last run left journaled
+    await admission.gate.start()
+    yield
+    await admission.gate.stop()
+    await order_outbox.stop()  # Flush journaled orders while Mongo and the job queue are still up
+    await jobs.stop()  # Drain side effects while Mongo is still up
+    await kitchen_stats.stop()
+    await order_archive.stop()
+    await hub.stop()
+    await bus.stop()
+    database.close()
 
-app = FastAPI(title="DineAI Backend")
+app = FastAPI(title="DineAI Backend", lifespan=lifespan)
 
 # --- CORS CONFIGURATION (Security Bridge) ---
-import os
 origins = [
     "http://localhost:5173",    # Vite Dev Server
     "http://127.0.0.1:5173",    # Vite Dev Server (IP)
@@ -27,6 +88,9 @@ if frontend_url:
     # Also allow Vercel preview deployments (optional, but helpful)
     origins.append("https://*.vercel.app") 
 
+# --- ADMISSION CONTROL (rate limits + load shedding; innermost, so 429/503 get CORS headers and metrics) ---
+app.add_middleware(admission.AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -35,8 +99,10 @@ app.add_middleware(
     allow_headers=["*"],        # Allow all headers
 )
 
+# --- METRICS (latency histograms + Mongo command stats, served at /metrics) ---
+app.add_middleware(metrics.MetricsMiddleware)
+
 # --- STARTUP: SEED DATA ---
-@app.on_event("startup")
 async def seed_data():
     count = await db.menu.count_documents({})
     if count == 0:
@@ -87,26 +153,80 @@ async def seed_data():
         ]
         # Insert all
         await db.menu.insert_many([item.model_dump(by_alias=True, exclude=["id"]) for item in initial_menu])
+        menu_cache.invalidate()
         print("✅ SEEDED 4 ITEMS")
 
+# Liveness: the process is up (no database call)
 @app.get("/")
 def health_check():
     return {"status": "online", "system": "DineAI Mongo Core"}
 
+# Readiness: Mongo reachable, pool + replica set view, in-memory state loaded
+@app.get("/health/ready")
+async def readiness_check():
+    report = await database.status()
+    report["tableRegistry"] = table_registry.hydrated
+    report["eventSource"] = hub.source
+    report["clusterBus"] = bus.status()
+    report["outbox"] = order_outbox.status()
+    return json_response(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- MENU ROUTES ---
 @app.get("/api/menu", response_model=List[MenuItem], response_model_by_alias=False)
-async def get_menu():
-    return await db.menu.find().to_list(1000)
+async def get_menu(request: Request):
+    # Served from the in-memory snapshot; tablets revalidate with If-None-Match
+    snapshot = await menu_cache.get()
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if snapshot.etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(snapshot.gzip_body, media_type="application/json",
+                        headers={**headers, "Content-Encoding": "gzip"})
+    return Response(snapshot.body, media_type="application/json", headers=headers)
+
+@app.get("/api/menu/recommendations")
+async def get_recommendations(
+    moods: Optional[str] = None,
+    goals: Optional[str] = None,
+    diet: Optional[str] = None,
+    allergens: Optional[str] = None,
+    category: Optional[str] = None,
+    top: Optional[int] = None,
+    includeUnavailable: bool = False,
+):
+    """Personalized ranking (comma-separated moods / goals / allergens). Allergen matches are excluded."""
+    snapshot = await menu_cache.get()
+    profile = Profile(moods=moods, goals=goals, dietary=diet, allergens=allergens)
+    return json_response(recommender.recommend(snapshot, profile, top=top, category=category,
+                                               include_unavailable=includeUnavailable))
+
+@app.get("/api/menu/search")
+async def search_menu(q: str = "", limit: int = Query(20, ge=1, le=100), includeUnavailable: bool = True):
+    """Ranked prefix / typo-tolerant search over name, description, category, tags, heroIngredient"""
+    if not search_index.built:
+        search_index.build(await menu_cache.get())
+    return json_response(search_index.search(q, limit=limit, include_unavailable=includeUnavailable))
 
 @app.post("/api/menu", response_model=MenuItem, response_model_by_alias=False)
 async def add_menu_item(item: MenuItem):
     # Exclude ID so Mongo generates it
     new_item = await db.menu.insert_one(item.model_dump(by_alias=True, exclude=["id"]))
+    menu_cache.invalidate()
     created_item = await db.menu.find_one({"_id": new_item.inserted_id})
-    return created_item
+    search_index.upsert(created_item)
+    return model_response(created_item, MenuItem)
 
 @app.patch("/api/menu/{item_id}", response_model=MenuItem, response_model_by_alias=False)
-async def update_menu_item(item_id: str, updates: dict):
+async def update_menu_item(item_id: str, updates: MenuItemUpdate):
     # Convert string ID to ObjectId isn't strictly needed if we query by string if we stored as string
     # But wait, PyObjectId stores as ObjectId in DB? 
     # Yes, PyObjectId logic handles validation. But for find_one with _id, we might need ObjectId(id) wrapper
@@ -115,37 +235,43 @@ async def update_menu_item(item_id: str, updates: dict):
     # But for search queries? We should probably try-catch ObjectId conversion.
     # actually, with PyObjectId, it might be safer to let Pydantic handle it?
     # Simple MVP approach: Pymongo needs ObjectId.
-    
-    # Let's import ObjectId
-    from bson import ObjectId
     try:
         oid = ObjectId(item_id)
     except:
         raise HTTPException(400, "Invalid ID format")
+    patch = updates.model_dump(exclude_unset=True)
+    if not patch:
+        raise HTTPException(400, "Empty patch")
 
-    await db.menu.update_one({"_id": oid}, {"$set": updates})
-    updated = await db.menu.find_one({"_id": oid})
-    if updated: return updated
-    raise HTTPException(404, "Item not found")
+    updated = await db.menu.find_one_and_update(
+        {"_id": oid}, {"$set": patch}, return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(404, "Item not found")
+    menu_cache.invalidate()
+    search_index.upsert(updated)
+    return model_response(updated, MenuItem)
 
 @app.patch("/api/menu/{item_id}/toggle", response_model=MenuItem, response_model_by_alias=False)
 async def toggle_item(item_id: str):
-    from bson import ObjectId
     try:
         oid = ObjectId(item_id)
     except:
         raise HTTPException(400, "Invalid ID")
         
-    item = await db.menu.find_one({"_id": oid})
+    # Flip server-side so two staff toggling at once can't both write the same value
+    item = await db.menu.find_one_and_update(
+        {"_id": oid},
+        [{"$set": {"isAvailable": {"$not": [{"$ifNull": ["$isAvailable", True]}]}}}],
+        return_document=ReturnDocument.AFTER,
+    )
     if not item: raise HTTPException(404, "Not Found")
-    
-    new_status = not item.get("isAvailable", True)
-    await db.menu.update_one({"_id": oid}, {"$set": {"isAvailable": new_status}})
-    return await db.menu.find_one({"_id": oid})
+    menu_cache.invalidate()
+    search_index.upsert(item)
+    return model_response(item, MenuItem)
 
 @app.delete("/api/menu/{item_id}")
 async def delete_menu_item(item_id: str):
-    from bson import ObjectId
     try:
         oid = ObjectId(item_id)
     except:
@@ -154,174 +280,518 @@ async def delete_menu_item(item_id: str):
     result = await db.menu.delete_one({"_id": oid})
     if result.deleted_count == 0:
         raise HTTPException(404, "Item not found")
+    menu_cache.invalidate()
+    search_index.remove(item_id)
     return {"status": "deleted", "id": item_id}
 
+# --- BULK MUTATIONS (one bulk_write per batch, per-entry results) ---
+MAX_BULK_UPDATES = 500
+
+def _bulk_write_errors(e: BulkWriteError) -> dict:
+    """op index -> error message"""
+    return {err["index"]: err.get("errmsg", "Write failed") for err in e.details.get("writeErrors", [])}
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+def _bulk_oids(ids: list, results: list) -> dict:
+    """entry index -> ObjectId for valid ids; invalid ones get their result filled in"""
+    if len(ids) > MAX_BULK_UPDATES:
+        raise HTTPException(400, f"Too many updates (max {MAX_BULK_UPDATES})")
+    oids = {}
+    for i, raw in enumerate(ids):
+        try:
+            oids[i] = ObjectId(raw)
+        except:
+            results[i] = {"id": raw, "ok": False, "error": "Invalid ID"}
+    return oids
+
+@app.post("/api/menu/bulk-update")
+async def bulk_update_menu(body: BulkMenuPatch):
+    """Apply many (item id, patch) edits - e.g. end-of-shift stock - in one round trip"""
+    results = [None] * len(body.updates)
+    oids = _bulk_oids([u.id for u in body.updates], results)
+
+    op_entries, ops = [], []
+    for i, oid in oids.items():
+        try:
+            # Validated per entry: one bad patch fails its own result, not the batch
+            patch = MenuItemUpdate.model_validate(body.updates[i].patch).model_dump(exclude_unset=True)
+        except ValidationError as e:
+            results[i] = {"id": body.updates[i].id, "ok": False, "error": _validation_message(e)}
+            continue
+        if not patch:
+            results[i] = {"id": body.updates[i].id, "ok": False, "error": "Empty patch"}
+            continue
+        op_entries.append(i)
+        ops.append(UpdateOne({"_id": oid}, {"$set": patch}))
+
+    errors = {}
+    if ops:
+        try:
+            await db.menu.bulk_write(ops, ordered=False)  # Items are independent
+        except BulkWriteError as e:
+            errors = _bulk_write_errors(e)
+
+    docs = {d["_id"]: d for d in await db.menu.find({"_id": {"$in": [oids[i] for i in op_entries]}}).to_list(None)}
+    for op_index, i in enumerate(op_entries):
+        doc = docs.get(oids[i])
+        if op_index in errors:
+            results[i] = {"id": body.updates[i].id, "ok": False, "error": errors[op_index]}
+        elif not doc:
+            results[i] = {"id": body.updates[i].id, "ok": False, "error": "Item not found"}
+        else:
+            results[i] = {"id": body.updates[i].id, "ok": True}
+
+    # Once per batch, not per item
+    if docs:
+        menu_cache.invalidate()
+        for doc in docs.values():
+            search_index.upsert(doc)
+    return json_response({"updated": sum(r["ok"] for r in results), "results": results})
+
 # --- Helper: Convert MongoDB order to JSON-safe dict ---
 def serialize_order(order: dict) -> dict:
-    """Convert MongoDB order document to JSON-serializable format"""
-    if not order:
-        return order
-    result = {**order}
-    if "_id" in result:
-        result["id"] = str(result.pop("_id"))
-    return result
+    """Convert MongoDB order document to JSON-serializable format (in place, no copy)"""
+    return rename_id(order)
 
 def serialize_orders(orders: list) -> list:
     """Convert list of MongoDB orders to JSON-serializable format"""
     return [serialize_order(o) for o in orders]
 
+# --- Helper: Order write pipelines (single round trip) ---
+GST_RATE = 0.05
+SERVICE_RATE = 0.025
+
+def _line_total_sum(items_expr):
+    """Aggregation expression: sum(price * quantity) over an items array"""
+    return {"$sum": {"$map": {
+        "input": {"$ifNull": [items_expr, []]},
+        "in": {"$multiply": ["$$this.price", "$$this.quantity"]}
+    }}}
+
+def _item_status(expr):
+    # Old items have no status; they count as pending
+    return {"$ifNull": [expr, "pending"]}
+
+def _merge_order_pipeline(order_in: OrderCreate, revision: int, key: str) -> list:
+    """Upsert-or-merge the table's active order.
+
+    Runs against the active order if there is one, otherwise Mongo inserts it
+    (upsert). `subtotal` is a running total: merges add only the new lines
+    instead of re-summing the ticket (legacy orders without it are summed once).
+    User-supplied values go through $literal so a "$..." note is never
+    read as a field path. The idempotency key is recorded in the same write,
+    so the outbox can tell afterwards whether these lines went in.
+    """
+    fields = stamp(revision)
+    new_items = [{**item.model_dump(exclude={"readyAt", "servedAt"}), "placedAt": fields["updatedAt"]}
+                 for item in order_in.items]
+    added = sum(item["price"] * item["quantity"] for item in new_items)
+    is_new = {"$eq": [{"$ifNull": ["$createdAt", None]}, None]}
+    return [
+        {"$set": {
+            "createdAt": {"$ifNull": ["$createdAt", fields["updatedAt"]]},
+            "type": {"$ifNull": ["$type", {"$literal": order_in.type or "food"}]},  # Default to 'food' for kitchen display
+            "items": {"$concatArrays": [{"$ifNull": ["$items", []]}, {"$literal": new_items}]},
+            "subtotal": {"$add": [{"$ifNull": ["$subtotal", _line_total_sum("$items")]}, added]},
+            "totalAmount": {"$cond": [
+                is_new,
+                order_in.totalAmount or 0,
+                # Merges recalculate with taxes (backend source of truth)
+                {"$multiply": [
+                    {"$add": [{"$ifNull": ["$subtotal", _line_total_sum("$items")]}, added]},
+                    1 + GST_RATE + SERVICE_RATE
+                ]}
+            ]},
+            # Reset status to 'placed' so kitchen sees the 'new' request
+            "status": "placed",
+            "guestName": {"$literal": order_in.guestName},
+            "idempotencyKeys": {"$concatArrays": [{"$ifNull": ["$idempotencyKeys", []]}, {"$literal": [key]}]},
+            "lastEvent": {"$cond": [is_new, "order.created", "order.items_merged"]},
+            **fields
+        }}
+    ]
+
+def _status_transition_pipeline(status: str, revision: int, event_type: str, at: str) -> list:
+    """Item-level transitions + parent status recalculation, in one update.
+
+    Transitioned items get `readyAt` / `servedAt` = `at`, which is also how
+    kitchen_stats picks out the items this write moved.
+    """
+    # "Mark Ready" (Kitchen): Pending -> Ready
+    # "Mark Served" (Service): Ready -> Served
+    transition = {"ready": ("pending", "ready"), "served": ("ready", "served")}.get(status)
+    stages = []
+    if transition:
+        from_status, to_status = transition
+        stages.append({"$set": {"items": {"$map": {
+            "input": {"$ifNull": ["$items", []]},
+            "in": {"$cond": [
+                {"$eq": [_item_status("$$this.status"), from_status]},
+                {"$mergeObjects": ["$$this", {"status": to_status, f"{to_status}At": at}]},
+                "$$this"
+            ]}
+        }}}})
+
+    # Priority: Placed (Kitchen) > Ready (Service) > Served (Done)
+    item_statuses = {"$map": {"input": {"$ifNull": ["$items", []]}, "in": _item_status("$$this.status")}}
+    stages.append({"$set": {
+        "status": {"$switch": {
+            "branches": [
+                {"case": {"$in": ["pending", item_statuses]}, "then": "placed"},
+                {"case": {"$in": ["ready", item_statuses]}, "then": "ready"},
+            ],
+            "default": "served"
+        }},
+        **stamp(revision, event_type)
+    }})
+    return stages
+
 # --- ORDER ROUTES ---
+MAX_IDEMPOTENCY_KEY = 128
+
 @app.post("/api/orders")
-async def place_order(order_in: OrderCreate):
-    # 1. Check for existing ACTIVE session (not paid/cancelled)
-    existing_order = await db.orders.find_one({
-        "tableId": order_in.tableId,
-        "status": {"$nin": ["paid", "cancelled"]}
-    })
+async def place_order(order_in: OrderCreate, request: Request):
+    # Journaled locally first when OUTBOX_PATH is set (see outbox.py), then
+    # written to Mongo in arrival order per table. The guest gets the order back as before when the write
+    # lands within OUTBOX_ACK_SECONDS, otherwise 202 with the queued entry.
+    # A retry with the same Idempotency-Key gets the first attempt's outcome.
+    client_key = request.headers.get("Idempotency-Key")
+    key = client_key or uuid.uuid4().hex
+    if len(key) > MAX_IDEMPOTENCY_KEY:
+        raise HTTPException(400, "Invalid Idempotency-Key")
 
-    if existing_order:
-        print(f"🔄 MERGING ORDER: Table {order_in.tableId} adding items...")
-        
-        # 2. Prepare Updates
-        # Convert new items to dict
-        new_items_data = [item.model_dump() for item in order_in.items]
-        
-        # EXPLICIT APPEND: Ensure we extend the list, not replace it.
-        # Although list + list works, let's be verbose for clarity.
-        current_items = list(existing_order.get('items', []))
-        current_items.extend(new_items_data)
-        updated_items = current_items
-        
-        # 3. Recalculate Totals (Backend Source of Truth)
-        # Calculate Subtotal
-        # Assuming item['price'] is UNIT price.
-        # Safest is to sum (price * quantity) for all items in the accumulated list.
-        # Let's verify standard usage. In `models.py`, `MenuItem` has `price`. `OrderItem` has `price`.
-        # Usually `OrderItem.price` copies `MenuItem.price`.
-        subtotal = sum(item['price'] * item['quantity'] for item in updated_items)
-        
-        gst_rate = 0.05
-        service_rate = 0.025
-        
-        gst_amount = subtotal * gst_rate
-        service_amount = subtotal * service_rate
-        
-        final_total = subtotal + gst_amount + service_amount
-        
-        print(f"💰 RESYNC TOTALS: Sub: {subtotal}, GST: {gst_amount}, Svc: {service_amount}, Total: {final_total}")
-
-        # 4. Perform Update
-        # Reset status to 'placed' so kitchen sees the 'new' request
-        await db.orders.update_one(
-            {"_id": existing_order["_id"]},
-            {
-                "$set": {
-                    "items": updated_items,
-                    "totalAmount": final_total,
-                    "status": "placed", 
-                    "guestName": order_in.guestName 
-                }
-            }
-        )
-        
-        # 4. Return Updated Doc
-        result = await db.orders.find_one({"_id": existing_order["_id"]})
-        return serialize_order(result)
+    if not outbox.OUTBOX_ENABLED:
+        # No journal to find the key in: a client retry is matched against the orders themselves
+        try:
+            return Response(await _write_order(order_in, key, bool(client_key)), media_type="application/json")
+        except Rejected as e:
+            raise HTTPException(e.status_code, e.detail)
+
+    payload = order_in.model_dump_json()
+    entry = await order_outbox.append(key, order_in.tableId, order_in.guestName,
+                                      sum(item.quantity for item in order_in.items), payload)
+    if entry.payload != payload:
+        raise HTTPException(422, "Idempotency-Key was already used for a different order")
+    return _outbox_response(await order_outbox.wait(entry, outbox.OUTBOX_ACK_SECONDS))
 
+def _outbox_response(entry) -> Response:
+    if entry.state == "applied":
+        return Response(entry.result, media_type="application/json")
+    if entry.state == "rejected":
+        error = json.loads(entry.result)
+        raise HTTPException(error["status"], error["detail"])
+    # Still journaled: the order reaches Mongo (and the dashboards) when the flusher gets to it
+    return json_response({**entry.as_pending(), "queued": True, "status": "queued"}, status_code=202)
+
+async def _apply_journaled(entry, recheck: bool) -> bytes:
+    """Outbox flusher -> Mongo, one journaled order at a time"""
+    try:
+        order_in = OrderCreate.model_validate_json(entry.payload)
+    except ValueError as e:
+        raise Rejected(422, str(e))
+    try:
+        return await _write_order(order_in, entry.key, recheck)
+    except Exception as e:
+        rejected = outbox.as_rejection(e)  # None: transient, the flusher retries it
+        if rejected is None:
+            raise
+        hub.emit("order.rejected", tableId=entry.tableId, idempotencyKey=entry.key, detail=rejected.detail)
+        if rejected is e:
+            raise
+        raise rejected from e
+
+# Reservations whose order write failed without telling us whether it went in
+# (network error, timeout): kept, not given back, until a retry with the same
+# key rechecks. Found -> the stock was rightly taken; not found -> the retry
+# writes the order against this reservation instead of reserving again.
+UNCERTAIN_RESERVATIONS = 1000
+_uncertain_reservations = OrderedDict()  # idempotency key -> stock.Reservation
+
+async def _write_order(order_in: OrderCreate, key: str, recheck: bool = False) -> bytes:
+    # Merge into the ACTIVE session (not paid/cancelled) or open a new one.
+    # Two first orders racing on an empty table both try to insert; the
+    # one-active-order-per-table index rejects the loser, whose retry merges.
+    # Stock for every tracked line is reserved first (all or nothing) and
+    # given back if the order write definitely failed.
+    reservation = _uncertain_reservations.pop(key, None)
+    if recheck or reservation:
+        # May have gone in already (before a crash, or a client retry): the order carries its key.
+        # Every archive month: the key may sit on a ticket opened, and archived under, an earlier month
+        done = await order_archive.find({"idempotencyKeys": key}, limit=1)
+        if done:
+            result = serialize_order(done[0])
+            table_registry.apply(result)
+            return dumps(result)
+
+    if reservation is None:
+        try:
+            reservation = await reserve_stock(order_in.items)
+        except OutOfStock as e:
+            raise Rejected(409, {"message": f"Out of stock: {e}", "items": e.items})
+
+    sent = False
+    try:
+        for attempt in range(2):
+            try:
+                async with order_clock.allocate() as revision:
+                    sent = True
+                    order = await db.orders.find_one_and_update(
+                        {"tableId": order_in.tableId, "status": {"$nin": ACTIVE_EXCLUDED}},
+                        _merge_order_pipeline(order_in, revision, key),
+                        sort=[("_id", -1)],
+                        upsert=True,
+                        return_document=ReturnDocument.AFTER,
+                    )
+                break
+            except DuplicateKeyError:
+                if attempt:
+                    raise
+                sent = False
+    except Exception as e:
+        # Definitely not written: never sent, rejected by the server, or lost the insert race twice
+        if not sent or isinstance(e, DuplicateKeyError) or outbox.as_rejection(e) is not None:
+            await reservation.release()
+        else:
+            _uncertain_reservations[key] = reservation
+            if len(_uncertain_reservations) > UNCERTAIN_RESERVATIONS:
+                _uncertain_reservations.popitem(last=False)  # Kept taken: under-selling beats over-selling
+        raise
+
+    result = serialize_order(order)
+    event_type = result["lastEvent"]
+    if event_type == "order.created":
+        jobs.submit("log", print, f"🔔 NEW ORDER: {order_in.guestName} (Table {order_in.tableId})")
     else:
-        # --- NEW ORDER LOGIC ---
-        new_order_data = {
-            "createdAt": datetime.now().isoformat(),
-            "status": "placed",
-            "tableId": order_in.tableId,
-            "items": [item.model_dump() for item in order_in.items],
-            "guestName": order_in.guestName,
-            "totalAmount": order_in.totalAmount or 0,
-            "type": order_in.type or "food"  # Default to 'food' for kitchen display
-        }
-        
-        result = await db.orders.insert_one(new_order_data)
-        created_order = await db.orders.find_one({"_id": result.inserted_id})
-        print(f"🔔 NEW ORDER: {order_in.guestName} (Table {order_in.tableId})")
-        return serialize_order(created_order)
+        jobs.submit("log", print, f"🔄 MERGED ORDER: Table {order_in.tableId} +{len(order_in.items)} items, Total: {result['totalAmount']}")
+    table_registry.apply(result)
+    hub.emit(event_type, result)
+    return dumps(result)
+
+@app.get("/api/outbox/{key}")
+async def get_outbox_entry(key: str):
+    """Where a queued (202) order stands: pending, applied (with the order) or rejected"""
+    entry = await order_outbox.lookup(key)
+    if not entry:
+        raise HTTPException(404, "Unknown Idempotency-Key")
+    body = {**entry.as_pending(), "state": entry.state}
+    if entry.state == "applied":
+        body["order"] = json.loads(entry.result)
+    elif entry.state == "rejected":
+        body["error"] = json.loads(entry.result)
+    return json_response(body)
+
+BULK_EVENT = "orders.bulk_updated"
+
+# --- Helper: Named order projections (each screen gets only what it renders) ---
+_ORDER_META = {"tableId": 1, "status": 1, "createdAt": 1, "type": 1, "revision": 1, "updatedAt": 1}
+ORDER_VIEWS = {
+    "full": None,
+    # Kitchen tickets: table, items, status
+    "kitchen": {**_ORDER_META, "items.name": 1, "items.quantity": 1, "items.notes": 1, "items.status": 1},
+    # Service / guest screens: adds guest, prices and totals
+    "service": {**_ORDER_META, "guestName": 1, "totalAmount": 1,
+                "items.name": 1, "items.quantity": 1, "items.notes": 1, "items.price": 1, "items.status": 1},
+    # Lists and counters: no items at all
+    "summary": {**_ORDER_META, "guestName": 1, "totalAmount": 1},
+}
+MAX_PAGE_SIZE = 1000
 
 @app.get("/api/orders")
-async def get_orders(status: Optional[str] = None):
+async def get_orders(
+    status: Optional[str] = None,
+    since: Optional[int] = None,
+    view: str = "full",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+):
+    """
+    Modes:
+      (default)     legacy list, up to 1000
+      since=N       delta sync -> {orders, cursor}
+      limit/after   keyset pages by _id -> {orders, next}
+    view = full | kitchen | service | summary; start/end filter createdAt (ISO, end exclusive)
+    Listings that can include paid / cancelled orders also read the monthly archive.
+    """
+    if view not in ORDER_VIEWS:
+        raise HTTPException(400, f"Unknown view '{view}'")
+    after_id = None
+    if after:
+        try:
+            after_id = ObjectId(after)
+        except:
+            raise HTTPException(400, "Invalid cursor")
+
+    # Identical polls in flight at once (or within the micro-TTL) share one query + encoding
+    key = (status or None, since, view, start, end, after_id, limit)
+    body = await coalescer.run("orders", key, lambda: _read_orders(status, since, view, start, end, after_id, limit))
+    return Response(body, media_type="application/json")
+
+async def _read_orders(status, since, view, start, end, after_id, limit) -> bytes:
+    projection = ORDER_VIEWS[view]
+
     query = {}
     if status:
         query["status"] = status
-    orders = await db.orders.find(query).to_list(1000)
-    return serialize_orders(orders)
+    if start or end:
+        query["createdAt"] = {k: v for k, v in (("$gte", start), ("$lt", end)) if v}
+    # Archived orders are all paid / cancelled
+    with_archive = not status or status in ARCHIVED_STATUSES
+
+    # Keyset pagination (stable under concurrent inserts, no skip())
+    if limit is not None or after_id:
+        page_size = max(1, min(limit or 100, MAX_PAGE_SIZE))
+        if after_id:
+            query["_id"] = {"$gt": after_id}
+        if with_archive:
+            orders = await order_archive.find(query, projection, sort=[("_id", 1)], limit=page_size,
+                                              start=start, end=end)
+        else:
+            orders = await db.orders.find(query, projection).sort("_id", 1).limit(page_size).to_list(page_size)
+        next_id = str(orders[-1]["_id"]) if len(orders) == page_size else None
+        return dumps({"orders": serialize_orders(orders), "next": next_id})
+
+    # Legacy full listing (no cursor)
+    if since is None:
+        if with_archive:
+            orders = await order_archive.find(query, projection, limit=1000, start=start, end=end)
+        else:
+            orders = await db.orders.find(query, projection).to_list(1000)
+        return dumps(serialize_orders(orders))
+
+    # Delta sync: only orders written after the client's cursor (live collection only).
+    # since=0 is the initial snapshot (includes pre-revision documents).
+    # A cursor older than the archive horizon may have missed orders leaving
+    # `orders`, so that client gets a fresh snapshot (reset=true).
+    reset = 0 < since < order_archive.horizon
+    if reset:
+        since = 0
+    if since > 0:
+        query["revision"] = {"$gt": since}
+    horizon = await order_clock.horizon()  # Before the query: later commits land above it
+    orders = await db.orders.find(query, projection).sort("revision", 1).to_list(1000)
+    return dumps({
+        "orders": serialize_orders(orders),
+        "cursor": order_clock.cursor_for(since, orders, horizon),
+        "reset": reset,
+    })
+
+@app.get("/api/orders/export")
+async def export_orders(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    status: Optional[str] = None,
+    format: str = "ndjson",
+    rows: str = "orders",
+    gzip: bool = False,
+):
+    """Every order created in [start, end) (live + archive), streamed as NDJSON or CSV"""
+    if format not in export.EXPORT_FORMATS:
+        raise HTTPException(400, f"Unknown format '{format}'")
+    if rows not in export.EXPORT_ROWS:
+        raise HTTPException(400, f"Unknown rows '{rows}'")
+    for value in (start, end):
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise HTTPException(400, f"Invalid date '{value}'")
+
+    name = export.filename(start, end, format, gzip)
+    return StreamingResponse(
+        export.stream_orders(start, end, _parse_status_filter(status), format, rows, gzip),
+        media_type="application/gzip" if gzip else export.EXPORT_FORMATS[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{name}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",
+        },
+    )
 
 @app.get("/api/orders/{order_id}")
 async def get_order(order_id: str):
-    from bson import ObjectId
     try:
         oid = ObjectId(order_id)
     except:
         raise HTTPException(400, "Invalid ID")
     
-    order = await db.orders.find_one({"_id": oid})
+    order = await order_archive.find_by_id(oid)
     if not order:
         raise HTTPException(404, "Order not found")
-    return serialize_order(order)
+    return json_response(serialize_order(order))
 
 @app.patch("/api/orders/{order_id}/status")
 async def update_status(order_id: str, status: str):
-    from bson import ObjectId
     try:
         oid = ObjectId(order_id)
     except:
         raise HTTPException(400, "Invalid ID")
 
-    # Fetch existing
-    existing = await db.orders.find_one({"_id": oid})
-    if not existing:
-         raise HTTPException(404, "Order not found")
+    event_type = {"ready": "order.items_ready", "served": "order.items_served"}.get(status, "order.updated")
 
-    updated_items = existing.get('items', [])
-    
-    # --- ITEM LEVEL TRANSITIONS ---
-    # "Mark Ready" (Kitchen): Pending -> Ready
-    if status == 'ready':
-        for item in updated_items:
-            if item.get('status', 'pending') == 'pending':
-                item['status'] = 'ready'
-                
-    # "Mark Served" (Service): Ready -> Served
-    elif status == 'served':
-        for item in updated_items:
-            # Service dashboard sees 'ready' items and serves them
-            if item.get('status', 'pending') == 'ready':
-                item['status'] = 'served'
-
-    # --- PARENT STATUS RECALC ---
-    # Determine visibility tag based on active items
-    has_pending = any(i.get('status', 'pending') == 'pending' for i in updated_items)
-    has_ready = any(i.get('status', 'pending') == 'ready' for i in updated_items)
-    
-    # Priority: Placed (Kitchen) > Ready (Service) > Served (Done)
-    new_parent_status = 'served' 
-    if has_pending:
-        new_parent_status = 'placed'
-    elif has_ready:
-        new_parent_status = 'ready'
-    
-    # Update DB
-    await db.orders.update_one(
-        {"_id": oid}, 
-        {
-            "$set": {
-                "status": new_parent_status,
-                "items": updated_items
-            }
-        }
-    )
-    
-    updated = await db.orders.find_one({"_id": oid})
-    if updated: 
-        return serialize_order(updated)
-    raise HTTPException(404, "Order not found")
+    at = datetime.now().isoformat()
+    async with order_clock.allocate() as revision:
+        updated = await db.orders.find_one_and_update(
+            {"_id": oid},
+            _status_transition_pipeline(status, revision, event_type, at),
+            return_document=ReturnDocument.AFTER,
+        )
+    if not updated:
+        raise HTTPException(404, "Order not found")
+    jobs.submit("kitchen.observe", kitchen_stats.observe, updated, at)
+
+    result = serialize_order(updated)
+    table_registry.apply(result)
+    hub.emit(event_type, result)
+    return json_response(result)
+
+@app.post("/api/orders/bulk-status")
+async def bulk_update_status(body: BulkOrderStatus):
+    """Kitchen / service bump several tickets at once: one revision, one bulk_write, one event"""
+    results = [None] * len(body.updates)
+    oids = _bulk_oids([u.orderId for u in body.updates], results)
+    op_entries = list(oids)
+
+    errors = {}
+    at = datetime.now().isoformat()
+    async with order_clock.allocate() as revision:
+        ops = [
+            UpdateOne({"_id": oids[i]}, _status_transition_pipeline(body.updates[i].status, revision, BULK_EVENT, at))
+            for i in op_entries
+        ]
+        if ops:
+            try:
+                # Ordered: the same ticket can be bumped twice in one batch (ready, then served)
+                await db.orders.bulk_write(ops, ordered=True)
+            except BulkWriteError as e:
+                errors = _bulk_write_errors(e)
+
+    docs = {d["_id"]: d for d in await db.orders.find({"_id": {"$in": list(oids.values())}}).to_list(None)}
+    first_error = min(errors, default=None)
+    for op_index, i in enumerate(op_entries):
+        order_id = body.updates[i].orderId
+        doc = docs.get(oids[i])
+        if op_index in errors:
+            results[i] = {"id": order_id, "ok": False, "error": errors[op_index]}
+        elif first_error is not None and op_index > first_error:
+            results[i] = {"id": order_id, "ok": False, "error": "Not applied (earlier entry failed)"}
+        elif not doc:
+            results[i] = {"id": order_id, "ok": False, "error": "Order not found"}
+        else:
+            results[i] = {"id": order_id, "ok": True, "status": doc.get("status"), "revision": doc.get("revision")}
+
+    changed = [serialize_order(d) for d in docs.values() if d.get("revision") == revision]
+    for order in changed:
+        table_registry.apply(order)
+        jobs.submit("kitchen.observe", kitchen_stats.observe, order, at)
+    if changed:
+        hub.emit(BULK_EVENT, revision=revision, count=len(changed), orders=[
+            {"orderId": o["id"], "tableId": o.get("tableId"), "status": o.get("status")} for o in changed
+        ])
+    return json_response({"updated": sum(r["ok"] for r in results), "revision": revision, "results": results})
 
 @app.post("/api/tables/{table_id}/settle")
 async def settle_table(table_id: str):
@@ -330,13 +800,20 @@ async def settle_table(table_id: str):
     except ValueError:
         raise HTTPException(400, "Invalid Table ID")
         
-    # Update many
-    result = await db.orders.update_many(
-        {"tableId": t_id, "status": {"$ne": "paid"}},  # Query
-        {"$set": {"status": "paid"}}                    # Update
-    )
-    
-    print(f"💰 SETTLED TABLE {t_id}: {result.modified_count} orders cleared")
+    # Update many (one revision for the whole settlement)
+    async with order_clock.allocate() as revision:
+        result = await db.orders.update_many(
+            {"tableId": t_id, "status": {"$ne": "paid"}},  # Query
+            {"$set": {"status": "paid", **stamp(revision, "table.settled")}}  # Update
+        )
+    # Free the table now; the re-read (an order placed mid-settle) and the rollup run after the response
+    table_registry.settle(t_id, revision)
+    jobs.submit("tables.refresh", table_registry.refresh, t_id, False)
+    if result.modified_count:
+        await jobs.submit_wait("analytics.settlement", analytics.record_settlement, t_id, revision, datetime.now())
+        hub.emit("table.settled", tableId=t_id, status="paid", revision=revision, count=result.modified_count)
+
+    jobs.submit("log", print, f"💰 SETTLED TABLE {t_id}: {result.modified_count} orders cleared")
     return {"status": "cleared", "count": result.modified_count}
 
 @app.get("/api/tables/{table_id}/session")
@@ -346,26 +823,108 @@ async def get_session(table_id: str):
     except ValueError:
         raise HTTPException(400, "Invalid Table ID")
 
-    # Find latest active order
-    # Sort by _id desc (approx timestamp)
-    cursor = db.orders.find(
-        {"tableId": t_id, "status": {"$nin": ["paid", "cancelled"]}}
-    ).sort("_id", -1).limit(1)
-    
-    active_orders = await cursor.to_list(length=1)
-    
+    # Served from the live table registry (no Mongo round trip)
+    if not table_registry.hydrated:
+        await table_registry.hydrate()
+    state = table_registry.get(t_id)
+    queued = table_registry.queued(t_id)  # Placed but still in the outbox journal
 
-    if active_orders:
-        o = active_orders[0]
+    if state:
         return {
             "active": True,
-            "guestName": o.get("guestName"),
+            "guestName": state.guestName,
             "tableId": table_id,
-            "orderId": str(o["_id"]),
-            "status": o.get("status")
+            "orderId": state.orderId,
+            "status": state.status,
+            "queued": len(queued)
+        }
+    if queued:
+        return {
+            "active": True,
+            "guestName": queued[0]["guestName"],
+            "tableId": table_id,
+            "orderId": None,
+            "status": "queued",
+            "queued": len(queued)
         }
     return {"active": False}
 
+@app.get("/api/tables")
+async def get_tables():
+    """Floor plan: every table with an active order, from the live registry"""
+    if not table_registry.hydrated:
+        await table_registry.hydrate()
+    return json_response({"tables": table_registry.floor_plan()})
+
+# --- KITCHEN ROUTES (streaming prep-time stats) ---
+KITCHEN_QUEUE = {"status": "placed", "type": {"$ne": "request"}}
+KITCHEN_QUEUE_FIELDS = {"tableId": 1, "guestName": 1, "createdAt": 1, "items.name": 1, "items.quantity": 1,
+                        "items.status": 1, "items.placedAt": 1}
+
+@app.get("/api/kitchen/eta")
+async def get_kitchen_eta():
+    """Predicted ready time (p50 / p90) of every open kitchen ticket, given the current queue"""
+    async def build():
+        orders = await db.orders.find(KITCHEN_QUEUE, KITCHEN_QUEUE_FIELDS).to_list(1000)
+        return dumps(await kitchen_stats.eta(orders))
+    return Response(await coalescer.run("orders", "kitchen.eta", build), media_type="application/json")
+
+@app.get("/api/kitchen/prep-times")
+async def get_prep_times():
+    """Observed prep (placed -> ready) and pass (ready -> served) times per item vs MenuItem.prepTime"""
+    return json_response(await kitchen_stats.prep_times())
+
+# --- ANALYTICS ROUTES (served from daily rollups) ---
+@app.get("/api/analytics/summary")
+async def get_analytics_summary(start: Optional[str] = None, end: Optional[str] = None, top: int = 5):
+    result = await analytics.summary(start, end, top)
+    result["activeOrders"] = await db.orders.count_documents({"status": {"$nin": ACTIVE_EXCLUDED}})
+    recent = await order_archive.find({"status": "paid"}, sort=[("revision", -1)], limit=10)
+    result["recentPaid"] = serialize_orders(recent)
+    return json_response(result)
+
+@app.get("/api/analytics/daily")
+async def get_analytics_daily(start: Optional[str] = None, end: Optional[str] = None):
+    return json_response(await analytics.daily(start, end))
+
+# --- EVENT STREAM ROUTES ---
+def _parse_status_filter(status_filter: Optional[str]):
+    return {s.strip() for s in status_filter.split(",") if s.strip()} if status_filter else None
+
+@app.get("/api/events/stream")
+async def stream_events(request: Request, tableId: Optional[int] = None, status: Optional[str] = None):
+    """Server-Sent Events feed of order events (optionally filtered by table / status list)"""
+    sub = hub.subscribe(tableId, _parse_status_filter(status))
+
+    async def event_source():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                event = await sub.next(timeout=15)
+                # Comment line keeps proxies from closing an idle stream
+                yield sse_format(event) if event else ": keep-alive\n\n"
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/api/events/ws")
+async def websocket_events(websocket: WebSocket, tableId: Optional[int] = None, status: Optional[str] = None):
+    await websocket.accept()
+    sub = hub.subscribe(tableId, _parse_status_filter(status))
+    try:
+        while True:
+            event = await sub.next(timeout=15)
+            await websocket.send_text(json.dumps(event or {"type": "ping"}, default=str))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(sub)
+
 # --- USER ROUTES ---
 from models import User, UserLogin, UserCheck
 
@@ -383,53 +942,43 @@ async def login_user(login_data: UserLogin):
         if not login_data.phone:
             raise HTTPException(status_code=400, detail="Phone is required")
 
-        # UPSERT LOGIC
-        # 2. Try to find by phone
-        existing_user = await db.users.find_one({"phone": login_data.phone})
+        # UPSERT LOGIC (one atomic round trip, unique phone index keeps it race-free)
+        update_data = {
+            "lastVisit": datetime.now().isoformat()
+        }
+        insert_defaults = {}
 
-        from datetime import datetime
-        
-        if existing_user:
-            # 3. CASE A: User Exists -> Update Stats & Prefs
-            print(f"✅ Existing User Logged In: {existing_user.get('name')}")
-            
-            update_data = {
-                "lastVisit": datetime.now().isoformat()
-            }
-            if login_data.name:
-                update_data["name"] = login_data.name
-            
-            # If preferences are passed, update them (MERGE or REPLACE? Let's Replace for simplicity/consistency with Wizard)
-            if login_data.preferences:
-                 update_data["preferences"] = login_data.preferences
-
-            # Atomic increment
-            await db.users.update_one(
-                {"_id": existing_user["_id"]},
-                {
-                    "$set": update_data,
-                    "$inc": {"visitCount": 1}
-                }
-            )
-            result = await db.users.find_one({"_id": existing_user["_id"]})
-            # Convert ObjectId to string for JSON serialization
-            result["id"] = str(result.pop("_id"))
-            return result
+        # Existing users get name / preferences replaced when passed (consistent with Wizard);
+        # new users fall back to defaults
+        if login_data.name:
+            update_data["name"] = login_data.name
+        else:
+            insert_defaults["name"] = "Guest"
+        if login_data.preferences:
+            update_data["preferences"] = login_data.preferences
         else:
-            # 4. CASE B: New User -> Create
-            print(f"🆕 Creating New User: {login_data.name}")
-            new_user_data = {
-                "name": login_data.name or "Guest",
-                "phone": login_data.phone,
-                "preferences": login_data.preferences or {},
-                "visitCount": 1,
-                "lastVisit": datetime.now().isoformat()
-            }
-            insert_result = await db.users.insert_one(new_user_data)
-            result = await db.users.find_one({"_id": insert_result.inserted_id})
-            # Convert ObjectId to string for JSON serialization
-            result["id"] = str(result.pop("_id"))
-            return result
+            insert_defaults["preferences"] = {}
+
+        update = {
+            "$set": update_data,
+            "$inc": {"visitCount": 1}  # Atomic increment (new users start at 1)
+        }
+        if insert_defaults:
+            update["$setOnInsert"] = insert_defaults
+
+        result = await db.users.find_one_and_update(
+            {"phone": login_data.phone},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+        if result.get("visitCount") == 1:
+            jobs.submit("log", print, f"🆕 Created New User: {result.get('name')}")
+        else:
+            jobs.submit("log", print, f"✅ Existing User Logged In: {result.get('name')}")
+
+        return json_response(rename_id(result))
     except HTTPException:
         raise
     except Exception as e:
@@ -440,7 +989,6 @@ async def login_user(login_data: UserLogin):
 
 @app.get("/api/users/{user_id}", response_model=User, response_model_by_alias=False)
 async def get_user_details(user_id: str):
-    from bson import ObjectId
     try:
         oid = ObjectId(user_id)
     except:
@@ -449,7 +997,7 @@ async def get_user_details(user_id: str):
     user = await db.users.find_one({"_id": oid})
     if not user:
         raise HTTPException(404, "User not found")
-    return user
+    return model_response(user, User)
 
 @app.put("/api/users/{user_id}/preferences", response_model=User, response_model_by_alias=False)
 async def add_preference(user_id: str, payload: dict):
@@ -458,7 +1006,6 @@ async def add_preference(user_id: str, payload: dict):
     if not pref:
          raise HTTPException(400, "Preference required")
 
-    from bson import ObjectId
     try:
         oid = ObjectId(user_id)
     except:
@@ -469,7 +1016,10 @@ async def add_preference(user_id: str, payload: dict):
         {"_id": oid},
         {"$addToSet": {"preferences": pref}}
     )
-    return await db.users.find_one({"_id": oid})
+    user = await db.users.find_one({"_id": oid})
+    if not user:
+        raise HTTPException(404, "User not found")
+    return model_response(user, User)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,64 @@
+import asyncio
+import gzip
+import hashlib
+from typing import Optional
+
+# LOCAL IMPORTS
+from bus import RESYNC, bus
+from database import db
+from responses import MENU_LIST_ADAPTER as _menu_adapter
+
+# ==========================
+# MENU SNAPSHOT CACHE
+# ==========================
+# The menu changes a few times a day but every tablet re-reads it every 10s.
+# We keep one pre-serialized copy of GET /api/menu (plain + gzip) with a
+# content hash used as the ETag. Menu write routes call `invalidate()`; the
+# next read rebuilds it once, however many tablets are waiting. With several
+# workers the invalidation is broadcast on the cluster bus.
+
+
+class MenuSnapshot:
+    def __init__(self, body: bytes, items: list):
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=6)
+        self.version = hashlib.sha1(body).hexdigest()[:16]
+        self.etag = f'"{self.version}"'
+        self.items = items  # Validated MenuItem models, for in-process consumers
+
+
+class MenuCache:
+    def __init__(self):
+        self._snapshot: Optional[MenuSnapshot] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, broadcast: bool = True):
+        self._generation += 1
+        self._snapshot = None
+        if broadcast:
+            bus.publish(MENU_INVALIDATED)
+
+    async def get(self) -> MenuSnapshot:
+        snapshot = self._snapshot
+        if snapshot:
+            return snapshot
+        async with self._lock:
+            # Another request may have rebuilt it while we waited
+            if self._snapshot:
+                return self._snapshot
+            generation = self._generation
+            docs = await db.menu.find().to_list(1000)
+            items = _menu_adapter.validate_python(docs)
+            snapshot = MenuSnapshot(_menu_adapter.dump_json(items), items)
+            # Don't keep a snapshot that a write invalidated mid-build
+            if generation == self._generation:
+                self._snapshot = snapshot
+            return snapshot
+
+
+MENU_INVALIDATED = "menu.invalidated"
+
+menu_cache = MenuCache()
+bus.subscribe(MENU_INVALIDATED, lambda _: menu_cache.invalidate(broadcast=False))
+bus.subscribe(RESYNC, lambda _: menu_cache.invalidate(broadcast=False))
@@ -0,0 +1,400 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.routing import Match
+
+# LOCAL IMPORTS
+from coalesce import coalescer
+from jobs import jobs
+
+# ==========================
+# REQUEST + MONGO METRICS
+# ==========================
+# Two sources, one /metrics page (Prometheus text format):
+#   MetricsMiddleware - per-route latency histogram, status counts and
+#                       in-flight gauge for every HTTP request.
+#   MongoCommandMetrics - pymongo CommandListener. Counts, durations and
+#                       documents returned per collection/command, labelled
+#                       with the route that issued them.
+#   PoolMetrics       - pymongo ConnectionPoolListener. Open / checked-out
+#                       connections and checkout waits per server.
+#
+# Motor runs pymongo on a thread pool but copies the caller's contextvars,
+# so the listener sees the RequestStats of the request that made the call.
+# Commands issued outside a request (startup, change stream, background
+# jobs) are labelled "(background)".
+#
+# SLOW_REQUEST_MS > 0 prints a line for every request slower than that,
+# with the Mongo breakdown that request was responsible for.
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Long-lived streams: counted in flight, kept out of the latency histogram
+STREAMING_ROUTES = {"/api/events/stream", "/api/orders/export"}
+
+BACKGROUND = "(background)"
+UNMATCHED = "(unmatched)"
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class RequestStats:
+    """Mongo work done on behalf of one request"""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.commands: Dict[Tuple[str, str], list] = defaultdict(lambda: [0, 0.0])  # -> [count, ms]
+
+    def add(self, collection: str, command: str, ms: float):
+        entry = self.commands[(collection, command)]
+        entry[0] += 1
+        entry[1] += ms
+
+    def breakdown(self) -> str:
+        if not self.commands:
+            return "no mongo"
+        parts = sorted(self.commands.items(), key=lambda kv: -kv[1][1])
+        return ", ".join(f"{c}.{cmd} x{n} {ms:.1f}ms" for (c, cmd), (n, ms) in parts)
+
+
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+# --- Mongo command listener ---
+# Commands whose reply carries a cursor batch
+_CURSOR_COMMANDS = {"find", "aggregate", "getMore", "listIndexes", "listCollections"}
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()  # Events arrive on motor's executor threads
+        self._pending: Dict[tuple, tuple] = {}
+        self.commands = defaultdict(lambda: [0, 0.0, 0])  # (route, coll, cmd) -> [count, seconds, docs]
+        self.failures = defaultdict(int)                   # (route, coll, cmd)
+        self.durations = defaultdict(Histogram)            # (coll, cmd)
+
+    @staticmethod
+    def _collection(event) -> str:
+        if event.command_name == "getMore":
+            return event.command.get("collection", "-")
+        target = event.command.get(event.command_name)
+        return target if isinstance(target, str) else "-"
+
+    @staticmethod
+    def _documents(command_name: str, reply: dict) -> int:
+        if command_name in _CURSOR_COMMANDS:
+            cursor = reply.get("cursor") or {}
+            return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+        if command_name == "findAndModify":
+            return 1 if reply.get("value") else 0
+        return 0
+
+    def started(self, event):
+        stats = current_request.get()
+        key = (event.connection_id, event.request_id)
+        with self._lock:
+            self._pending[key] = (self._collection(event), stats)
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            collection, stats = self._pending.pop((event.connection_id, event.request_id), ("-", None))
+            route = stats.route if stats else BACKGROUND
+            label = (route, collection, event.command_name)
+            seconds = event.duration_micros / 1e6
+            entry = self.commands[label]
+            entry[0] += 1
+            entry[1] += seconds
+            if failed:
+                self.failures[label] += 1
+            else:
+                entry[2] += self._documents(event.command_name, event.reply)
+            self.durations[(collection, event.command_name)].observe(seconds)
+        if stats:
+            stats.add(collection, event.command_name, seconds * 1000)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+mongo_metrics = MongoCommandMetrics()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = defaultdict(int)           # address -> connections
+        self.checked_out = defaultdict(int)    # address -> in use
+        self.checkout_failures = defaultdict(int)
+
+    @staticmethod
+    def _address(event) -> str:
+        return "%s:%s" % event.address
+
+    def _add(self, counter: dict, event, delta: int = 1):
+        with self._lock:
+            counter[self._address(event)] += delta
+
+    def connection_created(self, event):
+        self._add(self.open, event)
+
+    def connection_closed(self, event):
+        self._add(self.open, event, -1)
+
+    def connection_checked_out(self, event):
+        self._add(self.checked_out, event)
+
+    def connection_checked_in(self, event):
+        self._add(self.checked_out, event, -1)
+
+    def connection_check_out_failed(self, event):
+        self._add(self.checkout_failures, event)
+
+    def pool_closed(self, event):
+        with self._lock:
+            address = self._address(event)
+            self.open.pop(address, None)
+            self.checked_out.pop(address, None)
+
+    # Not tracked (the listener interface requires them)
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "open": dict(self.open),
+                "checkedOut": dict(self.checked_out),
+                "checkoutFailures": dict(self.checkout_failures),
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+# --- HTTP middleware ---
+class HttpMetrics:
+    def __init__(self):
+        self.latency = defaultdict(Histogram)  # (method, route)
+        self.responses = defaultdict(int)      # (method, route, status)
+        self.in_flight = defaultdict(int)      # (method, route)
+
+
+http_metrics = HttpMetrics()
+
+
+class AdmissionMetrics:
+    def __init__(self):
+        self.outcomes = defaultdict(int)  # (priority, admitted|throttled|shed)
+        self.in_flight = 0                # Requests holding a concurrency slot
+        self.poll_rate = 0.0              # Current (adaptive) polls/s admitted server-wide
+
+
+admission_metrics = AdmissionMetrics()
+
+
+class OutboxMetrics:
+    def __init__(self):
+        self.outcomes = defaultdict(int)  # journaled|deduplicated|applied|rejected|retried
+        self.pending = 0                  # Journaled, not yet in Mongo (as this worker sees it)
+        self.flusher = False              # This worker writes the journal to Mongo
+
+
+outbox_metrics = OutboxMetrics()
+
+
+class MetricsMiddleware:
+    """Pure ASGI (no BaseHTTPMiddleware) so streaming responses pass straight through"""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _route(scope) -> str:
+        # Resolve the template up front ("/api/orders/{order_id}"), so
+        # in-flight gauges and Mongo labels use it while the request runs
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", UNMATCHED)
+        return UNMATCHED
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        stats = RequestStats(self._route(scope))
+        key = (method, stats.route)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = current_request.set(stats)
+        http_metrics.in_flight[key] += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_metrics.in_flight[key] -= 1
+            current_request.reset(token)
+            http_metrics.responses[(method, stats.route, status_code)] += 1
+            if stats.route not in STREAMING_ROUTES:
+                http_metrics.latency[key].observe(elapsed)
+                if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                    print(f"🐢 SLOW {method} {stats.route} {elapsed * 1000:.1f}ms "
+                          f"(status {status_code}) mongo: {stats.breakdown()}")
+
+
+# ==========================
+# PROMETHEUS TEXT FORMAT
+# ==========================
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _histogram_lines(name: str, histograms: dict, label_names: tuple) -> list:
+    lines = []
+    for key, hist in sorted(histograms.items()):
+        labels = dict(zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), hist.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(**labels)} {hist.sum:.6f}")
+        lines.append(f"{name}_count{_labels(**labels)} {hist.count}")
+    return lines
+
+
+def _header(name: str, kind: str, help_text: str) -> list:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+def render() -> str:
+    lines = []
+
+    # --- HTTP ---
+    lines += _header("dineai_http_request_duration_seconds", "histogram", "Request latency by route")
+    lines += _histogram_lines("dineai_http_request_duration_seconds", dict(http_metrics.latency),
+                              ("method", "route"))
+
+    lines += _header("dineai_http_responses_total", "counter", "Responses by route and status")
+    for (method, route, status_code), n in sorted(http_metrics.responses.items()):
+        lines.append(f"dineai_http_responses_total{_labels(method=method, route=route, status=status_code)} {n}")
+
+    lines += _header("dineai_http_requests_in_flight", "gauge", "Requests currently being served")
+    for (method, route), n in sorted(http_metrics.in_flight.items()):
+        lines.append(f"dineai_http_requests_in_flight{_labels(method=method, route=route)} {n}")
+
+    lines += _header("dineai_admission_total", "counter", "Admission decisions by priority class (admitted, throttled = 429, shed = 503)")
+    for (priority, outcome), n in sorted(admission_metrics.outcomes.items()):
+        lines.append(f"dineai_admission_total{_labels(priority=priority, outcome=outcome)} {n}")
+    lines += _header("dineai_admission_in_flight", "gauge", "Mongo-bound requests holding a concurrency slot")
+    lines.append(f"dineai_admission_in_flight {admission_metrics.in_flight}")
+    lines += _header("dineai_admission_poll_rate", "gauge", "Polls/s currently admitted (halved while the server is overloaded)")
+    lines.append(f"dineai_admission_poll_rate {admission_metrics.poll_rate:.1f}")
+
+    # --- Mongo ---
+    with mongo_metrics._lock:
+        commands = {k: list(v) for k, v in mongo_metrics.commands.items()}
+        failures = dict(mongo_metrics.failures)
+        durations = {k: _copy_histogram(v) for k, v in mongo_metrics.durations.items()}
+
+    lines += _header("dineai_mongo_commands_total", "counter", "Mongo commands by issuing route")
+    for (route, coll, cmd), (n, _, _) in sorted(commands.items()):
+        lines.append(f"dineai_mongo_commands_total{_labels(route=route, collection=coll, command=cmd)} {n}")
+
+    lines += _header("dineai_mongo_command_seconds_total", "counter", "Time spent in Mongo commands by issuing route")
+    for (route, coll, cmd), (_, seconds, _) in sorted(commands.items()):
+        lines.append(f"dineai_mongo_command_seconds_total{_labels(route=route, collection=coll, command=cmd)} {seconds:.6f}")
+
+    lines += _header("dineai_mongo_documents_returned_total", "counter", "Documents returned by Mongo by issuing route")
+    for (route, coll, cmd), (_, _, docs) in sorted(commands.items()):
+        lines.append(f"dineai_mongo_documents_returned_total{_labels(route=route, collection=coll, command=cmd)} {docs}")
+
+    lines += _header("dineai_mongo_command_failures_total", "counter", "Failed Mongo commands by issuing route")
+    for (route, coll, cmd), n in sorted(failures.items()):
+        lines.append(f"dineai_mongo_command_failures_total{_labels(route=route, collection=coll, command=cmd)} {n}")
+
+    pool = pool_metrics.snapshot()
+    lines += _header("dineai_mongo_pool_connections", "gauge", "Open pooled connections per server")
+    for address, n in sorted(pool["open"].items()):
+        lines.append(f"dineai_mongo_pool_connections{_labels(address=address)} {n}")
+    lines += _header("dineai_mongo_pool_checked_out", "gauge", "Pooled connections in use per server")
+    for address, n in sorted(pool["checkedOut"].items()):
+        lines.append(f"dineai_mongo_pool_checked_out{_labels(address=address)} {n}")
+    lines += _header("dineai_mongo_pool_checkout_failures_total", "counter", "Failed connection checkouts per server")
+    for address, n in sorted(pool["checkoutFailures"].items()):
+        lines.append(f"dineai_mongo_pool_checkout_failures_total{_labels(address=address)} {n}")
+
+    lines += _header("dineai_mongo_command_duration_seconds", "histogram", "Mongo command latency")
+    lines += _histogram_lines("dineai_mongo_command_duration_seconds", durations, ("collection", "command"))
+
+    # --- Read coalescing ---
+    lines += _header("dineai_coalesced_reads_total", "counter", "Coalesced reads: leader ran the query, joined / cached shared it")
+    for (namespace, outcome), n in sorted(coalescer.outcomes.items()):
+        lines.append(f"dineai_coalesced_reads_total{_labels(namespace=namespace, outcome=outcome)} {n}")
+
+    # --- Background jobs ---
+    lines += _header("dineai_job_queue_depth", "gauge", "Jobs waiting for a worker")
+    lines.append(f"dineai_job_queue_depth {jobs.depth}")
+    lines += _header("dineai_job_queue_capacity", "gauge", "Job queue capacity")
+    lines.append(f"dineai_job_queue_capacity {jobs.capacity}")
+    lines += _header("dineai_jobs_running", "gauge", "Jobs being run right now")
+    lines.append(f"dineai_jobs_running {jobs.busy}")
+    lines += _header("dineai_jobs_total", "counter", "Jobs by name and outcome (done, retried, failed, dropped, rejected)")
+    for (name, outcome), n in sorted(jobs.outcomes.items()):
+        lines.append(f"dineai_jobs_total{_labels(job=name, outcome=outcome)} {n}")
+
+    # --- Order outbox ---
+    lines += _header("dineai_outbox_pending", "gauge", "Journaled orders not yet written to Mongo (as this worker sees it)")
+    lines.append(f"dineai_outbox_pending {outbox_metrics.pending}")
+    lines += _header("dineai_outbox_flusher", "gauge", "1 if this worker is the one writing the journal to Mongo")
+    lines.append(f"dineai_outbox_flusher {int(outbox_metrics.flusher)}")
+    lines += _header("dineai_outbox_total", "counter",
+                     "Outbox entries by outcome (journaled, deduplicated, applied, rejected, retried)")
+    for outcome, n in sorted(outbox_metrics.outcomes.items()):
+        lines.append(f"dineai_outbox_total{_labels(outcome=outcome)} {n}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _copy_histogram(hist: Histogram) -> Histogram:
+    copy = Histogram()
+    copy.counts, copy.sum, copy.count = list(hist.counts), hist.sum, hist.count
+    return copy
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, BeforeValidator
+from pydantic import BaseModel, Field, BeforeValidator, field_validator
 from typing import List, Optional, Any, Annotated
 from datetime import datetime
 
@@ -58,6 +58,34 @@ class MenuItem(BaseModel):
     class Config:
         populate_by_name = True
 
+class MenuItemUpdate(BaseModel):
+    # Partial edit: only the fields sent (exclude_unset), each typed as on
+    # MenuItem, so an edited document still validates as a MenuItem
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    category: Optional[str] = None
+    image: Optional[str] = None
+    spiceLevel: Optional[str] = None
+    isAvailable: Optional[bool] = None
+    dietaryType: Optional[str] = None
+    tags: Optional[List[str]] = None
+    heroIngredient: Optional[str] = None
+    allergens: Optional[List[str]] = None
+    prepTime: Optional[int] = None
+    calories: Optional[int] = None
+    stock: Optional[int] = None
+    rating: Optional[float] = None
+    # Anything else (`_id`, client-only fields) is dropped, as MenuItem drops it on the way out
+
+    @field_validator("name", "price", "category", "isAvailable", "tags", "allergens")
+    @classmethod
+    def required_not_null(cls, value, info):
+        # Leaving these out keeps the stored value; an explicit null would break the MenuItem
+        if value is None:
+            raise ValueError(f"{info.field_name} is required on a menu item and can't be null")
+        return value
+
 # ==========================
 # 3. ORDER MODELS
 # ==========================
@@ -69,6 +97,10 @@ class OrderItem(BaseModel):
     quantity: int
     notes: Optional[str] = ""
     status: Optional[str] = "pending"  # Item-level status
+    # Transition times (ISO), stamped by the server; feed kitchen prep-time stats
+    placedAt: Optional[str] = None
+    readyAt: Optional[str] = None
+    servedAt: Optional[str] = None
 
 class OrderCreate(BaseModel):
     tableId: int  # Match the DB field name directly
@@ -88,4 +120,21 @@ class Order(BaseModel):
     type: Optional[str] = "food"  # 'food' or 'request'
 
     class Config:
-        populate_by_name = True
\ No newline at end of file
+        populate_by_name = True
+
+# ==========================
+# 4. BULK MODELS
+# ==========================
+class OrderStatusChange(BaseModel):
+    orderId: str
+    status: str
+
+class BulkOrderStatus(BaseModel):
+    updates: List[OrderStatusChange]
+
+class MenuItemPatch(BaseModel):
+    id: str
+    patch: dict
+
+class BulkMenuPatch(BaseModel):
+    updates: List[MenuItemPatch]
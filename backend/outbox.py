@@ -0,0 +1,472 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import (DuplicateKeyError, ExecutionTimeout, OperationFailure,
+                            WriteConcernError, WTimeoutError)
+
+try:
+    import fcntl
+except ImportError:  # No flock (Windows): the one process there is owns the journal
+    fcntl = None
+
+# LOCAL IMPORTS
+import metrics
+from responses import dumps
+from tables import table_registry
+
+# ==========================
+# ORDER OUTBOX (local write-ahead journal)
+# ==========================
+# place_order doesn't wait on Mongo for the guest: the order is appended to
+# a local SQLite journal (WAL mode, fsync'd on commit) and a flusher writes
+# it to Mongo afterwards. Each table gets a lane: its entries go strictly in
+# journal order, and up to OUTBOX_LANES tables are written side by side, so
+# a burst over the floor isn't queued behind one coroutine.
+#
+#   place_order --append--> outbox.db --flusher--> Mongo (merge / upsert)
+#        |                                  |
+#        +------ wait <= OUTBOX_ACK_SECONDS -+
+#
+# When Mongo is healthy the write lands within the wait and the guest gets
+# the order back exactly as before. When it's slow or down the guest gets
+# 202 + the queued entry, and the order follows once Mongo catches up
+# (including after a restart: the journal is on disk).
+#
+# Exactly once: every entry carries an idempotency key (the client's
+# Idempotency-Key header, or a fresh one). Appending an existing key returns
+# the existing entry, so client retries never order twice. The key is also
+# written into the order (`idempotencyKeys`) by the same update that adds the
+# lines; an entry that may already have reached Mongo (the write errored, or
+# it was pending when this process took over the journal) is looked up by
+# key before it is written again.
+#
+# Concurrent appends share one transaction (one fsync). All workers on a
+# host share the file; whichever holds the `.lock` flock is the flusher and
+# the others append and watch. If it dies the lock frees and the next worker
+# takes over. Pending entries are shown on the table registry (status
+# "queued") so the floor plan and guest sessions include them.
+#
+# A failed write stays at the head of its table's line and is retried with
+# backoff (Mongo down, primary stepping down, ...); other tables carry on. A server error retrying
+# can't fix (a pipeline or validation error: `as_rejection`) rejects the
+# entry instead, so one bad order can't hold up every order behind it.
+#
+# Journal entries are kept OUTBOX_RETENTION_SECONDS after they are written
+# (retries within that window get the stored result).
+
+# The journal must outlive the process: on an ephemeral host (containers,
+# PaaS dynos) a path on the scratch disk loses every queued order with it.
+# So there is no default; setting OUTBOX_PATH to a file on persistent disk
+# turns the outbox on (OUTBOX_ENABLED=0 still switches it off).
+OUTBOX_PATH = os.getenv("OUTBOX_PATH")
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1" if OUTBOX_PATH else "0") == "1"
+OUTBOX_SYNC = os.getenv("OUTBOX_SYNC", "FULL").upper()  # NORMAL survives a crash, not a power cut
+OUTBOX_ACK_SECONDS = float(os.getenv("OUTBOX_ACK_SECONDS", "0.5"))
+OUTBOX_DRAIN_SECONDS = float(os.getenv("OUTBOX_DRAIN_SECONDS", "10"))
+OUTBOX_RETENTION_SECONDS = int(os.getenv("OUTBOX_RETENTION_SECONDS", str(24 * 3600)))
+OUTBOX_POLL_SECONDS = 0.05  # Idle flusher / non-flusher worker checking for foreign writes
+OUTBOX_PURGE_SECONDS = 300
+OUTBOX_BATCH = 100  # Entries per table per lane
+OUTBOX_LANES = int(os.getenv("OUTBOX_LANES", "16"))  # Tables written to Mongo side by side
+OUTBOX_MAX_GROUP = 500  # Appends per transaction (SQLite bound-parameter limit)
+OUTBOX_RETRY_BASE_SECONDS = 0.2
+OUTBOX_RETRY_MAX_SECONDS = 5.0
+OUTBOX_BUSY_SECONDS = 5.0
+
+SYNC_MODES = ("NORMAL", "FULL", "EXTRA")
+
+# Server error codes that go away on their own: shutdown / step-down / not
+# primary, network, time limits, write conflicts
+TRANSIENT_CODES = {6, 7, 50, 89, 91, 112, 189, 251, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    table_id INTEGER,
+    guest_name TEXT,
+    item_count INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    journaled_at TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    result BLOB,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    done_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_state ON outbox (state, seq);
+"""
+COLUMNS = "seq, key, table_id, guest_name, item_count, payload, journaled_at, state, result"
+
+
+class Rejected(Exception):
+    """The order can never be written (e.g. out of stock): recorded, not retried"""
+
+    def __init__(self, status_code: int, detail):
+        super().__init__(str(detail))
+        self.status_code = status_code
+        self.detail = detail
+
+
+def as_rejection(e: Exception) -> Optional[Rejected]:
+    """`e` as a Rejected if writing the entry again can't succeed, else None (retry)"""
+    if isinstance(e, Rejected):
+        return e
+    # Network errors (ConnectionFailure) aren't OperationFailures: always retried
+    if not isinstance(e, OperationFailure):
+        return None
+    if isinstance(e, (DuplicateKeyError, ExecutionTimeout, WTimeoutError, WriteConcernError)):
+        return None  # Lost a race / too slow / replication lag
+    if e.code in TRANSIENT_CODES or e.has_error_label("RetryableWriteError") \
+            or e.has_error_label("TransientTransactionError"):
+        return None
+    return Rejected(500, f"Order could not be written: {e}")
+
+
+class Entry:
+    __slots__ = ("seq", "key", "tableId", "guestName", "itemCount", "payload", "journaledAt", "state", "result")
+
+    def __init__(self, row: tuple):
+        (self.seq, self.key, self.tableId, self.guestName, self.itemCount,
+         self.payload, self.journaledAt, self.state, self.result) = row
+
+    def as_pending(self) -> dict:
+        return {"idempotencyKey": self.key, "tableId": self.tableId, "guestName": self.guestName,
+                "itemCount": self.itemCount, "journaledAt": self.journaledAt}
+
+
+class OrderOutbox:
+    def __init__(self, path: Optional[str] = OUTBOX_PATH):
+        self.path = path
+        self.apply: Optional[Callable[[Entry, bool], Awaitable[bytes]]] = None
+        self.pending: Dict[str, Entry] = {}  # key -> entry, as far as this worker knows
+        self.leader = False
+        self.outcomes = metrics.outbox_metrics.outcomes
+        self.last_error: Optional[str] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock_file = None
+        self._appends: List[tuple] = []  # (row, future) waiting for the next group commit
+        self._appended = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._uncertain = set()  # Keys whose write errored: may or may not be in Mongo
+        self._recheck_through = 0  # Entries up to this seq were pending when we took over
+        self._lanes: Dict[int, asyncio.Task] = {}  # table -> its flush lane
+        self._retries: Dict[int, tuple] = {}  # table -> (failures in a row, monotonic time of next try)
+        self._version = None
+        self._purged_at = 0.0
+        self._tasks: List[asyncio.Task] = []
+
+    # --- SQLite (one dedicated thread; fsync never blocks the event loop) ---
+    async def _db(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _db_open(self):
+        if OUTBOX_SYNC not in SYNC_MODES:
+            raise ValueError(f"OUTBOX_SYNC must be one of {', '.join(SYNC_MODES)}")
+        conn = sqlite3.connect(self.path, timeout=OUTBOX_BUSY_SECONDS, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={OUTBOX_SYNC}")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    def _db_close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _db_select(self, where: str, params: tuple = ()) -> List[Entry]:
+        rows = self._conn.execute(f"SELECT {COLUMNS} FROM outbox WHERE {where}", params).fetchall()
+        return [Entry(row) for row in rows]
+
+    def _db_keys(self, keys: list) -> List[Entry]:
+        return self._db_select(f"key IN ({', '.join('?' * len(keys))})", tuple(keys))
+
+    def _db_insert(self, rows: list) -> List[Entry]:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO outbox (key, table_id, guest_name, item_count, payload, journaled_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", rows)
+            entries = self._db_keys([row[0] for row in rows])
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return entries
+
+    def _db_finish(self, entries: List[Entry]):
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany("UPDATE outbox SET state = ?, result = ?, done_at = ? WHERE key = ?",
+                                   [(e.state, e.result, now, e.key) for e in entries])
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _db_heads(self, skip: set, per_table: int, limit: int) -> List[Entry]:
+        """The first `per_table` pending entries of each table not in `skip`, in journal order"""
+        where = f"AND table_id NOT IN ({', '.join('?' * len(skip))})" if skip else ""
+        return [Entry(row) for row in self._conn.execute(
+            f"SELECT {COLUMNS} FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY table_id ORDER BY seq) AS rank"
+            f" FROM outbox WHERE state = 'pending' {where}) WHERE rank <= ? ORDER BY seq LIMIT ?",
+            (*skip, per_table, limit)).fetchall()]
+
+    def _db_failed(self, key: str, error: str):
+        self._conn.execute("UPDATE outbox SET attempts = attempts + 1, error = ? WHERE key = ?", (error, key))
+
+    def _db_purge(self, before: float) -> int:
+        return self._conn.execute("DELETE FROM outbox WHERE state != 'pending' AND done_at < ?", (before,)).rowcount
+
+    def _db_version(self) -> int:
+        # Changes when ANOTHER connection (worker) commits
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _db_last_seq(self) -> int:
+        return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM outbox").fetchone()[0]
+
+    # --- Appending (place_order) ---
+    async def append(self, key: str, table_id: int, guest_name: Optional[str], item_count: int,
+                     payload: str) -> Entry:
+        """Durably journal an order; returns the entry (the existing one if `key` was seen before)"""
+        future = asyncio.get_running_loop().create_future()
+        self._appends.append(((key, table_id, guest_name, item_count, payload, datetime.now().isoformat()), future))
+        self._appended.set()
+        return await future
+
+    async def _commit(self):
+        """Group commit: everything appended while the last transaction ran goes in the next one"""
+        while True:
+            await self._appended.wait()
+            self._appended.clear()
+            batch, self._appends = self._appends[:OUTBOX_MAX_GROUP], self._appends[OUTBOX_MAX_GROUP:]
+            if self._appends:
+                self._appended.set()
+            try:
+                entries = {e.key: e for e in await self._db(self._db_insert, [row for row, _ in batch])}
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for row, future in batch:
+                entry = entries[row[0]]
+                if entry.state == "pending":
+                    entry = self.pending.setdefault(entry.key, entry)
+                self.outcomes["journaled" if entry.journaledAt == row[5] else "deduplicated"] += 1
+                if not future.done():
+                    future.set_result(entry)
+            self._publish_pending()
+            self._wake.set()
+
+    async def wait(self, entry: Entry, timeout: float) -> Entry:
+        """The entry once written to Mongo (or rejected), or as it stands after `timeout`"""
+        if entry.state != "pending" or timeout <= 0:
+            return entry
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(entry.key, []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return entry
+        finally:
+            waiters = self._waiters.get(entry.key)
+            if waiters and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self._waiters[entry.key]
+
+    async def lookup(self, key: str) -> Optional[Entry]:
+        if key in self.pending or not self._conn:
+            return self.pending.get(key)
+        entries = await self._db(self._db_keys, [key])
+        return entries[0] if entries else None
+
+    def _finish(self, entry: Entry):
+        """`entry` reached Mongo or was rejected: settle the copy append() handed out, and its waiters"""
+        held = self.pending.pop(entry.key, None)
+        if held is not None and held is not entry:
+            # The request may not have reached wait() yet (the write can land before it resumes)
+            held.state, held.result = entry.state, entry.result
+        for future in self._waiters.pop(entry.key, ()):
+            if not future.done():
+                future.set_result(entry)
+
+    def _publish_pending(self):
+        metrics.outbox_metrics.pending = len(self.pending)
+        table_registry.set_pending([e.as_pending() for e in sorted(self.pending.values(), key=lambda e: e.seq)])
+
+    # --- Flushing (the worker holding the lock) ---
+    def _try_lead(self) -> bool:
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    async def _flush(self):
+        """Start a lane for each table with pending entries (oldest first), up to OUTBOX_LANES at a time"""
+        now = time.monotonic()
+        busy = set(self._lanes) | {t for t, (_, until) in self._retries.items() if until > now}
+        free = OUTBOX_LANES - len(self._lanes)
+        if free <= 0:
+            return
+        entries = await self._db(self._db_heads, busy, OUTBOX_BATCH, free * OUTBOX_BATCH)
+        by_table: Dict[int, List[Entry]] = {}
+        for entry in entries:
+            if entry.tableId in by_table or len(by_table) < free:
+                by_table.setdefault(entry.tableId, []).append(entry)
+        for table_id, lane in by_table.items():
+            self._lanes[table_id] = asyncio.create_task(self._lane(table_id, lane))
+
+    async def _lane(self, table_id: int, entries: List[Entry]):
+        """One table's entries, strictly in journal order (a later merge must not land first)"""
+        finished = []
+        try:
+            for entry in entries:
+                recheck = entry.seq <= self._recheck_through or entry.key in self._uncertain
+                try:
+                    entry.result = await self.apply(entry, recheck)
+                    entry.state = "applied"
+                except asyncio.CancelledError:
+                    self._uncertain.add(entry.key)
+                    raise
+                except Exception as e:
+                    rejected = as_rejection(e)
+                    if not rejected:
+                        # Head of this table's line: it backs off, other tables carry on
+                        self._uncertain.add(entry.key)
+                        failures = self._retries.get(table_id, (0, 0))[0] + 1
+                        delay = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (failures - 1), OUTBOX_RETRY_MAX_SECONDS)
+                        self._retries[table_id] = (failures, time.monotonic() + delay)
+                        self.outcomes["retried"] += 1
+                        self.last_error = str(e)
+                        print(f"❌ Outbox write failed for table {table_id} ({failures}x), retrying: {e}")
+                        await self._db(self._db_failed, entry.key, str(e))
+                        break
+                    entry.state, entry.result = "rejected", _encode_rejection(rejected)
+                    if not isinstance(e, Rejected):
+                        print(f"❌ Outbox write rejected, not retried: {e}")
+                self._retries.pop(table_id, None)
+                self._uncertain.discard(entry.key)
+                self.outcomes[entry.state] += 1
+                self._finish(entry)
+                finished.append(entry)
+
+            # Not in a `finally`: if we die before this, the entries are rechecked by key
+            if finished:
+                await self._db(self._db_finish, finished)
+                self._publish_pending()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Applied but not recorded: the journal still says pending, so look before writing again
+            self._uncertain.update(entry.key for entry in finished)
+            self.last_error = str(e)
+            print(f"❌ Outbox lane error (table {table_id}): {e}")
+        finally:
+            if self._lanes.get(table_id) is asyncio.current_task():
+                del self._lanes[table_id]
+            self._wake.set()  # The table's next entries (or another table) can go
+
+    async def _reload(self):
+        """Another worker wrote to the journal: re-read what's pending"""
+        entries = await self._db(self._db_select, "state = 'pending' ORDER BY seq")
+        self.pending = {e.key: self.pending.get(e.key, e) for e in entries}
+        self._publish_pending()
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            delay = OUTBOX_POLL_SECONDS
+            try:
+                if not self.leader and self._try_lead():
+                    self.leader = metrics.outbox_metrics.flusher = True
+                    # Anything pending now may have reached Mongo before the last flusher died
+                    self._recheck_through = await self._db(self._db_last_seq)
+                    print(f"🗃️  OUTBOX: flushing to Mongo ({len(self.pending)} pending)")
+                version = await self._db(self._db_version)
+                if version != self._version:
+                    self._version = version
+                    await self._reload()
+                if self.leader:
+                    await self._flush()
+                    if time.monotonic() - self._purged_at > OUTBOX_PURGE_SECONDS:
+                        self._purged_at = time.monotonic()
+                        await self._db(self._db_purge, time.time() - OUTBOX_RETENTION_SECONDS)
+                elif self._waiters:
+                    # Written by the flusher in another worker
+                    for entry in await self._db(self._db_keys, list(self._waiters)):
+                        if entry.state != "pending":
+                            self._finish(entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"❌ Outbox error: {e}")
+                delay = OUTBOX_RETRY_MAX_SECONDS
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- Lifecycle ---
+    async def start(self, apply: Callable[[Entry, bool], Awaitable[bytes]]):
+        """`apply(entry, recheck)` writes one entry to Mongo and returns the order (JSON bytes)"""
+        if not self.path:
+            raise RuntimeError("OUTBOX_ENABLED=1 needs OUTBOX_PATH: a journal file on persistent disk")
+        self.apply = apply
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="outbox")
+        await self._db(self._db_open)
+        self._version = await self._db(self._db_version)
+        await self._reload()
+        self._tasks = [asyncio.create_task(self._commit()), asyncio.create_task(self._run())]
+        print(f"🗃️  OUTBOX: {self.path} ({len(self.pending)} pending)")
+
+    async def stop(self, timeout: float = OUTBOX_DRAIN_SECONDS):
+        """Give the flusher up to `timeout` to empty the journal; the rest waits on disk for the next start"""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._appends or (self.leader and self.pending)) and time.monotonic() < deadline:
+            self._wake.set()
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+        tasks = self._tasks + list(self._lanes.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._lanes = {}
+        if self.leader and self.pending:
+            print(f"🗃️  OUTBOX: {len(self.pending)} orders kept for the next start")
+        if self._lock_file:
+            self._lock_file.close()  # Releases the flock
+            self._lock_file = None
+        self.leader = metrics.outbox_metrics.flusher = False
+        await self._db(self._db_close)
+        self._executor.shutdown(wait=True)
+
+    def status(self) -> dict:
+        return {"running": bool(self._tasks), "flusher": self.leader, "pending": len(self.pending),
+                "lanes": len(self._lanes), "retrying": len(self._retries),
+                "failures": max((n for n, _ in self._retries.values()), default=0), "lastError": self.last_error}
+
+
+def _encode_rejection(e: Rejected) -> bytes:
+    return dumps({"status": e.status_code, "detail": e.detail})
+
+
+order_outbox = OrderOutbox()
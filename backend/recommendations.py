@@ -0,0 +1,223 @@
+import re
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+# LOCAL IMPORTS
+from menu_cache import MenuSnapshot
+
+# ==========================
+# RECOMMENDATION ENGINE
+# ==========================
+# Server-side port of the SmartMenu.tsx scoring rules.
+#
+# Per menu version we compile every item into small ints (tag bitmask,
+# allergen bitmask, diet / spice codes) so scoring a guest profile is a
+# single pass of bit tests over parallel lists - no string work per item.
+# Guests share a handful of preference combinations, so ranked results are
+# cached per (menu version, normalized profile) with LRU eviction.
+
+BASE_SCORE = 60
+CACHE_SIZE = 512
+
+SPICE_CODES = {"mild": 0, "medium": 1, "fiery": 2}
+DIET_CODES = {"veg": 0, "vegetarian": 0, "non-veg": 1, "egg": 2}
+UNKNOWN_CODE = -1
+
+
+def _norm_tag(text: str) -> str:
+    # Same normalisation as the client: lower case, no '_' / '-'
+    return re.sub(r"[_-]", "", (text or "").lower())
+
+
+def _format_text(text: str) -> str:
+    return " ".join(word[:1].upper() + word[1:] for word in (text or "").split("_"))
+
+
+def _split(values) -> List[str]:
+    if not values:
+        return []
+    if isinstance(values, str):
+        values = values.split(",")
+    return [v.strip() for v in values if v and v.strip()]
+
+
+class CompiledMenu:
+    def __init__(self, snapshot: MenuSnapshot):
+        self.version = snapshot.version
+        self.tag_bits = {}
+        self.allergen_bits = {}
+
+        self.ids, self.names, self.categories = [], [], []
+        self.tag_masks, self.allergen_masks = [], []
+        self.spice, self.diet, self.available = [], [], []
+
+        for item in snapshot.items:
+            self.ids.append(item.id)
+            self.names.append(item.name)
+            self.categories.append(item.category)
+            self.tag_masks.append(self._mask(self.tag_bits, item.tags))
+            self.allergen_masks.append(self._mask(self.allergen_bits, (a.lower() for a in item.allergens)))
+            self.spice.append(SPICE_CODES.get(item.spiceLevel, UNKNOWN_CODE))
+            self.diet.append(DIET_CODES.get(item.dietaryType, UNKNOWN_CODE))
+            self.available.append(item.isAvailable)
+
+        # Normalised tag vocabulary for the substring goal match
+        self.normalized_tags = [(_norm_tag(tag), bit) for tag, bit in self.tag_bits.items()]
+
+    @staticmethod
+    def _mask(bits: dict, values: Iterable[str]) -> int:
+        mask = 0
+        for value in values:
+            if value not in bits:
+                bits[value] = 1 << len(bits)
+            mask |= bits[value]
+        return mask
+
+    def tags_mask(self, *tags: str) -> int:
+        mask = 0
+        for tag in tags:
+            mask |= self.tag_bits.get(tag, 0)
+        return mask
+
+
+class Profile:
+    """Preference set normalised so equivalent guests share a cache entry.
+
+    Accepts both naming schemes the client stores:
+    moods/cravings, goals/healthGoals, dietary/dietType, allergens/allergies.
+    """
+
+    def __init__(self, moods=None, goals=None, dietary: Optional[str] = None, allergens=None):
+        self.moods = tuple(sorted({m.lower() for m in _split(moods)}))
+        # Keep the original spelling for reasons, dedupe on the normalised form
+        goal_map = {}
+        for g in _split(goals):
+            goal_map.setdefault(_norm_tag(g), g)
+        self.goals = tuple(sorted(goal_map.items()))
+        self.dietary = (dietary or "non-veg").lower()
+        self.allergens = tuple(sorted({a.lower() for a in _split(allergens)}))
+
+    @classmethod
+    def from_preferences(cls, prefs: Optional[dict]) -> "Profile":
+        prefs = prefs or {}
+        return cls(
+            moods=prefs.get("moods") or prefs.get("cravings"),
+            goals=prefs.get("goals") or prefs.get("healthGoals"),
+            dietary=prefs.get("dietary") or prefs.get("dietType"),
+            allergens=prefs.get("allergens") or prefs.get("allergies"),
+        )
+
+    @property
+    def key(self) -> tuple:
+        return (self.moods, self.goals, self.dietary, self.allergens)
+
+
+def score_menu(menu: CompiledMenu, profile: Profile, include_unavailable: bool = False) -> list:
+    """Score every item in one pass; returns ranked (highest first) results"""
+    # --- Resolve the profile to masks once, outside the item loop ---
+    spicy_mask = menu.tags_mask("spicy")
+    comfort_mask = menu.tags_mask("comfort")
+    light_mask = menu.tags_mask("light", "healthy")
+    popular_mask = menu.tags_mask("bestseller", "popular")
+    protein_mask = menu.tags_mask("high_protein")
+    keto_mask = menu.tags_mask("keto")
+
+    wants_spicy = "spicy" in profile.moods
+    wants_comfort = "comfort" in profile.moods
+    wants_light = "light" in profile.moods
+
+    goal_rules = []  # (tag mask, points, reason)
+    for normalized, original in profile.goals:
+        substring_mask = 0
+        for tag, bit in menu.normalized_tags:
+            if normalized in tag:
+                substring_mask |= bit
+        goal_rules.append((substring_mask, 15, _format_text(original)))
+        if normalized in ("protein", "highprotein"):
+            goal_rules.append((protein_mask, 15, "High Protein"))
+        if normalized == "keto":
+            goal_rules.append((keto_mask, 20, "Keto Friendly"))
+
+    allergen_mask = 0
+    for allergen in profile.allergens:
+        allergen_mask |= menu.allergen_bits.get(allergen, 0)
+
+    veg_bonus = 10 if profile.dietary == "veg" else 0
+    nonveg_bonus = 5 if profile.dietary == "non-veg" else 0
+
+    # --- Single pass over the compiled columns ---
+    results = []
+    for i, tags in enumerate(menu.tag_masks):
+        if menu.allergen_masks[i] & allergen_mask:
+            continue
+        if not include_unavailable and not menu.available[i]:
+            continue
+
+        score = 0
+        reasons = []
+        if wants_spicy and (menu.spice[i] >= 1 or tags & spicy_mask):
+            score += 25; reasons.append("Spicy Craving")
+        if wants_comfort and tags & comfort_mask:
+            score += 20; reasons.append("Comfort Food")
+        if wants_light and tags & light_mask:
+            score += 15; reasons.append("Light Choice")
+        for mask, points, reason in goal_rules:
+            if tags & mask:
+                score += points; reasons.append(reason)
+        diet = menu.diet[i]
+        if diet == 0:
+            score += veg_bonus
+        elif diet == 1:
+            score += nonveg_bonus
+        if tags & popular_mask:
+            score += 10; reasons.append("Bestseller")
+
+        results.append((BASE_SCORE + score, i, reasons))
+
+    # Stable sort keeps menu order for ties, like the client
+    results.sort(key=lambda r: r[0], reverse=True)
+    return [
+        {
+            "id": menu.ids[i],
+            "name": menu.names[i],
+            "category": menu.categories[i],
+            "score": score,
+            "matchPercentage": min(99, max(BASE_SCORE, score)),
+            "matchReasons": reasons,
+            "whyText": f"Matches {reasons[0]}" if reasons else "Chef's Pick",
+        }
+        for score, i, reasons in results
+    ]
+
+
+class RecommendationEngine:
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self._compiled: Optional[CompiledMenu] = None
+        self._cache: "OrderedDict[tuple, list]" = OrderedDict()
+        self.cache_size = cache_size
+
+    def _menu(self, snapshot: MenuSnapshot) -> CompiledMenu:
+        if not self._compiled or self._compiled.version != snapshot.version:
+            self._compiled = CompiledMenu(snapshot)
+            self._cache.clear()  # Old versions can never be hit again
+        return self._compiled
+
+    def recommend(self, snapshot: MenuSnapshot, profile: Profile, top: Optional[int] = None,
+                  category: Optional[str] = None, include_unavailable: bool = False) -> list:
+        menu = self._menu(snapshot)
+        key = (menu.version, profile.key, include_unavailable)
+        ranked = self._cache.get(key)
+        if ranked is None:
+            ranked = score_menu(menu, profile, include_unavailable)
+            self._cache[key] = ranked
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+
+        if category and category != "All":
+            ranked = [r for r in ranked if r["category"] == category]
+        return ranked[:top] if top else ranked
+
+
+engine = RecommendationEngine()
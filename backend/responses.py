@@ -0,0 +1,82 @@
+import os
+from datetime import date, datetime
+from typing import Any, List, Type
+
+from bson import ObjectId
+from fastapi.responses import Response
+from pydantic import BaseModel, TypeAdapter
+
+# LOCAL IMPORTS
+from models import MenuItem, User
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib so a missing wheel never breaks the API
+    orjson = None
+    import json
+
+# ==========================
+# FAST RESPONSE LAYER
+# ==========================
+# Returning a dict from a route makes FastAPI walk it with jsonable_encoder
+# (and re-validate it when the route has a response_model) before json.dumps.
+# Routes on the hot path instead return `json_response(...)`, which encodes
+# straight to bytes with orjson (ObjectId / datetime handled natively), and
+# `model_response(...)` for documents that must match a model.
+#
+# TRUST_STORED_DOCS=1 skips re-validating documents read back from Mongo:
+# every write path validates through the same models (menu edits through
+# MenuItemUpdate, typed field by field like MenuItem), so a read only has
+# to rename `_id` and encode. Documents written some other way (scripts,
+# the Mongo shell) must keep to the models too, or leave this off.
+
+TRUST_STORED_DOCS = os.getenv("TRUST_STORED_DOCS", "0") == "1"
+
+# Precompiled once; building an adapter per request is the expensive part
+ADAPTERS = {
+    MenuItem: TypeAdapter(MenuItem),
+    User: TypeAdapter(User),
+}
+MENU_LIST_ADAPTER = TypeAdapter(List[MenuItem])
+
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):  # stdlib fallback only; orjson does these itself
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(data: Any) -> bytes:
+    if orjson:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=_default, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def json_response(data: Any, status_code: int = 200) -> FastJSONResponse:
+    return FastJSONResponse(data, status_code=status_code)
+
+
+def rename_id(doc: dict) -> dict:
+    """`_id` -> `id` in place (documents fresh from Mongo are ours to mutate)"""
+    if doc and "_id" in doc:
+        doc["id"] = str(doc.pop("_id"))
+    return doc
+
+
+def model_response(doc: dict, model: Type[BaseModel]) -> Response:
+    """Encode a stored document the way `response_model=model, by_alias=False` would"""
+    if TRUST_STORED_DOCS:
+        return json_response(rename_id(doc))
+    adapter = ADAPTERS[model]
+    return Response(adapter.dump_json(adapter.validate_python(doc)), media_type="application/json")
@@ -0,0 +1,184 @@
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+# LOCAL IMPORTS
+from bus import RESYNC, bus
+from menu_cache import MENU_INVALIDATED, MenuSnapshot
+
+# ==========================
+# MENU SEARCH INDEX
+# ==========================
+# In-memory inverted index over the menu, so /api/menu/search never touches
+# Mongo. Three ways a query token can hit an indexed token:
+#   exact   - "biriyani" == "biriyani"
+#   prefix  - "biri" -> "biriyani"            (sorted vocabulary + bisect)
+#   fuzzy   - "biryani" -> "biriyani"         (trigram candidates + edit distance)
+# Built lazily from the menu snapshot, then kept current by the menu write
+# routes through upsert() / remove(). Menu writes on another worker drop it
+# (rebuilt from the fresh snapshot on the next search).
+
+FIELD_WEIGHTS = {"name": 3.0, "heroIngredient": 2.0, "tags": 2.0, "category": 1.5, "description": 1.0}
+MATCH_WEIGHTS = {"exact": 1.0, "prefix": 0.7, "fuzzy": 0.4}
+MIN_FUZZY_LEN = 4
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text) -> List[str]:
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(t) for t in text)
+    return _TOKEN_RE.findall(str(text).lower().replace("_", " "))
+
+
+def _trigrams(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _max_edits(token: str) -> int:
+    return 1 if len(token) <= 6 else 2
+
+
+def _within_distance(a: str, b: str, limit: int) -> bool:
+    """Levenshtein distance <= limit, abandoning rows that already exceed it"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+class MenuSearchIndex:
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.built = False
+        self.items: Dict[str, dict] = {}                    # id -> summary returned to clients
+        self.postings: Dict[str, Dict[str, float]] = defaultdict(dict)  # token -> {id: field weight}
+        self.item_tokens: Dict[str, set] = {}               # id -> tokens (for removal)
+        self.vocabulary: List[str] = []                     # sorted, for prefix scans
+        self.trigrams: Dict[str, set] = defaultdict(set)    # trigram -> tokens
+
+    # --- Building / incremental maintenance ---
+    def build(self, snapshot: MenuSnapshot):
+        self._reset()
+        for item in snapshot.items:
+            self.upsert(item.model_dump(by_alias=False), force=True)
+        self.built = True
+
+    def invalidate(self):
+        """Drop everything; the next search rebuilds from the menu snapshot"""
+        self._reset()
+
+    def upsert(self, doc: Optional[dict], force: bool = False):
+        """Index (or re-index) one menu item dict (Mongo doc or model dump)"""
+        if not doc or not (self.built or force):
+            return
+        item_id = str(doc.get("_id") or doc.get("id"))
+        self.remove(item_id)
+
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(doc.get(field)):
+                weights[token] = max(weights.get(token, 0), weight)
+        for token, weight in weights.items():
+            if token not in self.postings:
+                insort(self.vocabulary, token)
+                for gram in _trigrams(token):
+                    self.trigrams[gram].add(token)
+            self.postings[token][item_id] = weight
+
+        self.item_tokens[item_id] = set(weights)
+        self.items[item_id] = {
+            "id": item_id,
+            "name": doc.get("name"),
+            "category": doc.get("category"),
+            "price": doc.get("price"),
+            "isAvailable": doc.get("isAvailable", True),
+        }
+
+    def remove(self, item_id: str):
+        for token in self.item_tokens.pop(item_id, ()):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(item_id, None)
+            if not posting:
+                del self.postings[token]
+                self.vocabulary.pop(bisect_left(self.vocabulary, token))
+                for gram in _trigrams(token):
+                    self.trigrams[gram].discard(token)
+        self.items.pop(item_id, None)
+
+    # --- Query side ---
+    def _expand(self, term: str) -> Dict[str, float]:
+        """Indexed tokens a query term can match, with match-quality weight"""
+        matches = {}
+        if term in self.postings:
+            matches[term] = MATCH_WEIGHTS["exact"]
+
+        vocabulary = self.vocabulary
+        for i in range(bisect_left(vocabulary, term), len(vocabulary)):
+            if not vocabulary[i].startswith(term):
+                break
+            matches.setdefault(vocabulary[i], MATCH_WEIGHTS["prefix"])
+
+        if len(term) >= MIN_FUZZY_LEN:
+            limit = _max_edits(term)
+            grams = _trigrams(term)
+            shared = defaultdict(int)
+            for gram in grams:
+                for token in self.trigrams.get(gram, ()):
+                    shared[token] += 1
+            # Each edit destroys at most 3 trigrams
+            needed = len(grams) - 3 * limit
+            for token, count in shared.items():
+                if token not in matches and count >= needed and _within_distance(term, token, limit):
+                    matches[token] = MATCH_WEIGHTS["fuzzy"]
+        return matches
+
+    def search(self, query: str, limit: int = 20, include_unavailable: bool = True) -> list:
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        scores: Optional[Dict[str, float]] = None
+        for term in terms:
+            term_scores = defaultdict(float)
+            for token, quality in self._expand(term).items():
+                for item_id, field_weight in self.postings[token].items():
+                    term_scores[item_id] = max(term_scores[item_id], quality * field_weight)
+            # Every query term has to match something on the item
+            if scores is None:
+                scores = dict(term_scores)
+            else:
+                scores = {i: s + term_scores[i] for i, s in scores.items() if i in term_scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], self.items[kv[0]]["name"] or ""))
+        results = []
+        for item_id, score in ranked:
+            item = self.items[item_id]
+            if not include_unavailable and not item["isAvailable"]:
+                continue
+            results.append({**item, "score": round(score, 3)})
+            if len(results) >= limit:
+                break
+        return results
+
+
+search_index = MenuSearchIndex()
+bus.subscribe(MENU_INVALIDATED, lambda _: search_index._reset())
+bus.subscribe(RESYNC, lambda _: search_index._reset())
@@ -0,0 +1,68 @@
+"""
+Production launcher: N uvicorn workers behind one port.
+
+    python serve.py                      # WEB_CONCURRENCY workers (default: CPU count)
+    python serve.py --workers 4 --port 8000
+
+`python main.py` stays the single-process dev server (auto-reload).
+
+Indexes and seed data are set up once here, before the workers fork, so
+they don't race each other on an empty database. With more than one worker
+the cluster bus is switched on (see bus.py): menu invalidations, table
+registry updates, dashboard events and archive moves reach every worker.
+
+/metrics is per worker: each scrape reports whichever worker answered it.
+
+OUTBOX_PATH=/var/lib/dineai/outbox.db journals orders on local disk before
+they reach Mongo (see outbox.py); the workers share the one file. Point it
+at persistent storage: on an ephemeral disk a restart loses queued orders.
+Without it orders are written straight to Mongo.
+"""
+import argparse
+import asyncio
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DineAI production server")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1)
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = parser.parse_args()
+
+    # Workers are fresh interpreters: they read these at import
+    if args.workers > 1:
+        os.environ["CLUSTER_BUS"] = "1"
+    os.environ["SETUP_DONE"] = "1"
+
+    import uvicorn
+    import analytics
+    import database
+    from indexes import ensure_indexes
+    from main import seed_data
+
+    async def setup():
+        database.connect()
+        try:
+            await ensure_indexes()
+            await seed_data()
+            await analytics.backfill_if_empty()
+        finally:
+            database.close()
+
+    asyncio.run(setup())
+    print(f"🚀 STARTING {args.workers} WORKER(S) ON {args.host}:{args.port}")
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# LOCAL IMPORTS
+from database import db
+from menu_cache import MenuSnapshot, menu_cache
+from search import search_index
+
+# ==========================
+# STOCK RESERVATION
+# ==========================
+# place_order reserves every tracked line (menu items whose `stock` is a
+# number; null = not tracked) with ONE ordered bulk_write:
+#
+#   UpdateOne({_id}, [_id = stock >= qty ? _id : null, stock -= qty, isAvailable &= stock > 0])
+#
+# The _id rewrite is the guard: with too little stock left the update tries
+# to change the immutable _id and the write fails. In an ordered bulk the
+# error carries the index of the failing line and nothing after it runs, so
+# exactly ops[:index] were applied and are given back with a second
+# bulk_write. No locks, no per-item round trips, and two tables racing for
+# the last portion can never both get it.
+#
+# Ordinary decrements leave the menu snapshot alone (its `stock` numbers are
+# allowed to lag). When an item sells out, isAvailable flips to false in the
+# same write and the snapshot and search index are invalidated. To learn that
+# without reading the items back, each line is followed by a probe that only
+# matches an item this order emptied and never modifies it: every applied
+# take modifies its item, so
+#   matched_count - modified_count = items this order emptied
+#   lines - modified_count         = items deleted since the snapshot
+IMMUTABLE_FIELD = 66
+
+
+def _menu_changed():
+    # Availability flipped: the bus resets the other workers' search indexes, not ours
+    menu_cache.invalidate()
+    search_index.invalidate()
+
+
+class OutOfStock(Exception):
+    def __init__(self, items: List[dict]):
+        super().__init__(", ".join(i["name"] for i in items))
+        self.items = items  # [{name, requested}]
+
+
+class Reservation:
+    def __init__(self, lines: list):
+        self.lines = lines  # [(oid, name, qty)] actually taken
+
+    async def release(self):
+        """Give the reserved quantities back (order write failed after reserving)"""
+        if self.lines:
+            await db.menu.bulk_write([_give_back(oid, qty) for oid, _, qty in self.lines], ordered=False)
+            _menu_changed()  # May have made a sold-out item available again
+
+
+def _take(oid: ObjectId, qty: int) -> UpdateOne:
+    remaining = {"$subtract": ["$stock", qty]}
+    return UpdateOne(
+        {"_id": oid},
+        [{"$set": {
+            "_id": {"$cond": [{"$gte": ["$stock", qty]}, "$_id", None]},
+            "stock": remaining,
+            "isAvailable": {"$and": [{"$ifNull": ["$isAvailable", True]}, {"$gt": [remaining, 0]}]},
+        }}],
+    )
+
+
+def _probe_sold_out(oid: ObjectId) -> UpdateOne:
+    return UpdateOne({"_id": oid, "stock": {"$lte": 0}, "isAvailable": False}, {"$set": {"isAvailable": False}})
+
+
+def _give_back(oid: ObjectId, qty: int) -> UpdateOne:
+    # Restores availability only if the reservation is what sold it out
+    restored = {"$add": ["$stock", qty]}
+    return UpdateOne(
+        {"_id": oid},
+        [{"$set": {
+            "stock": restored,
+            "isAvailable": {"$or": ["$isAvailable", {"$and": [{"$lte": ["$stock", 0]}, {"$gt": [restored, 0]}]}]},
+        }}],
+    )
+
+
+# --- Resolving order lines to tracked menu items ---
+class _TrackedIndex:
+    """name / id -> (oid, name) for items with numeric stock, per snapshot version"""
+
+    def __init__(self, snapshot: MenuSnapshot):
+        self.version = snapshot.version
+        self.by_key = {}
+        for item in snapshot.items:
+            if item.stock is None or not item.id:
+                continue
+            entry = (ObjectId(item.id), item.name)
+            self.by_key[item.id] = entry
+            self.by_key[item.name.strip().lower()] = entry
+
+
+_tracked: Optional[_TrackedIndex] = None
+
+
+async def _tracked_index() -> _TrackedIndex:
+    global _tracked
+    snapshot = await menu_cache.get()
+    if not _tracked or _tracked.version != snapshot.version:
+        _tracked = _TrackedIndex(snapshot)
+    return _tracked
+
+
+async def reserve(items: list) -> Reservation:
+    """Reserve stock for order lines (OrderItem models); raises OutOfStock, taking nothing"""
+    index = await _tracked_index()
+    wanted = OrderedDict()  # oid -> [name, qty]; repeated lines are summed
+    for item in items:
+        entry = index.by_key.get(item.menu_item_id or "") or index.by_key.get((item.name or "").strip().lower())
+        if not entry or item.quantity <= 0:
+            continue
+        oid, name = entry
+        wanted.setdefault(oid, [name, 0])[1] += item.quantity
+    if not wanted:
+        return Reservation([])
+
+    lines = [(oid, name, qty) for oid, (name, qty) in wanted.items()]
+    ops = []
+    for oid, _, qty in lines:
+        ops += [_take(oid, qty), _probe_sold_out(oid)]
+    try:
+        result = await db.menu.bulk_write(ops, ordered=True)
+    except BulkWriteError as e:
+        error = e.details["writeErrors"][0]
+        failed = error["index"] // 2  # Two ops per line
+        await Reservation(lines[:failed]).release()
+        if error.get("code") != IMMUTABLE_FIELD:
+            raise
+        _, name, qty = lines[failed]
+        raise OutOfStock([{"name": name, "requested": qty}])
+
+    if result.modified_count < len(lines):
+        # Item deleted since the snapshot: nothing to take, so it's unavailable
+        oids = [oid for oid, _, _ in lines]
+        present = {doc["_id"] for doc in await db.menu.find({"_id": {"$in": oids}}, {"_id": 1}).to_list(None)}
+        await Reservation([line for line in lines if line[0] in present]).release()
+        raise OutOfStock([{"name": name, "requested": qty} for oid, name, qty in lines if oid not in present])
+
+    if result.matched_count > result.modified_count:
+        print(f"🚫 SOLD OUT: {result.matched_count - result.modified_count} item(s)")
+        _menu_changed()
+    return Reservation(lines)
@@ -0,0 +1,127 @@
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Iterable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+# LOCAL IMPORTS
+from bus import bus
+from coalesce import coalescer
+from database import db
+
+# ==========================
+# ORDER REVISION CLOCK
+# ==========================
+# Every write to `orders` stamps the touched documents with a monotonic
+# `revision` (plus a human readable `updatedAt`). Tablets poll with the last
+# cursor they saw and only get back documents whose revision is newer.
+#
+# Revisions come from a single counter document, so they are unique and
+# ordered. A write can take its revision and then commit *after* a later
+# revision has already been read by a poller, so a delta read first takes
+# the clock's `horizon()`: the highest revision that every write at or below
+# it had committed by. It is read BEFORE the orders query, so whatever
+# commits later is above it, and the cursor handed back never passes it.
+# Worst case a client receives the same order twice, which is harmless
+# because clients upsert by id.
+#
+# Single worker: the horizon is the last revision this process allocated,
+# held below the oldest one still being written. With several workers
+# (cluster bus on) the in-flight revisions live on the counter document:
+# the update that takes a revision also appends it to `inFlight`, the write
+# pulls it once committed, and the horizon is read from that one document.
+# An entry older than CURSOR_ORPHAN_SECONDS belongs to a worker that died
+# mid-write; it stops holding the cursor back and the next allocation drops it.
+
+CURSOR_ORPHAN_SECONDS = 60
+
+class RevisionClock:
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight = set()
+        self._last: Optional[int] = None  # Highest revision allocated here (single worker)
+
+    async def _next(self) -> int:
+        if not bus.enabled:
+            counter = await db.counters.find_one_and_update(
+                {"_id": self.name},
+                {"$inc": {"seq": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            return counter["seq"]
+        now = time.time()
+        counter = await db.counters.find_one_and_update(
+            {"_id": self.name},
+            [
+                {"$set": {"seq": {"$add": [{"$ifNull": ["$seq", 0]}, 1]}}},
+                {"$set": {"inFlight": {"$concatArrays": [
+                    {"$filter": {
+                        "input": {"$ifNull": ["$inFlight", []]},
+                        "cond": {"$gt": ["$$this.at", now - CURSOR_ORPHAN_SECONDS]},
+                    }},
+                    {"$map": {"input": [0], "in": {"rev": "$seq", "at": now}}},
+                ]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["seq"]
+
+    async def _committed(self, revision: int):
+        if not bus.enabled:
+            return
+        try:
+            await db.counters.update_one({"_id": self.name}, {"$pull": {"inFlight": {"rev": revision}}})
+        except PyMongoError as e:
+            print(f"⚠️ Revision {revision} left in flight ({e}); cursors wait {CURSOR_ORPHAN_SECONDS}s")
+
+    @asynccontextmanager
+    async def allocate(self):
+        """Reserve the next revision for the duration of a write."""
+        revision = await self._next()
+        self._last = max(self._last or 0, revision)
+        self._in_flight.add(revision)
+        try:
+            yield revision
+        finally:
+            self._in_flight.discard(revision)
+            await self._committed(revision)
+            coalescer.touch(self.name)  # Reads from here on don't reuse pre-write results
+
+    async def horizon(self) -> int:
+        """Highest revision every write at or below has committed by.
+
+        Take it before reading the orders it will cap.
+        """
+        if not bus.enabled:
+            if self._last is None:
+                counter = await db.counters.find_one({"_id": self.name})
+                self._last = max(self._last or 0, (counter or {}).get("seq", 0))
+            return min([self._last] + [revision - 1 for revision in self._in_flight])
+        counter = await db.counters.find_one({"_id": self.name}) or {}
+        orphaned = time.time() - CURSOR_ORPHAN_SECONDS
+        in_flight = [entry["rev"] - 1 for entry in counter.get("inFlight") or () if entry.get("at", 0) > orphaned]
+        return min([counter.get("seq", 0)] + in_flight)
+
+    def cursor_for(self, since: int, orders: Iterable[dict], horizon: int) -> int:
+        """Highest revision a client can safely resume from after this read."""
+        cursor = max([since] + [o["revision"] for o in orders if o.get("revision") is not None])
+        return max(min(cursor, horizon), 0)
+
+
+order_clock = RevisionClock("orders")
+
+
+def stamp(revision: int, event: Optional[str] = None) -> dict:
+    """`$set` fragment recording a write at `revision`.
+
+    `event` is the typed order event (see events.py) that caused the write;
+    the change stream relay reads it back to classify the change.
+    """
+    fields = {"revision": revision, "updatedAt": datetime.now().isoformat()}
+    if event:
+        fields["lastEvent"] = event
+    return fields
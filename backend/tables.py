@@ -0,0 +1,146 @@
+from typing import Dict, List, Optional
+
+# LOCAL IMPORTS
+from bus import RESYNC, bus
+from database import db
+from indexes import ACTIVE_EXCLUDED
+
+# ==========================
+# LIVE TABLE REGISTRY
+# ==========================
+# tableId -> the table's active order (id, guest, status, running total).
+# Hydrated from Mongo at startup, then kept current by the order routes from
+# the documents their writes return, so guest session polls and the floor
+# plan never query Mongo.
+#
+# A table's active order is the newest non-paid / non-cancelled one (same
+# rule as the old get_session query). Writes to one order can finish out of
+# order, so an update only replaces the entry if it is for a newer order or
+# carries a newer revision of the same one.
+#
+# Per process: every change is also published on the cluster bus, and other
+# workers fold it into their own copy with the same newer-wins rule.
+#
+# Orders still in the outbox journal (not in Mongo yet) are kept beside the
+# registry by outbox.py and shown as "queued" on top of it.
+
+SESSION_FIELDS = {"tableId": 1, "guestName": 1, "status": 1, "totalAmount": 1, "items": 1, "revision": 1, "createdAt": 1}
+
+
+class TableState:
+    __slots__ = ("tableId", "orderId", "guestName", "status", "totalAmount", "itemCount", "revision", "openedAt")
+
+    def __init__(self, order: dict):
+        self.tableId = order.get("tableId")
+        self.orderId = str(order.get("id") or order.get("_id"))
+        self.guestName = order.get("guestName")
+        self.status = order.get("status")
+        self.totalAmount = order.get("totalAmount") or 0
+        self.itemCount = sum(item.get("quantity", 1) for item in order.get("items") or ())
+        self.revision = order.get("revision") or 0
+        self.openedAt = order.get("createdAt")
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TableState":
+        state = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(state, name, data.get(name))
+        return state
+
+
+class TableRegistry:
+    def __init__(self):
+        self._tables: Dict[int, TableState] = {}
+        self._queued: Dict[int, List[dict]] = {}  # tableId -> outbox entries not yet in Mongo
+        self.hydrated = False
+
+    async def hydrate(self):
+        tables = {}
+        cursor = db.orders.find({"status": {"$nin": ACTIVE_EXCLUDED}}, SESSION_FIELDS).sort("_id", 1)
+        async for order in cursor:
+            tables[order.get("tableId")] = TableState(order)  # Newest per table wins
+        self._tables = tables
+        self.hydrated = True
+        print(f"🪑 TABLE REGISTRY: {len(tables)} active tables")
+
+    async def refresh(self, table_id: int, broadcast: bool = True):
+        """Re-read one table from Mongo (after writes that don't return the document)"""
+        order = await db.orders.find_one(
+            {"tableId": table_id, "status": {"$nin": ACTIVE_EXCLUDED}},
+            SESSION_FIELDS, sort=[("_id", -1)]
+        )
+        if order:
+            self._tables[table_id] = TableState(order)
+        else:
+            self._tables.pop(table_id, None)
+        if broadcast:
+            bus.publish(TABLE_REFRESHED, {"tableId": table_id})
+
+    def settle(self, table_id: int, revision: int):
+        """settle_table marked the table's open orders paid at `revision`: free it now"""
+        current = self._tables.get(table_id)
+        if current and current.revision <= revision:
+            del self._tables[table_id]
+        bus.publish(TABLE_REFRESHED, {"tableId": table_id})
+
+    def apply(self, order: dict):
+        """Fold in an order document returned by a write (serialized or raw)"""
+        if not order:
+            return
+        state = TableState(order)
+        self._fold(state)
+        bus.publish(TABLE_CHANGED, state.as_dict())
+
+    def _fold(self, state: TableState):
+        current = self._tables.get(state.tableId)
+
+        if state.status in ACTIVE_EXCLUDED:
+            if current and current.orderId == state.orderId:
+                del self._tables[state.tableId]
+            return
+        if current is None:
+            self._tables[state.tableId] = state
+        elif current.orderId == state.orderId:
+            if state.revision >= current.revision:
+                self._tables[state.tableId] = state
+        elif state.orderId > current.orderId:  # ObjectId hex sorts by creation time
+            self._tables[state.tableId] = state
+
+    def set_pending(self, entries: List[dict]):
+        """Replace the outbox overlay (journal order)"""
+        queued = {}
+        for entry in entries:
+            queued.setdefault(entry["tableId"], []).append(entry)
+        self._queued = queued
+
+    def get(self, table_id: int) -> Optional[TableState]:
+        return self._tables.get(table_id)
+
+    def queued(self, table_id: int) -> List[dict]:
+        return self._queued.get(table_id, [])
+
+    def floor_plan(self) -> list:
+        plan = []
+        for t in sorted(self._tables.keys() | self._queued.keys(), key=lambda t: (t is None, t)):
+            state, queued = self._tables.get(t), self.queued(t)
+            if state:
+                row = state.as_dict()
+            else:  # First order still in the journal
+                row = {"tableId": t, "orderId": None, "guestName": queued[0]["guestName"], "status": "queued",
+                       "totalAmount": 0, "itemCount": 0, "revision": 0, "openedAt": queued[0]["journaledAt"]}
+            row["queued"] = len(queued)
+            row["queuedItems"] = sum(entry["itemCount"] for entry in queued)
+            plan.append(row)
+        return plan
+
+
+TABLE_CHANGED = "tables.changed"
+TABLE_REFRESHED = "tables.refreshed"
+
+table_registry = TableRegistry()
+bus.subscribe(TABLE_CHANGED, lambda state: table_registry._fold(TableState.from_dict(state)))
+bus.subscribe(TABLE_REFRESHED, lambda msg: table_registry.refresh(msg["tableId"], broadcast=False))
+bus.subscribe(RESYNC, lambda _: table_registry.hydrate())
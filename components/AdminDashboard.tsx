@@ -10,7 +10,7 @@ import {
     X,
     Image as ImageIcon
 } from 'lucide-react';
-import { api, MenuItem, Order } from '../services/api';
+import { api, MenuItem } from '../services/api';
 import { DietaryType, SpiceLevel } from '../services/db';
 
 interface AdminDashboardProps {
@@ -18,7 +18,7 @@ interface AdminDashboardProps {
 }
 
 const AdminDashboard: React.FC<AdminDashboardProps> = ({ onNavigate }) => {
-    const [orders, setOrders] = useState<Order[]>([]);
+    const [salesSummary, setSalesSummary] = useState<{ revenue: number; orders: number } | null>(null);
     const [menuItems, setMenuItems] = useState<MenuItem[]>([]);
     const [isLoading, setIsLoading] = useState(true);
 
@@ -42,9 +42,9 @@ const AdminDashboard: React.FC<AdminDashboardProps> = ({ onNavigate }) => {
     const fetchData = async () => {
         setIsLoading(true);
         try {
-            // 1. Fetch Orders for Analytics
-            const fetchedOrders = await api.getOrders('paid');
-            setOrders(fetchedOrders);
+            // 1. Fetch Analytics (server-side rollups)
+            const summary = await api.getAnalyticsSummary();
+            setSalesSummary(summary);
 
             // 2. Fetch Menu
             const fetchedMenu = await api.fetchMenu();
@@ -62,10 +62,10 @@ const AdminDashboard: React.FC<AdminDashboardProps> = ({ onNavigate }) => {
 
     // --- ANALYTICS ---
     const analytics = useMemo(() => {
-        const totalRevenue = orders.reduce((sum, order) => sum + order.totalAmount, 0);
-        const totalOrders = orders.length; // Already filtered by 'paid'
+        const totalRevenue = salesSummary?.revenue || 0;
+        const totalOrders = salesSummary?.orders || 0; // Paid orders only
         return { totalRevenue, totalOrders };
-    }, [orders]);
+    }, [salesSummary]);
 
     // --- HANDLERS ---
     const handleToggleAvailability = async (id: string) => {
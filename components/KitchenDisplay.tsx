@@ -1,10 +1,13 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { ChefHat, CheckCircle2 } from 'lucide-react'; // Timer removed, used in sub-component
 import { OrderTicket } from '../context/RestaurantContext'; // Use Context Type
 import OrderTimer from './OrderTimer'; // Import Timer
 import { motion, AnimatePresence } from 'framer-motion';
 
 import StaffNavbar from './StaffNavbar';
+import { api } from '../services/api';
+
+const ETA_REFRESH_MS = 30000;
 
 interface KitchenDisplayProps {
   tickets: OrderTicket[];
@@ -17,6 +20,23 @@ interface KitchenDisplayProps {
 }
 
 const KitchenDisplay: React.FC<KitchenDisplayProps> = ({ tickets, onMarkReady }) => {
+  // Predicted ready times (orderId -> ISO), from live prep-time stats + queue depth
+  const [readyAt, setReadyAt] = useState<Record<string, string>>({});
+
+  useEffect(() => {
+    let cancelled = false;
+    const refresh = () => {
+      api.getKitchenEta()
+        .then(eta => {
+          if (!cancelled) setReadyAt(Object.fromEntries(eta.tickets.map(t => [t.orderId, t.readyAt])));
+        })
+        .catch(() => { /* Keep the last prediction; timers still count up */ });
+    };
+    refresh();
+    const interval = setInterval(refresh, ETA_REFRESH_MS);
+    return () => { cancelled = true; clearInterval(interval); };
+  }, [tickets.length]);
+
   // STRICT FILTER: Only show orders that are placed and are food (or have no type - backward compat).
   // SORT: FIFO (Oldest First) - Ascending Order of CreatedAt
   const kitchenOrders = tickets
@@ -65,7 +85,7 @@ const KitchenDisplay: React.FC<KitchenDisplayProps> = ({ tickets, onMarkReady })
                 </div>
 
                 {/* Live Timer */}
-                <OrderTimer startTime={ticket.createdAt} />
+                <OrderTimer startTime={ticket.createdAt} readyAt={readyAt[ticket.id]} />
               </div>
 
               {/* Items */}
@@ -4,10 +4,12 @@ import { motion } from 'framer-motion';
 
 interface OrderTimerProps {
     startTime: Date | string;
+    readyAt?: string; // Predicted by /api/kitchen/eta
 }
 
-const OrderTimer: React.FC<OrderTimerProps> = ({ startTime }) => {
+const OrderTimer: React.FC<OrderTimerProps> = ({ startTime, readyAt }) => {
     const [elapsed, setElapsed] = useState(0);
+    const [remaining, setRemaining] = useState<number | null>(null);
 
     useEffect(() => {
         // Helper to calculate minutes
@@ -17,16 +19,21 @@ const OrderTimer: React.FC<OrderTimerProps> = ({ startTime }) => {
             return Math.floor((now - start) / 60000); // Minutes
         };
 
+        const calculateRemaining = () =>
+            readyAt ? Math.max(0, Math.ceil((new Date(readyAt).getTime() - new Date().getTime()) / 60000)) : null;
+
         // Initial set
         setElapsed(calculateElapsed());
+        setRemaining(calculateRemaining());
 
         // Update every minute (or 30s for responsiveness)
         const interval = setInterval(() => {
             setElapsed(calculateElapsed());
+            setRemaining(calculateRemaining());
         }, 30000);
 
         return () => clearInterval(interval);
-    }, [startTime]);
+    }, [startTime, readyAt]);
 
 
     // ... inside OrderTimer ...
@@ -52,6 +59,11 @@ const OrderTimer: React.FC<OrderTimerProps> = ({ startTime }) => {
             <span className="font-mono font-medium whitespace-nowrap">
                 {elapsed} min
             </span>
+            {remaining !== null && (
+                <span className="font-mono text-xs opacity-75 whitespace-nowrap">
+                    ~{remaining} left
+                </span>
+            )}
         </motion.div>
     );
 };
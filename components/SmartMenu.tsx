@@ -10,6 +10,7 @@ import UpsellModal from './UpsellModal';
 import { MenuItem, MenuItemSize } from './data';
 import { FloatingStatusPill } from './FloatingStatusPill';
 import { ScaleButton } from './animations';
+import { api, RankedItem } from '../services/api';
 
 interface SmartMenuProps {
   preferences: UserPreferences;
@@ -35,11 +36,6 @@ export interface EnrichedMenuItem extends MenuItem {
 
 const FALLBACK_IMAGE = "https://images.unsplash.com/photo-1546069901-ba9599a7e63c?auto=format&fit=crop&w=500&q=80";
 
-const formatText = (text: string) => {
-  if (!text) return '';
-  return text.split('_').map(word => word.charAt(0).toUpperCase() + word.slice(1)).join(' ');
-};
-
 const DietaryIcon = ({ type }: { type: string }) => {
   const isVeg = type === 'veg' || type === 'vegetarian' || type === 'vegan';
   const colorClass = isVeg ? 'border-green-600' : 'border-red-600';
@@ -182,7 +178,15 @@ const SmartMenu: React.FC<SmartMenuProps> = ({ preferences, onPlaceOrder, onProf
   const cartTotal = useMemo(() => cartItems.reduce((sum, item) => sum + (item.price * item.quantity), 0), [cartItems]);
   const cartCount = useMemo(() => cartItems.reduce((sum, item) => sum + item.quantity, 0), [cartItems]);
 
-  // --- RECOMMENDATION ENGINE (DEFENSIVE) ---
+  // --- RECOMMENDATION ENGINE (scored on the backend, cached per preference profile) ---
+  const [ranking, setRanking] = useState<Map<string, RankedItem>>(new Map());
+  const preferenceKey = JSON.stringify(activePreferences || {});
+  useEffect(() => {
+    api.getRecommendations(activePreferences)
+      .then(results => setRanking(new Map(results.map(r => [r.id, r]))))
+      .catch(() => setRanking(new Map()));
+  }, [preferenceKey, activeMenuItems]);
+
   const processedMenu = useMemo(() => {
     if (!activeMenuItems) return [];
     let list = activeMenuItems;
@@ -193,39 +197,12 @@ const SmartMenu: React.FC<SmartMenuProps> = ({ preferences, onPlaceOrder, onProf
     const catItems = activeCategory === 'All' ? list : list.filter(i => i.category === activeCategory);
 
     return catItems.map(item => {
-      let score = 0; const reasons: string[] = []; const tags = item.tags || [];
-
-      // --- PREFERENCE FIELD MAPPING ---
-      // DB may send: cravings, healthGoals, dietary, allergies
-      // Menu expects: moods, goals
-      const moodList = activePreferences?.moods || activePreferences?.cravings || [];
-      const goalList = activePreferences?.goals || activePreferences?.healthGoals || [];
-      const dietaryPref = activePreferences?.dietary || activePreferences?.dietType || 'non-veg';
-      const allergens = activePreferences?.allergens || activePreferences?.allergies || [];
-
-      // Spicy/Mood matching
-      if (moodList.includes('spicy') && (item.spiceLevel === 'fiery' || item.spiceLevel === 'medium' || tags.includes('spicy'))) { score += 25; reasons.push('Spicy Craving'); }
-      if (moodList.includes('comfort') && tags.includes('comfort')) { score += 20; reasons.push('Comfort Food'); }
-      if (moodList.includes('light') && (tags.includes('light') || tags.includes('healthy'))) { score += 15; reasons.push('Light Choice'); }
-
-      // Goal matching
-      goalList.forEach((g: string) => {
-        const normalizedGoal = g.toLowerCase().replace(/[_-]/g, '');
-        if (tags.some(t => t.toLowerCase().replace(/[_-]/g, '').includes(normalizedGoal))) { score += 15; reasons.push(formatText(g)); }
-        if ((normalizedGoal === 'protein' || normalizedGoal === 'highprotein') && tags.includes('high_protein')) { score += 15; reasons.push('High Protein'); }
-        if (normalizedGoal === 'keto' && tags.includes('keto')) { score += 20; reasons.push('Keto Friendly'); }
-      });
-
-      // Dietary match bonus
-      if (dietaryPref === 'veg' && (item.dietaryType === 'veg' || item.dietaryType === 'vegetarian')) { score += 10; }
-      if (dietaryPref === 'non-veg' && item.dietaryType === 'non-veg') { score += 5; }
-
-      // Bestseller/popular boost
-      if (tags.includes('bestseller') || tags.includes('popular')) { score += 10; reasons.push('Bestseller'); }
-
-      return { ...item, score: 60 + score, matchPercentage: Math.min(99, Math.max(60, 60 + score)), matchReasons: reasons, whyText: reasons[0] ? `Matches ${reasons[0]}` : "Chef's Pick" };
+      const ranked = ranking.get(item.id);
+      // Allergen matches are excluded server-side: keep them listed, ranked last
+      if (!ranked) return { ...item, score: 0, matchPercentage: 60, matchReasons: [], whyText: "Chef's Pick" };
+      return { ...item, score: ranked.score, matchPercentage: ranked.matchPercentage, matchReasons: ranked.matchReasons, whyText: ranked.whyText };
     }).sort((a, b) => b.score - a.score);
-  }, [preferences, activeCategory, searchQuery, activeMenuItems, activePreferences]);
+  }, [ranking, activeCategory, searchQuery, activeMenuItems]);
 
   const { topPicks, standardItems } = useMemo(() => {
     // ALWAYS show top 3 highest-scoring items as Top Picks (relaxed threshold)
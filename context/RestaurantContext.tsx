@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useState, useEffect, ReactNode } from 'react';
+import React, { createContext, useContext, useState, useEffect, useRef, ReactNode } from 'react';
 import { api } from '../services/api';
 import { playNotificationSound } from '../utils/SoundManager';
 import { MenuItem } from '../components/data';
@@ -72,7 +72,13 @@ export const RestaurantProvider: React.FC<{ children: ReactNode }> = ({ children
 
     // Audio State
     const [isAudioEnabled, setIsAudioEnabled] = useState(false);
-    const [prevOrderCount, setPrevOrderCount] = useState(0);
+    // Refs, not state: the event subscription below is opened once and reads them live
+    const audioEnabled = useRef(false);
+    const prevOrderCount = useRef(0);
+
+    // Delta Sync State: last server cursor + merged orders by id
+    const orderCursor = useRef(0);
+    const orderIndex = useRef(new Map<string, OrderTicket>());
 
     // --- LAZY STATE INITIALIZATION (Fixes "Flash of Landing") ---
     const [view, setView] = useState(() => {
@@ -120,24 +126,33 @@ export const RestaurantProvider: React.FC<{ children: ReactNode }> = ({ children
 
     // --- 0. HELPER FUNCTIONS (Hoisted for Init) ---
     // --- 1. THE SYNC LOOP (POLLING) ---
+    const resetOrderSync = () => {
+        orderCursor.current = 0;
+        orderIndex.current = new Map();
+    };
+
     const fetchOrders = async () => {
         try {
-            const data = await api.getOrders();
-            // Convert string timestamps back to Date objects
-            const parsedTickets = data.map((t: any) => ({
-                ...t,
-                createdAt: new Date(t.createdAt)
-            }));
+            // Only orders changed since our last cursor come back
+            const delta = await api.getOrdersSince(orderCursor.current);
+            // reset: our cursor predates archived orders, so this is a full snapshot
+            if (orderCursor.current === 0 || delta.reset) orderIndex.current = new Map();
+            delta.orders.forEach((t: any) => {
+                // Convert string timestamps back to Date objects
+                orderIndex.current.set(t.id, { ...t, createdAt: new Date(t.createdAt) });
+            });
+            orderCursor.current = delta.cursor;
+            const parsedTickets = Array.from(orderIndex.current.values());
 
             // Audio Logic
-            if (isAudioEnabled) {
-                if (parsedTickets.length > prevOrderCount) {
+            if (audioEnabled.current) {
+                if (parsedTickets.length > prevOrderCount.current) {
                     playNotificationSound('order');
                 }
             }
 
             setTickets(parsedTickets);
-            setPrevOrderCount(parsedTickets.length);
+            prevOrderCount.current = parsedTickets.length;
             setIsOffline(false);
         } catch (err) {
             console.error("Connection lost:", err);
@@ -260,6 +275,7 @@ export const RestaurantProvider: React.FC<{ children: ReactNode }> = ({ children
         setUser(null);
         // setActiveOrder(null); // Not explicitly in context state, strictly. Tickets are the source of truth.
         setTickets([]); // Clear tickets to be safe? Or keep for cache? Better clear.
+        resetOrderSync();
 
         // 3. CRITICAL: Force Navigation to Landing Page
         setView('landing');
@@ -269,6 +285,7 @@ export const RestaurantProvider: React.FC<{ children: ReactNode }> = ({ children
         console.log("🔄 Starting New Order Session...");
         // Keep User, Clear Tickets
         setTickets([]);
+        resetOrderSync();
         // Force View to Menu
         setView('menu');
     };
@@ -292,6 +309,7 @@ export const RestaurantProvider: React.FC<{ children: ReactNode }> = ({ children
 
     const toggleAudio = () => {
         const newState = !isAudioEnabled;
+        audioEnabled.current = newState;
         setIsAudioEnabled(newState);
         if (newState) {
             playNotificationSound('order');
@@ -301,11 +319,16 @@ export const RestaurantProvider: React.FC<{ children: ReactNode }> = ({ children
     // --- 1. THE SYNC LOOP (POLLING) ---
     // (Moved to top)
 
-    // Audio Polling
+    // Push Sync: every order event pulls the delta; slow polling is only a safety net.
+    // Opened once per mount: reopening on every new order would reconnect every tablet.
     useEffect(() => {
-        const interval = setInterval(fetchOrders, 3000);
-        return () => clearInterval(interval);
-    }, [isAudioEnabled, prevOrderCount]);
+        const source = api.subscribeOrderEvents(() => fetchOrders());
+        const interval = setInterval(fetchOrders, 15000);
+        return () => {
+            source.close();
+            clearInterval(interval);
+        };
+    }, []);
 
     // Initial Load Logic merged into the effect above
     // Keeping menu polling
@@ -320,6 +343,10 @@ export const RestaurantProvider: React.FC<{ children: ReactNode }> = ({ children
     const placeOrder = async (payload: any) => {
         try {
             const updatedOrder = await api.placeOrder(payload);
+            if ('queued' in updatedOrder) {
+                // Accepted but not in the database yet: the ticket shows up with the next sync
+                return updatedOrder as any;
+            }
 
             // IMMEDIATE STATE UPDATE (Fixing Partial Receipt/Display Lag)
             // Convert string dates if needed (though API returns ISO strings, usually fine or we parse)
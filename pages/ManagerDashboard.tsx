@@ -5,13 +5,13 @@ import StaffNavbar from '../components/StaffNavbar';
 import { TrendingUp, DollarSign, Activity, ShoppingBag, ArrowUpRight, ArrowDownRight } from 'lucide-react';
 
 const ManagerDashboard: React.FC = () => {
-    const [orders, setOrders] = useState<any[]>([]);
+    const [summary, setSummary] = useState<any | null>(null);
     const [loading, setLoading] = useState(true);
 
     const loadOrders = async () => {
         try {
-            const data = await api.getOrders();
-            setOrders(data);
+            const data = await api.getAnalyticsSummary();
+            setSummary(data);
         } catch (error) {
             console.error("Failed to load metrics");
         } finally {
@@ -25,26 +25,22 @@ const ManagerDashboard: React.FC = () => {
         return () => clearInterval(interval);
     }, []);
 
-    // --- METRICS CALCULATION ---
+    // --- METRICS (computed server-side from daily rollups) ---
     // 1. Total Revenue (Paid Orders)
-    const paidOrders = orders.filter(o => o.status === 'paid');
-    const totalRevenue = paidOrders.reduce((sum, o) => sum + (o.totalAmount || 0), 0);
+    const totalRevenue = summary?.revenue || 0;
 
     // 2. Average Order Value
-    const aov = paidOrders.length > 0 ? totalRevenue / paidOrders.length : 0;
+    const aov = summary?.averageOrderValue || 0;
 
     // 3. Active Orders (Live)
-    const activeOrdersCount = orders.filter(o => !['paid', 'cancelled'].includes(o.status)).length;
+    const activeOrdersCount = summary?.activeOrders || 0;
 
-    // 4. Best Seller Logic
-    const itemCounts: { [key: string]: number } = {};
-    paidOrders.forEach(o => {
-        o.items?.forEach((i: any) => {
-            itemCounts[i.name] = (itemCounts[i.name] || 0) + i.quantity;
-        });
-    });
-    // Find key with max value
-    const bestSeller = Object.entries(itemCounts).sort((a, b) => b[1] - a[1])[0]; // [name, count]
+    // 4. Best Seller: [name, count]
+    const top = summary?.bestSellers?.[0];
+    const bestSeller = top ? [top.name, top.quantity] : undefined;
+
+    // 5. Recent paid orders, newest first
+    const recentPaid: any[] = summary?.recentPaid || [];
 
     return (
         <div className="min-h-screen bg-[#F1F5F9] dark:bg-[#0F172A] pt-20 pb-12 font-sans transition-colors">
@@ -106,7 +102,7 @@ const ManagerDashboard: React.FC = () => {
                                 </tr>
                             </thead>
                             <tbody className="divide-y divide-slate-100 dark:divide-white/5">
-                                {[...paidOrders].reverse().slice(0, 10).map((order) => (
+                                {recentPaid.map((order) => (
                                     <tr key={order.id} className="hover:bg-slate-50 dark:hover:bg-white/5 transition-colors">
                                         <td className="px-6 py-4 font-mono text-xs">{order.id.slice(-6)}</td>
                                         <td className="px-6 py-4 font-medium text-slate-900 dark:text-white">
@@ -124,7 +120,7 @@ const ManagerDashboard: React.FC = () => {
                                         </td>
                                     </tr>
                                 ))}
-                                {paidOrders.length === 0 && (
+                                {recentPaid.length === 0 && (
                                     <tr>
                                         <td colSpan={6} className="px-6 py-8 text-center text-slate-400">No paid orders yet.</td>
                                     </tr>
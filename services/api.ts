@@ -2,6 +2,28 @@ import { DietaryType, SpiceLevel } from './db';
 
 const API_URL = 'https://dineai-backend.onrender.com';
 
+// Stable per-browser id: the backend rate-limits per device (falls back to table / IP without it)
+const DEVICE_KEY = 'dineai_device_id';
+const deviceId = (() => {
+    try {
+        let id = localStorage.getItem(DEVICE_KEY);
+        if (!id) {
+            id = crypto.randomUUID();
+            localStorage.setItem(DEVICE_KEY, id);
+        }
+        return id;
+    } catch {
+        return undefined;
+    }
+})();
+
+// fetch() with the device header; 429 / 503 responses carry Retry-After
+const apiFetch = (url: string, init: RequestInit = {}): Promise<Response> => {
+    const headers = new Headers(init.headers);
+    if (deviceId) headers.set('X-Device-Id', deviceId);
+    return fetch(url, { ...init, headers });
+};
+
 export interface MenuItem {
     id: string;
     name: string;
@@ -34,6 +56,10 @@ export interface OrderItem {
     quantity: number;
     notes?: string;
     price: number;
+    // Stamped by the server on each item transition (ISO)
+    placedAt?: string;
+    readyAt?: string;
+    servedAt?: string;
 }
 
 // Strictly matches OrderCreate(BaseModel) in backend/main.py
@@ -49,13 +75,73 @@ export interface Order extends OrderCreate {
     id: string;
     status: 'placed' | 'ready' | 'served' | 'paid' | 'cancelled';
     createdAt: string;
+    updatedAt?: string;
+    revision?: number;
+}
+
+// 202 from POST /api/orders: journaled by the server, reaches the kitchen once its database catches up
+export interface QueuedOrder {
+    queued: true;
+    status: 'queued';
+    idempotencyKey: string;
+    tableId: number;
+    guestName?: string;
+    itemCount: number;
+    journaledAt: string;
+}
+
+const ORDER_RETRIES = 2;
+
+export interface RankedItem {
+    id: string;
+    name: string;
+    category: string;
+    score: number;
+    matchPercentage: number;
+    matchReasons: string[];
+    whyText: string;
+}
+
+export interface BulkResult {
+    updated: number;
+    revision?: number;
+    results: { id: string; ok: boolean; error?: string; status?: string; revision?: number }[];
+}
+
+export interface TableState {
+    tableId: number;
+    orderId: string;
+    guestName?: string;
+    status: string;
+    totalAmount: number;
+    itemCount: number;
+    revision: number;
+    openedAt?: string;
+}
+
+export interface TicketEta {
+    orderId: string;
+    tableId: number;
+    guestName?: string;
+    readyAt: string;
+    readyAtP90: string;
+    readyInSeconds: number;
+    readyInSecondsP90: number;
+    items: { name: string; quantity: number; readyInSeconds: number }[];
+}
+
+export interface KitchenEta {
+    generatedAt: string;
+    stations: number;
+    queueDepth: number;
+    tickets: TicketEta[];
 }
 
 export const api = {
     // GET Menu
     fetchMenu: async (): Promise<MenuItem[]> => {
         try {
-            const res = await fetch(`${API_URL}/api/menu`);
+            const res = await apiFetch(`${API_URL}/api/menu`);
             if (!res.ok) throw new Error(`Fetch menu failed: ${res.statusText}`);
             return await res.json();
         } catch (error) {
@@ -67,7 +153,7 @@ export const api = {
     // PATCH Menu Availability
     toggleItemAvailability: async (itemId: string): Promise<MenuItem> => {
         try {
-            const res = await fetch(`${API_URL}/api/menu/${itemId}/toggle`, {
+            const res = await apiFetch(`${API_URL}/api/menu/${itemId}/toggle`, {
                 method: 'PATCH'
             });
             if (!res.ok) throw new Error("Toggle failed");
@@ -81,7 +167,7 @@ export const api = {
     // POST Add Menu Item
     addMenuItem: async (item: Omit<MenuItem, 'id'>): Promise<MenuItem> => {
         try {
-            const res = await fetch(`${API_URL}/api/menu`, {
+            const res = await apiFetch(`${API_URL}/api/menu`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ ...item, id: '' }), // Send empty ID, backend generates
@@ -97,7 +183,7 @@ export const api = {
     // DELETE Menu Item
     deleteMenuItem: async (id: string): Promise<void> => {
         try {
-            const res = await fetch(`${API_URL}/api/menu/${id}`, {
+            const res = await apiFetch(`${API_URL}/api/menu/${id}`, {
                 method: 'DELETE'
             });
             if (!res.ok) throw new Error("Failed to delete menu item");
@@ -110,7 +196,7 @@ export const api = {
     // UPDATE Menu Item (PATCH)
     updateMenuItem: async (id: string, updates: Partial<MenuItem>): Promise<MenuItem> => {
         try {
-            const res = await fetch(`${API_URL}/api/menu/${id}`, {
+            const res = await apiFetch(`${API_URL}/api/menu/${id}`, {
                 method: 'PATCH',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify(updates),
@@ -123,18 +209,44 @@ export const api = {
         }
     },
 
+    // POST Many menu edits in one request (e.g. end-of-shift stock); per-entry results
+    bulkUpdateMenu: async (updates: { id: string; patch: Partial<MenuItem> }[]): Promise<BulkResult> => {
+        try {
+            const res = await apiFetch(`${API_URL}/api/menu/bulk-update`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ updates }),
+            });
+            if (!res.ok) throw new Error("Failed to bulk update menu");
+            return await res.json();
+        } catch (error) {
+            console.error("API Error (bulkUpdateMenu):", error);
+            throw error;
+        }
+    },
 
 
-    // POST Order
-    placeOrder: async (order: OrderCreate): Promise<Order> => {
+
+    // POST Order (network errors / 5xx are retried with the same Idempotency-Key: never ordered twice)
+    placeOrder: async (order: OrderCreate): Promise<Order | QueuedOrder> => {
         console.log("POSTing order:", order);
+        const idempotencyKey = crypto.randomUUID();
 
         try {
-            const res = await fetch(`${API_URL}/api/orders`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(order),
-            });
+            let res!: Response;
+            for (let attempt = 0; ; attempt++) {
+                try {
+                    res = await apiFetch(`${API_URL}/api/orders`, {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey },
+                        body: JSON.stringify(order),
+                    });
+                    if (res.status < 500 || attempt >= ORDER_RETRIES) break;
+                } catch (networkError) {
+                    if (attempt >= ORDER_RETRIES) throw networkError;
+                }
+                await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+            }
 
             if (!res.ok) {
                 let errorMsg = `Server Error (${res.status})`;
@@ -162,7 +274,7 @@ export const api = {
                 ? `${API_URL}/api/orders?status=${status}`
                 : `${API_URL}/api/orders`;
 
-            const res = await fetch(url);
+            const res = await apiFetch(url);
             if (!res.ok) throw new Error(`Fetch orders failed: ${res.statusText}`);
             return await res.json();
         } catch (error) {
@@ -171,10 +283,81 @@ export const api = {
         }
     },
 
+    // GET Orders changed since a sync cursor (0 = full snapshot; reset = cursor too old, snapshot sent)
+    // view: projection the caller renders ('kitchen' | 'service' | 'summary' | 'full')
+    getOrdersSince: async (since: number, view: string = 'service'): Promise<{ orders: Order[]; cursor: number; reset?: boolean }> => {
+        try {
+            const res = await apiFetch(`${API_URL}/api/orders?since=${since}&view=${view}`);
+            if (!res.ok) throw new Error(`Fetch orders failed: ${res.statusText}`);
+            return await res.json();
+        } catch (error) {
+            console.error("API Error (getOrdersSince):", error);
+            throw error;
+        }
+    },
+
+    // SSE: push notifications for order events (created / merged / ready / served / settled)
+    subscribeOrderEvents: (onEvent: (event: { type: string; tableId?: number; revision?: number }) => void): EventSource => {
+        const source = new EventSource(`${API_URL}/api/events/stream`);
+        const handler = (e: MessageEvent) => {
+            try {
+                onEvent(JSON.parse(e.data));
+            } catch (error) {
+                console.error("API Error (orderEvents):", error);
+            }
+        };
+        ['order.created', 'order.items_merged', 'order.items_ready', 'order.items_served', 'order.updated', 'table.settled', 'orders.bulk_updated', 'resync']
+            .forEach(type => source.addEventListener(type, handler as EventListener));
+        return source;
+    },
+
+    // GET Personalized Ranking (accepts moods/cravings, goals/healthGoals, dietary/dietType, allergens/allergies)
+    getRecommendations: async (prefs: any): Promise<RankedItem[]> => {
+        try {
+            const params = new URLSearchParams({ includeUnavailable: 'true' });
+            const list = (v: any) => (Array.isArray(v) ? v.join(',') : v || '');
+            params.set('moods', list(prefs?.moods || prefs?.cravings));
+            params.set('goals', list(prefs?.goals || prefs?.healthGoals));
+            params.set('diet', prefs?.dietary || prefs?.dietType || 'non-veg');
+            params.set('allergens', list(prefs?.allergens || prefs?.allergies));
+            const res = await apiFetch(`${API_URL}/api/menu/recommendations?${params.toString()}`);
+            if (!res.ok) throw new Error(`Fetch recommendations failed: ${res.statusText}`);
+            return await res.json();
+        } catch (error) {
+            console.error("API Error (getRecommendations):", error);
+            throw error;
+        }
+    },
+
+    // GET Analytics Summary (server-side rollups; optional ISO date range)
+    getAnalyticsSummary: async (start?: string, end?: string): Promise<any> => {
+        try {
+            const params = new URLSearchParams();
+            if (start) params.set('start', start);
+            if (end) params.set('end', end);
+            const res = await apiFetch(`${API_URL}/api/analytics/summary?${params.toString()}`);
+            if (!res.ok) throw new Error(`Fetch analytics failed: ${res.statusText}`);
+            return await res.json();
+        } catch (error) {
+            console.error("API Error (getAnalyticsSummary):", error);
+            throw error;
+        }
+    },
+
+    // Order history export (streamed by the server; use as a download link)
+    exportOrdersUrl: (start?: string, end?: string, format: 'ndjson' | 'csv' = 'csv', gzip: boolean = false, status?: string): string => {
+        const params = new URLSearchParams({ format });
+        if (start) params.set('start', start);
+        if (end) params.set('end', end);
+        if (status) params.set('status', status);
+        if (gzip) params.set('gzip', 'true');
+        return `${API_URL}/api/orders/export?${params.toString()}`;
+    },
+
     // GET Single Order by ID
     getOrder: async (orderId: string): Promise<Order> => {
         try {
-            const res = await fetch(`${API_URL}/api/orders/${orderId}`);
+            const res = await apiFetch(`${API_URL}/api/orders/${orderId}`);
             if (!res.ok) throw new Error(`Fetch single order failed: ${res.statusText}`);
             return await res.json();
         } catch (error) {
@@ -187,7 +370,7 @@ export const api = {
     updateStatus: async (orderId: string, status: string): Promise<Order> => {
         try {
             // Must use query param for status as per backend implementation
-            const res = await fetch(`${API_URL}/api/orders/${orderId}/status?status=${status}`, {
+            const res = await apiFetch(`${API_URL}/api/orders/${orderId}/status?status=${status}`, {
                 method: 'PATCH'
             });
 
@@ -202,10 +385,26 @@ export const api = {
         }
     },
 
+    // POST Bump several tickets at once (kitchen / service); per-entry results
+    bulkUpdateStatus: async (updates: { orderId: string; status: string }[]): Promise<BulkResult> => {
+        try {
+            const res = await apiFetch(`${API_URL}/api/orders/bulk-status`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ updates }),
+            });
+            if (!res.ok) throw new Error(`Bulk status update failed: ${res.statusText}`);
+            return await res.json();
+        } catch (error) {
+            console.error("API Error (bulkUpdateStatus):", error);
+            throw error;
+        }
+    },
+
     // POST Settle Table
     settleTable: async (tableId: string): Promise<{ status: string }> => {
         try {
-            const res = await fetch(`${API_URL}/api/tables/${tableId}/settle`, {
+            const res = await apiFetch(`${API_URL}/api/tables/${tableId}/settle`, {
                 method: 'POST'
             });
 
@@ -220,7 +419,7 @@ export const api = {
     // DELETE Cancel Order
     cancelOrder: async (orderId: string): Promise<void> => {
         try {
-            const res = await fetch(`${API_URL}/api/orders/${orderId}`, {
+            const res = await apiFetch(`${API_URL}/api/orders/${orderId}`, {
                 method: 'DELETE'
             });
 
@@ -237,7 +436,7 @@ export const api = {
     // GET Session Status
     getSession: async (tableId: string): Promise<{ active: boolean; guestName?: string; status?: string }> => {
         try {
-            const res = await fetch(`${API_URL}/api/tables/${tableId}/session`);
+            const res = await apiFetch(`${API_URL}/api/tables/${tableId}/session`);
             if (!res.ok) return { active: false };
             return await res.json();
         } catch (error) {
@@ -246,10 +445,34 @@ export const api = {
         }
     },
 
+    // GET Floor Plan (every table with an active order, served from memory)
+    getTables: async (): Promise<TableState[]> => {
+        try {
+            const res = await apiFetch(`${API_URL}/api/tables`);
+            if (!res.ok) throw new Error(`Fetch tables failed: ${res.statusText}`);
+            return (await res.json()).tables;
+        } catch (error) {
+            console.error("API Error (getTables):", error);
+            throw error;
+        }
+    },
+
+    // --- KITCHEN ---
+    getKitchenEta: async (): Promise<KitchenEta> => {
+        try {
+            const res = await apiFetch(`${API_URL}/api/kitchen/eta`);
+            if (!res.ok) throw new Error(`Fetch kitchen ETA failed: ${res.statusText}`);
+            return await res.json();
+        } catch (error) {
+            console.error("API Error (getKitchenEta):", error);
+            throw error;
+        }
+    },
+
     // --- USER / LOYALTY ROUTES ---
     checkUser: async (phone: string): Promise<{ exists: boolean; name?: string }> => {
         try {
-            const res = await fetch(`${API_URL}/api/users/check`, {
+            const res = await apiFetch(`${API_URL}/api/users/check`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ phone })
@@ -265,7 +488,7 @@ export const api = {
 
     loginUser: async (name: string, phone: string, preferences?: any): Promise<any> => {
         try {
-            const res = await fetch(`${API_URL}/api/users/login`, {
+            const res = await apiFetch(`${API_URL}/api/users/login`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ name, phone, preferences }) // Send Prefs
@@ -280,7 +503,7 @@ export const api = {
 
     getUser: async (userId: string): Promise<any> => {
         try {
-            const res = await fetch(`${API_URL}/api/users/${userId}`);
+            const res = await apiFetch(`${API_URL}/api/users/${userId}`);
             if (!res.ok) throw new Error("Fetch user failed");
             return await res.json();
         } catch (error) {
@@ -291,7 +514,7 @@ export const api = {
 
     addPreference: async (userId: string, preference: string): Promise<any> => {
         try {
-            const res = await fetch(`${API_URL}/api/users/${userId}/preferences`, {
+            const res = await apiFetch(`${API_URL}/api/users/${userId}/preferences`, {
                 method: 'PUT',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ preference })